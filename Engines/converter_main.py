@@ -1,4 +1,5 @@
 ## Main script for the compiler
+import io
 import os
 import sys
 import runpy
@@ -7,7 +8,9 @@ import logging
 import traceback
 import importlib
 import importlib.util
-from lib.util import ijoin
+import contextlib
+import concurrent.futures
+from lib.util import ijoin, indexDirectoryTree
 
 
 # Check if the dependencies are installed
@@ -73,10 +76,15 @@ def run_type_request(argv):
 		return argv[1]
 	
 	print("Usage:")
-	print("  compiler_main <run type>")
+	print("  compiler_main <run type> [options]")
 	print("run type:")
 	print("  0                         convert player folders")
 	print("  1                         convert entire exports")
+	print("options:")
+	print("  --jobs N                  convert N folders at the same time (0 = one per cpu core)")
+	print("  --combined-save           make a single EDIT00000000 with the players of all the exports")
+	print("  --compress-models N       write zlib compressed .model files with compression level N (1-9)")
+	print("  --texture-cache-size N    keep up to N MB of converted textures between runs (0 = no cache, default 1024)")
 	print("")
 	
 	# Ask the user for a run type, read a single character input
@@ -91,9 +99,149 @@ def run_type_request(argv):
 	return run_type
 
 
-def convert_players():
+def options_request(argv):
+	options = {
+		"jobs": 1,
+		"combined_save": False,
+		"model_compression_level": None,
+		"texture_cache_size": None,
+	}
+	
+	# Options come after the run type
+	i = 2
+	while i < len(argv):
+		if argv[i] in ["--jobs", "-j"] and i + 1 < len(argv) and argv[i + 1].isdigit():
+			options["jobs"] = int(argv[i + 1])
+			if options["jobs"] == 0:
+				options["jobs"] = os.cpu_count() or 1
+			i += 2
+		elif argv[i] == "--combined-save":
+			options["combined_save"] = True
+			i += 1
+		elif argv[i] == "--compress-models" and i + 1 < len(argv) and argv[i + 1] in [str(level) for level in range(1, 10)]:
+			options["model_compression_level"] = int(argv[i + 1])
+			i += 2
+		elif argv[i] == "--texture-cache-size" and i + 1 < len(argv) and argv[i + 1].isdigit():
+			options["texture_cache_size"] = int(argv[i + 1]) * 1024 * 1024
+			i += 2
+		else:
+			print(f"- Ignoring unknown option \"{argv[i]}\"")
+			i += 1
+	
+	return options
+
+
+def print_summary(results):
+	succeeded = [name for (name, success) in results if success]
+	failed = [name for (name, success) in results if not success]
+	
+	print("-")
+	print(f"- Converted {len(succeeded)} of {len(results)} folders")
+	if len(succeeded) > 0:
+		print("- Succeeded:")
+		for name in sorted(succeeded):
+			print(f"-   {name}")
+	if len(failed) > 0:
+		print("- Failed:")
+		for name in sorted(failed):
+			print(f"-   {name}")
+		print("- The errors have been saved to error.log")
+
+
+# Runs in a worker process. The console output of the conversion is returned instead of printed,
+# so that the output of folders converted at the same time doesn't get mixed up.
+# The value returned by convert_function is passed back as well.
+def convert_folder_job(convert_function, folder, *args):
+	output = io.StringIO()
+	success = True
+	result = None
+	
+	with contextlib.redirect_stdout(output):
+		try:
+			result = convert_function(folder, *args)
+		except Exception:
+			success = False
+			print(f"ERROR: Conversion of \"{folder}\" failed")
+			traceback.print_exc(file=output)
+	
+	return (folder, success, output.getvalue(), result)
+
+
+def convert_folders_in_pool(jobs, convert_function, folders, *args, initializer=None, initargs=()):
+	print(f"- Using {jobs} worker processes")
+	print("-")
+	
+	results = []
+	folder_results = {}
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as executor:
+		futures = [
+			executor.submit(convert_folder_job, convert_function, folder, *args)
+			for folder in folders
+		]
+		
+		# Print the output of each folder in one go as soon as it's done
+		for future in concurrent.futures.as_completed(futures):
+			(folder, success, output, result) = future.result()
+			print(output, end="")
+			if not success:
+				logging.getLogger(__name__).error(output)
+			else:
+				folder_results[folder] = result
+			results.append((folder, success))
+	
+	print_summary(results)
+	
+	# Return the results of the folders that were converted successfully
+	return folder_results
+
+
+def convert_player_folder(player_folder, output_folder, model_compression_level=None, texture_cache_size=None, texture_conversion_workers=None):
 	from lib.convertFaceFolder import convertFaceFolder
+	from lib.material import setTextureCacheSize, setTextureConversionWorkers
+	
+	if texture_cache_size is not None:
+		setTextureCacheSize(texture_cache_size)
+	if texture_conversion_workers is not None:
+		setTextureConversionWorkers(texture_conversion_workers)
+	
+	player_folder_path = os.path.join("players_to_convert", player_folder)
+	
+	# Everything in the player folder gets looked up many times, so list it all once
+	indexDirectoryTree(player_folder_path)
+	
+	folders_to_convert = []
+	
+	# For each folder in the player folder
+	for folder in os.listdir(player_folder_path):
+		if folder.lower() == 'common':
+			continue
+		
+		folder_path = os.path.join(player_folder_path, folder)
+		if os.path.isdir(folder_path):
+			# Add it to the list of folders to convert
+			folders_to_convert.append(folder_path)
+	
+	# Create the player destination folder after deleting it if it already exists
+	player_destination_folder = os.path.join(output_folder, player_folder)
+	if os.path.isdir(player_destination_folder):
+		shutil.rmtree(player_destination_folder)
+	os.mkdir(player_destination_folder)
+	
+	destination_face_folder = os.path.join(player_destination_folder, "Face")
+	os.mkdir(destination_face_folder)
+	
+	destination_common_folder = os.path.join(player_destination_folder, "Common")
+	os.mkdir(destination_common_folder)
 	
+	# Convert the player folder
+	print(f"- {player_folder}")
+	convertFaceFolder(folders_to_convert, destination_face_folder, destination_common_folder, model_compression_level)
+	
+	if len(os.listdir(destination_common_folder)) == 0:
+		os.rmdir(destination_common_folder)
+
+
+def convert_players(options):
 	print("- Converting player folders...")
 	print("-")
 	
@@ -102,50 +250,58 @@ def convert_players():
 	if not os.path.isdir(OUTPUT_FOLDER):
 		os.mkdir(OUTPUT_FOLDER)
 	
-	# For each player folder in the "players_to_convert" folder
+	# Make a list of the player folders in the "players_to_convert" folder
+	player_folders = []
 	for player_folder in os.listdir("players_to_convert"):
 		if player_folder.lower() == 'common':
 			continue
 		
 		player_folder_path = os.path.join("players_to_convert", player_folder)
-		if not os.path.isdir(player_folder_path):
-			continue
-		
-		folders_to_convert = []
-		
-		# For each folder in the player folder
-		for folder in os.listdir(player_folder_path):
-			if folder.lower() == 'common':
-				continue
-			
-			folder_path = os.path.join(player_folder_path, folder)
-			if os.path.isdir(folder_path):
-				# Add it to the list of folders to convert
-				folders_to_convert.append(folder_path)
-		
-		# Create the player destination folder after deleting it if it already exists
-		player_destination_folder = os.path.join(OUTPUT_FOLDER, player_folder)
-		if os.path.isdir(player_destination_folder):
-			shutil.rmtree(player_destination_folder)
-		os.mkdir(player_destination_folder)
-		
-		destination_face_folder = os.path.join(player_destination_folder, "Face")
-		os.mkdir(destination_face_folder)
-		
-		destination_common_folder = os.path.join(player_destination_folder, "Common")
-		os.mkdir(destination_common_folder)
-		
-		# Convert the player folder
-		print(f"- {player_folder}")
-		convertFaceFolder(folders_to_convert, destination_face_folder, destination_common_folder)
-		
-		if len(os.listdir(destination_common_folder)) == 0:
-			os.rmdir(destination_common_folder)
+		if os.path.isdir(player_folder_path):
+			player_folders.append(player_folder)
+	
+	if options["jobs"] <= 1:
+		for player_folder in player_folders:
+			convert_player_folder(player_folder, OUTPUT_FOLDER, options["model_compression_level"], options["texture_cache_size"])
+		return
+	
+	# Every player folder is independent, so convert several of them at the same time.
+	# The worker processes already keep the cpu cores busy, so each converts its textures on one thread.
+	convert_folders_in_pool(options["jobs"], convert_player_folder, player_folders, OUTPUT_FOLDER, options["model_compression_level"], options["texture_cache_size"], 1)
+
 
+# Decrypted save data shared by all the teams converted in this process,
+# so that the saves only get decrypted once per run instead of once per team
+shared_save_data = None
 
-def convert_teams():
+def set_shared_save_data(save_data):
+	global shared_save_data
+	shared_save_data = save_data
+
+
+def convert_export_folder(export_folder, input_savefile_path, output_folder, write_save, model_compression_level=None, texture_cache_size=None, texture_conversion_workers=None):
 	from lib.convertTeam import convertTeam
+	from lib.material import setTextureCacheSize, setTextureConversionWorkers
+	
+	if texture_cache_size is not None:
+		setTextureCacheSize(texture_cache_size)
+	if texture_conversion_workers is not None:
+		setTextureConversionWorkers(texture_conversion_workers)
+	
+	export_folder_path = os.path.join("exports_to_convert", export_folder)
 	
+	# Create the export destination folder after deleting it if it already exists
+	export_destination_folder = os.path.join(output_folder, export_folder)
+	if os.path.isdir(export_destination_folder):
+		shutil.rmtree(export_destination_folder)
+	os.mkdir(export_destination_folder)
+	
+	# Convert the export folder
+	print(f"- {export_folder}")
+	return convertTeam(export_folder_path, input_savefile_path, export_destination_folder, shared_save_data, write_save, model_compression_level)
+
+
+def convert_teams(options):
 	# Check if the "EDIT00000000" file exists in the "exports_to_convert" folder
 	input_savefile_path = ijoin("exports_to_convert", "EDIT00000000")
 	if input_savefile_path is None:
@@ -164,21 +320,49 @@ def convert_teams():
 	if not os.path.isdir(OUTPUT_FOLDER):
 		os.mkdir(OUTPUT_FOLDER)
 	
-	# For each export folder in the "exports_to_convert" folder
+	# Make a list of the export folders in the "exports_to_convert" folder
+	export_folders = []
 	for export_folder in os.listdir("exports_to_convert"):
 		export_folder_path = os.path.join("exports_to_convert", export_folder)
-		if not os.path.isdir(export_folder_path):
-			continue
+		if os.path.isdir(export_folder_path):
+			export_folders.append(export_folder)
+	
+	print("- Loading save data")
+	print("-")
+	from lib.convertTeam import loadSaveData, saveTeamPlayers
+	set_shared_save_data(loadSaveData(input_savefile_path))
+	
+	# With a combined save, the teams don't get their own savefile; their players are collected instead
+	write_save = not options["combined_save"]
+	
+	if options["jobs"] <= 1:
+		team_players = {}
+		for export_folder in export_folders:
+			team_players[export_folder] = convert_export_folder(export_folder, input_savefile_path, OUTPUT_FOLDER, write_save, options["model_compression_level"], options["texture_cache_size"])
+	else:
+		# Convert several export folders at the same time, one per worker process.
+		# The workers get a copy of the already decrypted save data when they start,
+		# and convert their textures on one thread each, since they already keep the cpu cores busy.
+		team_players = convert_folders_in_pool(
+			options["jobs"], convert_export_folder, export_folders, input_savefile_path, OUTPUT_FOLDER, write_save, options["model_compression_level"], options["texture_cache_size"], 1,
+			initializer=set_shared_save_data, initargs=(shared_save_data,),
+		)
+	
+	if options["combined_save"]:
+		print("-")
+		print("- Creating combined save")
 		
-		# Create the export destination folder after deleting it if it already exists
-		export_destination_folder = os.path.join(OUTPUT_FOLDER, export_folder)
-		if os.path.isdir(export_destination_folder):
-			shutil.rmtree(export_destination_folder)
-		os.mkdir(export_destination_folder)
+		players = {}
+		for export_folder in export_folders:
+			if export_folder not in team_players:
+				continue
+			for player_id in team_players[export_folder]:
+				if player_id in players:
+					print(f"- WARNING: Player {player_id} from export \"{export_folder}\" was already converted from another export, overwriting it")
+			players.update(team_players[export_folder])
 		
-		# Convert the export folder
-		print(f"- {export_folder}")
-		convertTeam(export_folder_path, input_savefile_path, export_destination_folder)
+		# All the teams go into one copy of the template, which only needs to be encrypted once
+		saveTeamPlayers(shared_save_data, players, os.path.join(OUTPUT_FOLDER, "EDIT00000000"))
 
 
 if __name__ == "__main__":
@@ -203,6 +387,7 @@ if __name__ == "__main__":
 	
 	# Check if an argument has been passed and its value is between 0 and 1
 	run_type = run_type_request(sys.argv)
+	options = options_request(sys.argv)
 	
 	# Run the main function with the logger
 	with printing_exc(file_=LoggerAsFile(logger)):
@@ -210,9 +395,9 @@ if __name__ == "__main__":
 		os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 		
 		if run_type == "0":
-			convert_players()
+			convert_players(options)
 		else:
-			convert_teams()
+			convert_teams(options)
 	
 	# Exit the script
 	print("-")
@@ -8,7 +8,7 @@ cd /D "%~dp0\.."
 REM - Check if python is installed and was added to the PATH
 call .\Engines\python_check
 
-REM - Check if python is installed and was added to the PATH
+REM - Warn if imagemagick is missing, as a few texture formats need it
 call .\Engines\imagemagick_check
 
 REM - Set the running type from the first argument this script was called with
@@ -17,8 +17,8 @@ set running_type=%1
 REM - Grab the number from the first character from the running type
 set running_type_num=%running_type:~0,1%
 
-REM - Invoke the main compiler
-call py -3 .\Engines\converter_main.py %running_type_num%
+REM - Invoke the main compiler, passing along any options after the running type
+call py -3 .\Engines\converter_main.py %running_type_num% %2 %3 %4 %5 %6 %7 %8 %9
 
 
 REM - Pause if the compiler returned an error
@@ -1,4 +1,6 @@
 REM - Script to check if imagemagick is in the PATH and that its version is 7.1 or higher
+REM - The converter only needs it for BC7 texture arrays and textures in formats Pillow can't read,
+REM - so a missing imagemagick is only a warning
 
 setlocal EnableDelayedExpansion
 
@@ -17,25 +19,7 @@ for /f "tokens=*" %%A in ('magick -version 2^>nul') do (
 )
 
 if not defined imagemagick_version_ok (
-
-  echo -
-  echo - ImageMagick 7.1+ is missing from your pc, please install it
-  echo -
-  echo - If it is already installed, reinstall it, and make sure to check
-  echo - the "Add application directory to your system path" checkbox
-  echo -
-  echo Press any key to open the ImageMagick download webpage...
-
-  pause >nul
-
-  start "" "https://imagemagick.org/script/download.php#windows"
-
-  timeout /t 5 >nul
-
-  echo -
-  echo Press any key to resume the compiler after installing or fixing ImageMagick...
-
-  pause >nul
-
-  .\Engines\imagemagick_check
+  echo - Warning: ImageMagick 7.1+ not found, only needed for BC7 texture arrays and textures Pillow can't read
 )
+
+endlocal
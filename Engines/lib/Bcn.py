@@ -0,0 +1,390 @@
+import numpy
+
+#
+# Block compression codecs, working on many 4x4 pixel blocks at once.
+#
+# Compressed blocks are uint8 arrays with one row of 16 bytes per block.
+# Decoded blocks are uint8 arrays of shape (blockCount, 16, 4), holding the RGBA values
+# of the 16 pixels of every block in row-major order.
+#
+
+#
+# BC7
+#
+
+bc7Partitions2 = numpy.array([
+	0,0,1,1,0,0,1,1,0,0,1,1,0,0,1,1,  0,0,0,1,0,0,0,1,0,0,0,1,0,0,0,1,  0,1,1,1,0,1,1,1,0,1,1,1,0,1,1,1,  0,0,0,1,0,0,1,1,0,0,1,1,0,1,1,1,
+	0,0,0,0,0,0,0,1,0,0,0,1,0,0,1,1,  0,0,1,1,0,1,1,1,0,1,1,1,1,1,1,1,  0,0,0,1,0,0,1,1,0,1,1,1,1,1,1,1,  0,0,0,0,0,0,0,1,0,0,1,1,0,1,1,1,
+	0,0,0,0,0,0,0,0,0,0,0,1,0,0,1,1,  0,0,1,1,0,1,1,1,1,1,1,1,1,1,1,1,  0,0,0,0,0,0,0,1,0,1,1,1,1,1,1,1,  0,0,0,0,0,0,0,0,0,0,0,1,0,1,1,1,
+	0,0,0,1,0,1,1,1,1,1,1,1,1,1,1,1,  0,0,0,0,0,0,0,0,1,1,1,1,1,1,1,1,  0,0,0,0,1,1,1,1,1,1,1,1,1,1,1,1,  0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,1,
+	0,0,0,0,1,0,0,0,1,1,1,0,1,1,1,1,  0,1,1,1,0,0,0,1,0,0,0,0,0,0,0,0,  0,0,0,0,0,0,0,0,1,0,0,0,1,1,1,0,  0,1,1,1,0,0,1,1,0,0,0,1,0,0,0,0,
+	0,0,1,1,0,0,0,1,0,0,0,0,0,0,0,0,  0,0,0,0,1,0,0,0,1,1,0,0,1,1,1,0,  0,0,0,0,0,0,0,0,1,0,0,0,1,1,0,0,  0,1,1,1,0,0,1,1,0,0,1,1,0,0,0,1,
+	0,0,1,1,0,0,0,1,0,0,0,1,0,0,0,0,  0,0,0,0,1,0,0,0,1,0,0,0,1,1,0,0,  0,1,1,0,0,1,1,0,0,1,1,0,0,1,1,0,  0,0,1,1,0,1,1,0,0,1,1,0,1,1,0,0,
+	0,0,0,1,0,1,1,1,1,1,1,0,1,0,0,0,  0,0,0,0,1,1,1,1,1,1,1,1,0,0,0,0,  0,1,1,1,0,0,0,1,1,0,0,0,1,1,1,0,  0,0,1,1,1,0,0,1,1,0,0,1,1,1,0,0,
+	0,1,0,1,0,1,0,1,0,1,0,1,0,1,0,1,  0,0,0,0,1,1,1,1,0,0,0,0,1,1,1,1,  0,1,0,1,1,0,1,0,0,1,0,1,1,0,1,0,  0,0,1,1,0,0,1,1,1,1,0,0,1,1,0,0,
+	0,0,1,1,1,1,0,0,0,0,1,1,1,1,0,0,  0,1,0,1,0,1,0,1,1,0,1,0,1,0,1,0,  0,1,1,0,1,0,0,1,0,1,1,0,1,0,0,1,  0,1,0,1,1,0,1,0,1,0,1,0,0,1,0,1,
+	0,1,1,1,0,0,1,1,1,1,0,0,1,1,1,0,  0,0,0,1,0,0,1,1,1,1,0,0,1,0,0,0,  0,0,1,1,0,0,1,0,0,1,0,0,1,1,0,0,  0,0,1,1,1,0,1,1,1,1,0,1,1,1,0,0,
+	0,1,1,0,1,0,0,1,1,0,0,1,0,1,1,0,  0,0,1,1,1,1,0,0,1,1,0,0,0,0,1,1,  0,1,1,0,0,1,1,0,1,0,0,1,1,0,0,1,  0,0,0,0,0,1,1,0,0,1,1,0,0,0,0,0,
+	0,1,0,0,1,1,1,0,0,1,0,0,0,0,0,0,  0,0,1,0,0,1,1,1,0,0,1,0,0,0,0,0,  0,0,0,0,0,0,1,0,0,1,1,1,0,0,1,0,  0,0,0,0,0,1,0,0,1,1,1,0,0,1,0,0,
+	0,1,1,0,1,1,0,0,1,0,0,1,0,0,1,1,  0,0,1,1,0,1,1,0,1,1,0,0,1,0,0,1,  0,1,1,0,0,0,1,1,1,0,0,1,1,1,0,0,  0,0,1,1,1,0,0,1,1,1,0,0,0,1,1,0,
+	0,1,1,0,1,1,0,0,1,1,0,0,1,0,0,1,  0,1,1,0,0,0,1,1,0,0,1,1,1,0,0,1,  0,1,1,1,1,1,1,0,1,0,0,0,0,0,0,1,  0,0,0,1,1,0,0,0,1,1,1,0,0,1,1,1,
+	0,0,0,0,1,1,1,1,0,0,1,1,0,0,1,1,  0,0,1,1,0,0,1,1,1,1,1,1,0,0,0,0,  0,0,1,0,0,0,1,0,1,1,1,0,1,1,1,0,  0,1,0,0,0,1,0,0,0,1,1,1,0,1,1,1,
+], dtype = numpy.intp).reshape((64, 16))
+
+bc7Partitions3 = numpy.array([
+	0,0,1,1,0,0,1,1,0,2,2,1,2,2,2,2,  0,0,0,1,0,0,1,1,2,2,1,1,2,2,2,1,  0,0,0,0,2,0,0,1,2,2,1,1,2,2,1,1,  0,2,2,2,0,0,2,2,0,0,1,1,0,1,1,1,
+	0,0,0,0,0,0,0,0,1,1,2,2,1,1,2,2,  0,0,1,1,0,0,1,1,0,0,2,2,0,0,2,2,  0,0,2,2,0,0,2,2,1,1,1,1,1,1,1,1,  0,0,1,1,0,0,1,1,2,2,1,1,2,2,1,1,
+	0,0,0,0,0,0,0,0,1,1,1,1,2,2,2,2,  0,0,0,0,1,1,1,1,1,1,1,1,2,2,2,2,  0,0,0,0,1,1,1,1,2,2,2,2,2,2,2,2,  0,0,1,2,0,0,1,2,0,0,1,2,0,0,1,2,
+	0,1,1,2,0,1,1,2,0,1,1,2,0,1,1,2,  0,1,2,2,0,1,2,2,0,1,2,2,0,1,2,2,  0,0,1,1,0,1,1,2,1,1,2,2,1,2,2,2,  0,0,1,1,2,0,0,1,2,2,0,0,2,2,2,0,
+	0,0,0,1,0,0,1,1,0,1,1,2,1,1,2,2,  0,1,1,1,0,0,1,1,2,0,0,1,2,2,0,0,  0,0,0,0,1,1,2,2,1,1,2,2,1,1,2,2,  0,0,2,2,0,0,2,2,0,0,2,2,1,1,1,1,
+	0,1,1,1,0,1,1,1,0,2,2,2,0,2,2,2,  0,0,0,1,0,0,0,1,2,2,2,1,2,2,2,1,  0,0,0,0,0,0,1,1,0,1,2,2,0,1,2,2,  0,0,0,0,1,1,0,0,2,2,1,0,2,2,1,0,
+	0,1,2,2,0,1,2,2,0,0,1,1,0,0,0,0,  0,0,1,2,0,0,1,2,1,1,2,2,2,2,2,2,  0,1,1,0,1,2,2,1,1,2,2,1,0,1,1,0,  0,0,0,0,0,1,1,0,1,2,2,1,1,2,2,1,
+	0,0,2,2,1,1,0,2,1,1,0,2,0,0,2,2,  0,1,1,0,0,1,1,0,2,0,0,2,2,2,2,2,  0,0,1,1,0,1,2,2,0,1,2,2,0,0,1,1,  0,0,0,0,2,0,0,0,2,2,1,1,2,2,2,1,
+	0,0,0,0,0,0,0,2,1,1,2,2,1,2,2,2,  0,2,2,2,0,0,2,2,0,0,1,2,0,0,1,1,  0,0,1,1,0,0,1,2,0,0,2,2,0,2,2,2,  0,1,2,0,0,1,2,0,0,1,2,0,0,1,2,0,
+	0,0,0,0,1,1,1,1,2,2,2,2,0,0,0,0,  0,1,2,0,1,2,0,1,2,0,1,2,0,1,2,0,  0,1,2,0,2,0,1,2,1,2,0,1,0,1,2,0,  0,0,1,1,2,2,0,0,1,1,2,2,0,0,1,1,
+	0,0,1,1,1,1,2,2,2,2,0,0,0,0,1,1,  0,1,0,1,0,1,0,1,2,2,2,2,2,2,2,2,  0,0,0,0,0,0,0,0,2,1,2,1,2,1,2,1,  0,0,2,2,1,1,2,2,0,0,2,2,1,1,2,2,
+	0,0,2,2,0,0,1,1,0,0,2,2,0,0,1,1,  0,2,2,0,1,2,2,1,0,2,2,0,1,2,2,1,  0,1,0,1,2,2,2,2,2,2,2,2,0,1,0,1,  0,0,0,0,2,1,2,1,2,1,2,1,2,1,2,1,
+	0,1,0,1,0,1,0,1,0,1,0,1,2,2,2,2,  0,2,2,2,0,1,1,1,0,2,2,2,0,1,1,1,  0,0,0,2,1,1,1,2,0,0,0,2,1,1,1,2,  0,0,0,0,2,1,1,2,2,1,1,2,2,1,1,2,
+	0,2,2,2,0,1,1,1,0,1,1,1,0,2,2,2,  0,0,0,2,1,1,1,2,1,1,1,2,0,0,0,2,  0,1,1,0,0,1,1,0,0,1,1,0,2,2,2,2,  0,0,0,0,0,0,0,0,2,1,1,2,2,1,1,2,
+	0,1,1,0,0,1,1,0,2,2,2,2,2,2,2,2,  0,0,2,2,0,0,1,1,0,0,1,1,0,0,2,2,  0,0,2,2,1,1,2,2,1,1,2,2,0,0,2,2,  0,0,0,0,0,0,0,0,0,0,0,0,2,1,1,2,
+	0,0,0,2,0,0,0,1,0,0,0,2,0,0,0,1,  0,2,2,2,1,2,2,2,0,2,2,2,1,2,2,2,  0,1,0,1,2,2,2,2,2,2,2,2,2,2,2,2,  0,1,1,1,2,0,1,1,2,2,0,1,2,2,2,0,
+], dtype = numpy.intp).reshape((64, 16))
+
+# The pixel of the second subset whose index is stored with one bit less, for each partition
+bc7Anchors2 = numpy.array([
+	15,15,15,15,15,15,15,15,  15,15,15,15,15,15,15,15,
+	15, 2, 8, 2, 2, 8, 8,15,   2, 8, 2, 2, 8, 8, 2, 2,
+	15,15, 6, 8, 2, 8,15,15,   2, 8, 2, 2, 2,15,15, 6,
+	 6, 2, 6, 8,15,15, 2, 2,  15,15,15,15,15, 2, 2,15,
+], dtype = numpy.intp)
+
+# The same for the second and third subset of three-subset partitions
+bc7Anchors3Second = numpy.array([
+	 3, 3,15,15, 8, 3,15,15,   8, 8, 6, 6, 6, 5, 3, 3,
+	 3, 3, 8,15, 3, 3, 6,10,   5, 8, 8, 6, 8, 5,15,15,
+	 8,15, 3, 5, 6,10, 8,15,  15, 3,15, 5,15,15,15,15,
+	 3,15, 5, 5, 5, 8, 5,10,   5,10, 8,13,15,12, 3, 3,
+], dtype = numpy.intp)
+
+bc7Anchors3Third = numpy.array([
+	15, 8, 8, 3,15,15, 3, 8,  15,15,15,15,15,15,15, 8,
+	15, 8,15, 3,15, 8,15, 8,   3,15, 6,10,15,15,10, 8,
+	15, 3,15,10,10, 8, 9,10,   6,15, 8,15, 3, 6, 6, 8,
+	15, 3,15,15,15,15,15,15,  15,15,15,15, 3,15,15, 8,
+], dtype = numpy.intp)
+
+# Interpolation weights out of 64, by index size in bits
+bc7Weights = {
+	2: numpy.array([0, 21, 43, 64], dtype = numpy.int32),
+	3: numpy.array([0, 9, 18, 27, 37, 46, 55, 64], dtype = numpy.int32),
+	4: numpy.array([0, 4, 9, 13, 17, 21, 26, 30, 34, 38, 43, 47, 51, 55, 60, 64], dtype = numpy.int32),
+}
+
+class Bc7Mode:
+	def __init__(self, subsetCount, partitionBits, rotationBits, indexSelectionBits, colorBits, alphaBits, endpointPBits, sharedPBits, indexBits, secondaryIndexBits):
+		self.subsetCount = subsetCount
+		self.partitionBits = partitionBits
+		self.rotationBits = rotationBits
+		self.indexSelectionBits = indexSelectionBits
+		self.colorBits = colorBits
+		self.alphaBits = alphaBits
+		self.endpointPBits = endpointPBits
+		self.sharedPBits = sharedPBits
+		self.indexBits = indexBits
+		self.secondaryIndexBits = secondaryIndexBits
+
+bc7Modes = [
+	Bc7Mode(3, 4, 0, 0, 4, 0, True,  False, 3, 0),
+	Bc7Mode(2, 6, 0, 0, 6, 0, False, True,  3, 0),
+	Bc7Mode(3, 6, 0, 0, 5, 0, False, False, 2, 0),
+	Bc7Mode(2, 6, 0, 0, 7, 0, True,  False, 2, 0),
+	Bc7Mode(1, 0, 2, 1, 5, 6, False, False, 2, 3),
+	Bc7Mode(1, 0, 2, 0, 7, 8, False, False, 2, 2),
+	Bc7Mode(1, 0, 0, 0, 7, 7, True,  False, 4, 0),
+	Bc7Mode(2, 6, 0, 0, 5, 5, True,  False, 2, 0),
+]
+
+#
+# bits holds the bits of every block, least significant bit first.
+#
+def bitField(bits, offset, count):
+	return bits[:, offset : offset + count].astype(numpy.int32) @ (1 << numpy.arange(count, dtype = numpy.int32))
+
+#
+# Reads the 16 indices of every block, which take indexBits bits each,
+# except for the anchor pixels of each subset which take one bit less.
+#
+def bc7IndexFields(bits, offset, indexBits, isAnchor):
+	widths = indexBits - isAnchor.astype(numpy.int32)
+	offsets = offset + numpy.cumsum(widths, axis = 1) - widths
+	positions = numpy.minimum(offsets[:, :, None] + numpy.arange(indexBits), bits.shape[1] - 1)
+	values = numpy.take_along_axis(bits, positions.reshape((len(bits), -1)), axis = 1).reshape(positions.shape).astype(numpy.int32)
+	values[numpy.arange(indexBits) >= widths[:, :, None]] = 0
+	return values @ (1 << numpy.arange(indexBits, dtype = numpy.int32))
+
+def expandBits(values, bitCount):
+	return (values << (8 - bitCount)) | (values >> (2 * bitCount - 8))
+
+def decodeBc7Mode(bits, modeNumber, mode):
+	blockCount = len(bits)
+	offset = modeNumber + 1
+	def read(count):
+		nonlocal offset
+		value = bitField(bits, offset, count)
+		offset += count
+		return value
+	
+	partition = read(mode.partitionBits)
+	rotation = read(mode.rotationBits)
+	indexSelection = read(mode.indexSelectionBits)
+	
+	#
+	# Endpoints are stored one channel at a time, followed by their p-bits
+	#
+	endpointCount = 2 * mode.subsetCount
+	endpoints = numpy.zeros((blockCount, endpointCount, 4), dtype = numpy.int32)
+	for channel in range(3):
+		for endpoint in range(endpointCount):
+			endpoints[:, endpoint, channel] = read(mode.colorBits)
+	if mode.alphaBits > 0:
+		for endpoint in range(endpointCount):
+			endpoints[:, endpoint, 3] = read(mode.alphaBits)
+	
+	colorBits = mode.colorBits
+	alphaBits = mode.alphaBits
+	if mode.endpointPBits:
+		pBits = numpy.stack([read(1) for endpoint in range(endpointCount)], axis = 1)
+	elif mode.sharedPBits:
+		pBits = numpy.repeat(numpy.stack([read(1) for subset in range(mode.subsetCount)], axis = 1), 2, axis = 1)
+	else:
+		pBits = None
+	if pBits is not None:
+		endpoints = (endpoints << 1) | pBits[:, :, None]
+		colorBits += 1
+		alphaBits += 1
+	
+	endpoints[:, :, 0:3] = expandBits(endpoints[:, :, 0:3], colorBits)
+	if mode.alphaBits > 0:
+		endpoints[:, :, 3] = expandBits(endpoints[:, :, 3], alphaBits)
+	else:
+		endpoints[:, :, 3] = 255
+	
+	#
+	# Indices
+	#
+	isAnchor = numpy.zeros((blockCount, 16), dtype = bool)
+	isAnchor[:, 0] = True
+	if mode.subsetCount == 1:
+		subsets = numpy.zeros((blockCount, 16), dtype = numpy.intp)
+	elif mode.subsetCount == 2:
+		subsets = bc7Partitions2[partition]
+		isAnchor[numpy.arange(blockCount), bc7Anchors2[partition]] = True
+	else:
+		subsets = bc7Partitions3[partition]
+		isAnchor[numpy.arange(blockCount), bc7Anchors3Second[partition]] = True
+		isAnchor[numpy.arange(blockCount), bc7Anchors3Third[partition]] = True
+	
+	indices = bc7IndexFields(bits, offset, mode.indexBits, isAnchor)
+	offset += 16 * mode.indexBits - mode.subsetCount
+	colorWeights = bc7Weights[mode.indexBits][indices]
+	alphaWeights = colorWeights
+	
+	if mode.secondaryIndexBits > 0:
+		isSecondaryAnchor = numpy.zeros((blockCount, 16), dtype = bool)
+		isSecondaryAnchor[:, 0] = True
+		secondaryIndices = bc7IndexFields(bits, offset, mode.secondaryIndexBits, isSecondaryAnchor)
+		secondaryWeights = bc7Weights[mode.secondaryIndexBits][secondaryIndices]
+		
+		# The index selection bit swaps which indices are used for color and which for alpha
+		swapIndices = (indexSelection == 1)[:, None]
+		(colorWeights, alphaWeights) = (
+			numpy.where(swapIndices, secondaryWeights, colorWeights),
+			numpy.where(swapIndices, colorWeights, secondaryWeights),
+		)
+	
+	#
+	# Interpolate
+	#
+	endpoint0 = numpy.take_along_axis(endpoints, (2 * subsets)[:, :, None], axis = 1)
+	endpoint1 = numpy.take_along_axis(endpoints, (2 * subsets + 1)[:, :, None], axis = 1)
+	weights = numpy.stack([colorWeights, colorWeights, colorWeights, alphaWeights], axis = 2)
+	pixels = ((64 - weights) * endpoint0 + weights * endpoint1 + 32) >> 6
+	
+	# Rotation swaps alpha with one of the color channels
+	for channel in range(3):
+		rotated = rotation == channel + 1
+		if rotated.any():
+			rotatedPixels = pixels[rotated]
+			rotatedPixels[:, :, [channel, 3]] = rotatedPixels[:, :, [3, channel]]
+			pixels[rotated] = rotatedPixels
+	
+	return pixels.astype(numpy.uint8)
+
+def decodeBc7Blocks(blocks):
+	bits = numpy.unpackbits(blocks, axis = 1, bitorder = 'little')
+	pixels = numpy.zeros((len(blocks), 16, 4), dtype = numpy.uint8)
+	
+	# The mode of a block is the number of zero bits before its first one bit.
+	# Blocks without any of the first 8 bits set are invalid, and decode to transparent black.
+	modes = numpy.argmax(bits[:, 0:8], axis = 1)
+	modes[bits[:, 0:8].max(axis = 1) == 0] = len(bc7Modes)
+	
+	for (modeNumber, mode) in enumerate(bc7Modes):
+		selection = numpy.nonzero(modes == modeNumber)[0]
+		if len(selection) > 0:
+			pixels[selection] = decodeBc7Mode(bits[selection], modeNumber, mode)
+	return pixels
+
+#
+# BC3, also known as DXT5
+#
+
+def encodeBc3AlphaBlocks(alphas):
+	alphas = alphas.astype(numpy.int32)
+	alpha0 = alphas.max(axis = 1)
+	alpha1 = alphas.min(axis = 1)
+	
+	# With alpha0 > alpha1, the palette interpolates 6 values between the two
+	palette = numpy.empty((len(alphas), 8), dtype = numpy.int32)
+	palette[:, 0] = alpha0
+	palette[:, 1] = alpha1
+	for i in range(1, 7):
+		palette[:, i + 1] = ((7 - i) * alpha0 + i * alpha1 + 3) // 7
+	codes = numpy.argmin(numpy.abs(alphas[:, :, None] - palette[:, None, :]), axis = 2)
+	codes[alpha0 == alpha1] = 0
+	
+	packedCodes = (codes.astype(numpy.uint64) << (3 * numpy.arange(16, dtype = numpy.uint64))).sum(axis = 1, dtype = numpy.uint64)
+	
+	blocks = numpy.empty((len(alphas), 8), dtype = numpy.uint8)
+	blocks[:, 0] = alpha0
+	blocks[:, 1] = alpha1
+	blocks[:, 2:8] = (packedCodes[:, None] >> (8 * numpy.arange(6, dtype = numpy.uint64))) & 0xff
+	return blocks
+
+def quantize565(colors):
+	r = numpy.clip(numpy.rint(colors[:, 0] * (31 / 255)), 0, 31).astype(numpy.int32)
+	g = numpy.clip(numpy.rint(colors[:, 1] * (63 / 255)), 0, 63).astype(numpy.int32)
+	b = numpy.clip(numpy.rint(colors[:, 2] * (31 / 255)), 0, 31).astype(numpy.int32)
+	packed = (r << 11) | (g << 5) | b
+	expanded = numpy.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis = 1)
+	return (packed, expanded)
+
+#
+# Quantizes a pair of endpoint colors for every block and picks the closest palette entry for each pixel.
+# Returns the packed endpoints, ordered so that color0 > color1 as the 4-color palette needs,
+# the indices, and the squared error of every block.
+#
+def fitBc1Endpoints(colors, endpointA, endpointB):
+	(packedA, expandedA) = quantize565(endpointA)
+	(packedB, expandedB) = quantize565(endpointB)
+	swap = packedA < packedB
+	packed0 = numpy.where(swap, packedB, packedA)
+	packed1 = numpy.where(swap, packedA, packedB)
+	expanded0 = numpy.where(swap[:, None], expandedB, expandedA)
+	expanded1 = numpy.where(swap[:, None], expandedA, expandedB)
+	
+	palette = numpy.stack([
+		expanded0,
+		expanded1,
+		(2 * expanded0 + expanded1 + 1) // 3,
+		(expanded0 + 2 * expanded1 + 1) // 3,
+	], axis = 1).astype(numpy.float32)
+	
+	# Squared distances to each palette entry, less the squared length of the pixel color, which is the same for all entries
+	distances = (palette * palette).sum(axis = 2)[:, None, :] - 2 * (colors @ palette.transpose((0, 2, 1)))
+	indices = numpy.argmin(distances, axis = 2)
+	indices[packed0 == packed1] = 0
+	errors = numpy.take_along_axis(distances, indices[:, :, None], axis = 2).sum(axis = (1, 2))
+	return (packed0, packed1, indices, errors)
+
+def encodeBc1ColorBlocks(colors):
+	colors = colors.astype(numpy.float32)
+	
+	#
+	# Start with endpoints at the extremes of the principal axis of the block colors
+	#
+	mean = colors.mean(axis = 1)
+	centered = colors - mean[:, None, :]
+	covariance = centered.transpose((0, 2, 1)) @ centered
+	
+	# Power iteration, starting from the diagonal of the bounding box of the colors
+	axis = colors.max(axis = 1) - colors.min(axis = 1)
+	for iteration in range(8):
+		axis = (covariance @ axis[:, :, None])[:, :, 0]
+		axis /= numpy.maximum(numpy.abs(axis).max(axis = 1), 1e-6)[:, None]
+	axis /= numpy.maximum(numpy.sqrt((axis * axis).sum(axis = 1)), 1e-6)[:, None]
+	projections = (centered @ axis[:, :, None])[:, :, 0]
+	endpointA = numpy.clip(mean + axis * projections.max(axis = 1)[:, None], 0, 255)
+	endpointB = numpy.clip(mean + axis * projections.min(axis = 1)[:, None], 0, 255)
+	(packed0, packed1, indices, errors) = fitBc1Endpoints(colors, endpointA, endpointB)
+	
+	#
+	# Refine the endpoints with a least squares fit for the chosen indices,
+	# and keep the result where it is better
+	#
+	endpointWeights = numpy.array([1, 0, 2 / 3, 1 / 3], dtype = numpy.float32)[indices]
+	alpha = endpointWeights
+	beta = 1 - endpointWeights
+	alphaAlpha = (alpha * alpha).sum(axis = 1)
+	alphaBeta = (alpha * beta).sum(axis = 1)
+	betaBeta = (beta * beta).sum(axis = 1)
+	alphaColors = (alpha[:, :, None] * colors).sum(axis = 1)
+	betaColors = (beta[:, :, None] * colors).sum(axis = 1)
+	determinant = alphaAlpha * betaBeta - alphaBeta * alphaBeta
+	solvable = numpy.abs(determinant) > 1e-6
+	determinant[~solvable] = 1
+	refinedA = numpy.clip((betaBeta[:, None] * alphaColors - alphaBeta[:, None] * betaColors) / determinant[:, None], 0, 255)
+	refinedB = numpy.clip((alphaAlpha[:, None] * betaColors - alphaBeta[:, None] * alphaColors) / determinant[:, None], 0, 255)
+	(refinedPacked0, refinedPacked1, refinedIndices, refinedErrors) = fitBc1Endpoints(colors, refinedA, refinedB)
+	
+	improved = solvable & (refinedErrors < errors)
+	packed0 = numpy.where(improved, refinedPacked0, packed0)
+	packed1 = numpy.where(improved, refinedPacked1, packed1)
+	indices = numpy.where(improved[:, None], refinedIndices, indices)
+	
+	packedIndices = (indices.astype(numpy.uint32) << (2 * numpy.arange(16, dtype = numpy.uint32))).sum(axis = 1, dtype = numpy.uint32)
+	
+	blocks = numpy.empty((len(colors), 8), dtype = numpy.uint8)
+	blocks[:, 0] = packed0 & 0xff
+	blocks[:, 1] = packed0 >> 8
+	blocks[:, 2] = packed1 & 0xff
+	blocks[:, 3] = packed1 >> 8
+	blocks[:, 4:8] = (packedIndices[:, None] >> (8 * numpy.arange(4, dtype = numpy.uint32))) & 0xff
+	return blocks
+
+def encodeBc3Batch(pixels):
+	blocks = numpy.empty((len(pixels), 16), dtype = numpy.uint8)
+	blocks[:, 0:8] = encodeBc3AlphaBlocks(pixels[:, :, 3])
+	blocks[:, 8:16] = encodeBc1ColorBlocks(pixels[:, :, 0:3])
+	return blocks
+
+#
+# Encoding works through the blocks in batches, to bound memory use on large textures.
+#
+def encodeBc3Blocks(pixels, batchSize = 16384):
+	blocks = numpy.empty((len(pixels), 16), dtype = numpy.uint8)
+	for start in range(0, len(pixels), batchSize):
+		blocks[start : start + batchSize] = encodeBc3Batch(pixels[start : start + batchSize])
+	return blocks
+
+#
+# Converts BC7 blocks into BC3 blocks of the same pixels.
+# Both formats take 16 bytes per block, so a whole texture, with all of its mipmaps,
+# can be transcoded as one array of blocks.
+#
+def transcodeBc7ToBc3(blocks, batchSize = 16384):
+	output = numpy.empty_like(blocks)
+	for start in range(0, len(blocks), batchSize):
+		output[start : start + batchSize] = encodeBc3Batch(decodeBc7Blocks(blocks[start : start + batchSize]))
+	return output
+
+#
+# Conversion between images, as (height, width, 4) uint8 arrays, and decoded blocks.
+# Image dimensions must be multiples of 4.
+#
+def imageToBlocks(pixels):
+	(height, width) = pixels.shape[0:2]
+	return pixels.reshape((height // 4, 4, width // 4, 4, 4)).transpose((0, 2, 1, 3, 4)).reshape((-1, 16, 4))
+
+def blocksToImage(blocks, width, height):
+	return blocks.reshape((height // 4, width // 4, 4, 4, 4)).transpose((0, 2, 1, 3, 4)).reshape((height, width, 4))
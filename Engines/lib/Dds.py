@@ -0,0 +1,274 @@
+from struct import pack, unpack
+import numpy
+from PIL import Image
+
+from . import Bcn
+
+#
+# Pixel formats of the DX10 extension header, by DXGI_FORMAT number.
+# Typeless and srgb variants are named after the format they store.
+#
+dxgiFormats = {
+	2: 'RGBA32F',
+	10: 'RGBA16F',
+	24: 'RGB10A2',
+	26: 'R11G11B10F',
+	27: 'RGBA8',
+	28: 'RGBA8',
+	29: 'RGBA8',
+	61: 'R8',
+	70: 'BC1',
+	71: 'BC1',
+	72: 'BC1',
+	73: 'BC2',
+	74: 'BC2',
+	75: 'BC2',
+	76: 'BC3',
+	77: 'BC3',
+	78: 'BC3',
+	79: 'BC4',
+	80: 'BC4',
+	81: 'BC4',
+	82: 'BC5',
+	83: 'BC5',
+	84: 'BC5',
+	87: 'BGRA8',
+	91: 'BGRA8',
+	94: 'BC6H',
+	95: 'BC6H',
+	96: 'BC6H',
+	97: 'BC7',
+	98: 'BC7',
+	99: 'BC7',
+}
+
+#
+# Pixel formats of legacy headers, by FourCC.
+#
+fourCCFormats = {
+	b'DXT1': 'BC1',
+	b'DXT2': 'BC2',
+	b'DXT3': 'BC2',
+	b'DXT4': 'BC3',
+	b'DXT5': 'BC3',
+	b'ATI1': 'BC4',
+	b'BC4U': 'BC4',
+	b'BC4S': 'BC4',
+	b'ATI2': 'BC5',
+	b'BC5U': 'BC5',
+	b'BC5S': 'BC5',
+}
+
+class DdsHeader:
+	def __init__(self):
+		self.width = None
+		self.height = None
+		self.depth = None
+		self.mipmapCount = None
+		# One of the names in dxgiFormats or fourCCFormats, 'RGB' or 'RGBA', or None if unknown
+		self.format = None
+		self.fourCC = None
+		# Only set for files with a DX10 extension header
+		self.dxgiFormat = None
+		self.arraySize = 1
+		self.isCubeMap = False
+
+#
+# Parses the header of a .dds file, without reading any of its image data.
+# Returns a DdsHeader, or None if buffer does not start with a valid dds header.
+#
+def parseDdsHeader(buffer):
+	if len(buffer) < 128:
+		return None
+	
+	(
+		magic,
+		headerSize,
+		flags,
+		height,
+		width,
+		pitchOrLinearSize,
+		depth,
+		mipmapCount,
+		
+		formatSize,
+		formatFlags,
+		fourCC,
+		rgbBitCount,
+		
+		capabilities1,
+		capabilities2,
+	) = unpack('< 4s 7I 44x 2I 4s I 16x 2I 12x', buffer[0:128])
+	
+	if magic != b'DDS ' or headerSize != 124 or formatSize != 32:
+		return None
+	
+	header = DdsHeader()
+	header.width = width
+	header.height = height
+	header.depth = depth if (flags & 0x800000) != 0 and depth > 0 else 1
+	header.mipmapCount = mipmapCount if (flags & 0x20000) != 0 and mipmapCount > 0 else 1
+	header.isCubeMap = (capabilities2 & 0x200) != 0
+	
+	if (formatFlags & 0x4) != 0:
+		# FourCC
+		header.fourCC = fourCC
+		if fourCC == b'DX10':
+			if len(buffer) < 148:
+				return None
+			(header.dxgiFormat, miscFlags, arraySize) = unpack('< I 4x 2I 4x', buffer[128:148])
+			header.format = dxgiFormats.get(header.dxgiFormat)
+			header.arraySize = max(arraySize, 1)
+			if (miscFlags & 0x4) != 0:
+				header.isCubeMap = True
+		else:
+			header.format = fourCCFormats.get(fourCC)
+	elif (formatFlags & 0x40) != 0:
+		# Uncompressed rgb, with alpha if flagged so
+		header.format = 'RGBA' if (formatFlags & 0x1) != 0 else 'RGB'
+	
+	return header
+
+def readDdsHeader(filename):
+	try:
+		with open(filename, 'rb') as stream:
+			buffer = stream.read(148)
+	except OSError:
+		return None
+	return parseDdsHeader(buffer)
+
+#
+# Transcodes a BC7 .dds file into a DXT5 one, all in memory.
+# BC7 and DXT5 both take 16 bytes per 4x4 block, so every mipmap, cube face and volume slice
+# is transcoded in place, and the result keeps the layout and header of the input,
+# minus its DX10 extension header.
+# Returns the DXT5 .dds file, or None if buffer can't be transcoded this way,
+# such as texture arrays, which need a DX10 header.
+#
+def transcodeBc7ToDxt5(buffer):
+	header = parseDdsHeader(buffer)
+	if header is None or header.format != 'BC7' or header.arraySize != 1:
+		return None
+	
+	data = numpy.frombuffer(buffer, dtype = numpy.uint8, offset = 148)
+	if len(data) % 16 != 0:
+		return None
+	blocks = Bcn.transcodeBc7ToBc3(data.reshape((-1, 16)))
+	
+	legacyHeader = bytearray(buffer[0:128])
+	# Pixel format: DXT5 FourCC, without bit masks
+	legacyHeader[80:108] = pack('< I 4s 20x', 0x4, b'DXT5')
+	if header.isCubeMap:
+		(capabilities1, capabilities2) = unpack('< 2I', legacyHeader[108:116])
+		legacyHeader[108:116] = pack('< 2I', capabilities1 | 0x8, capabilities2 | 0xfe00)
+	
+	return bytes(legacyHeader) + blocks.tobytes()
+
+#
+# Encodes a PIL image as a DXT5 .dds file.
+# Like imagemagick, this includes a full mipmap chain if the image dimensions are powers of two.
+#
+def encodeDxt5(image):
+	image = image.convert('RGBA')
+	(width, height) = image.size
+	
+	levels = [image]
+	if (width & (width - 1)) == 0 and (height & (height - 1)) == 0:
+		while levels[-1].size != (1, 1):
+			(levelWidth, levelHeight) = levels[-1].size
+			levels.append(levels[-1].resize((max(levelWidth // 2, 1), max(levelHeight // 2, 1)), Image.BOX))
+	
+	frames = []
+	for level in levels:
+		pixels = numpy.asarray(level)
+		# Blocks past the edge of the image repeat its last row and column
+		padding = ((0, -pixels.shape[0] % 4), (0, -pixels.shape[1] % 4), (0, 0))
+		pixels = numpy.pad(pixels, padding, mode = 'edge')
+		frames.append(Bcn.encodeBc3Blocks(Bcn.imageToBlocks(pixels)).tobytes())
+	
+	flags = (
+		  0x1     # capabilities
+		| 0x2     # height
+		| 0x4     # width
+		| 0x1000  # pixel format
+		| 0x80000 # linear size
+	)
+	capabilities1 = 0x1000 # texture
+	if len(levels) > 1:
+		flags |= 0x20000 # mipmapCount
+		capabilities1 |= 0x8 | 0x400000 # complex, mipmap
+	
+	header = pack('< 4s 7I 44x 2I 4s 5I 2I 12x',
+		b'DDS ',
+		
+		124, # header size
+		flags,
+		height,
+		width,
+		len(frames[0]),
+		0, # depth
+		len(levels),
+		
+		32, # substructure size
+		0x4, # compressed
+		b'DXT5',
+		0,
+		0,
+		0,
+		0,
+		0,
+		
+		capabilities1,
+		0,
+	)
+	
+	return header + b''.join(frames)
+
+#
+# Benchmark of transcodeBc7ToDxt5 against imagemagick, if installed.
+# Reports the time taken, and the PSNR of the top mipmap of each result against the BC7 original.
+#
+if __name__ == "__main__":
+	import io
+	import os
+	import shutil
+	import subprocess
+	import sys
+	import tempfile
+	import time
+	
+	if len(sys.argv) != 2:
+		print("Usage: python -m lib.Dds <bc7 .dds file>")
+		sys.exit(1)
+	
+	buffer = open(sys.argv[1], 'rb').read()
+	header = parseDdsHeader(buffer)
+	if header is None or header.format != 'BC7':
+		print("Not a BC7 .dds file")
+		sys.exit(1)
+	
+	blockColumns = (header.width + 3) // 4
+	blockRows = (header.height + 3) // 4
+	originalBlocks = numpy.frombuffer(buffer, dtype = numpy.uint8, count = blockColumns * blockRows * 16, offset = 148)
+	original = Bcn.blocksToImage(Bcn.decodeBc7Blocks(originalBlocks.reshape((-1, 16))), blockColumns * 4, blockRows * 4)
+	original = original[0 : header.height, 0 : header.width].astype(numpy.float64)
+	
+	def report(name, seconds, dxt5Buffer):
+		pixels = numpy.asarray(Image.open(io.BytesIO(dxt5Buffer)).convert('RGBA'), dtype = numpy.float64)
+		meanSquaredError = ((pixels - original) ** 2).mean()
+		psnr = 10 * numpy.log10(255 ** 2 / meanSquaredError) if meanSquaredError > 0 else float('inf')
+		print("%-12s %8.3f s  %6.2f dB" % (name, seconds, psnr))
+	
+	startTime = time.perf_counter()
+	dxt5Buffer = transcodeBc7ToDxt5(buffer)
+	report("in-process", time.perf_counter() - startTime, dxt5Buffer)
+	
+	if shutil.which("magick") is not None:
+		with tempfile.TemporaryDirectory() as directory:
+			magickFilename = os.path.join(directory, "dxt5.dds")
+			startTime = time.perf_counter()
+			subprocess.run(["magick", "convert", sys.argv[1], "-format", "dds", "-define", "dds:compression=dxt5", magickFilename], capture_output = True)
+			seconds = time.perf_counter() - startTime
+			report("imagemagick", seconds, open(magickFilename, 'rb').read())
+	else:
+		print("imagemagick not found, skipping")
@@ -1,7 +1,11 @@
 import math
+import mmap
+import numpy
 import struct
 from struct import pack, pack_into, unpack, unpack_from
 
+from . import MeshArrays
+
 class InvalidFmdl(Exception):
 	pass
 
@@ -35,6 +39,7 @@ class FmdlContainer:
 		self.version = self.VERSION_2_03
 		self.segment0Blocks = {}
 		self.segment1Blocks = {}
+		self.mapping = None
 	
 	def readStream(self, stream):
 		header = bytearray(56)
@@ -128,6 +133,112 @@ class FmdlContainer:
 		with open(filename, 'rb') as stream:
 			self.readStream(stream)
 	
+	#
+	# Same as readStream, but for an fmdl file that is entirely in a buffer.
+	# Segment 0 entries and segment 1 blocks are memoryview slices of the buffer instead of copies.
+	#
+	def readBuffer(self, buffer):
+		buffer = memoryview(buffer)
+		fileLength = len(buffer)
+		
+		if fileLength < 56:
+			raise InvalidFmdl("Incomplete header")
+		(
+			magic,
+			version,
+			descriptorsOffset,
+			section0Bitmap,
+			section1Bitmap,
+			section0BlockCount,
+			section1BlockCount,
+			section0Offset,
+			section0Length,
+			section1Offset,
+			section1Length,
+		) = unpack_from('< 4s I Q QQ II II II', buffer, 0)
+		
+		if magic != self.MAGIC:
+			raise InvalidFmdl("Unexpected magic number")
+		
+		self.version = version
+		
+		if descriptorsOffset + section0BlockCount * 8 + section1BlockCount * 12 > fileLength:
+			raise InvalidFmdl("Incomplete block descriptor")
+		
+		section0Descriptors = []
+		for i in range(section0BlockCount):
+			(
+				blockID,
+				entryCount,
+				blockOffset,
+			) = unpack_from('< H H I', buffer, descriptorsOffset + i * 8)
+			section0Descriptors.append((blockID, entryCount, blockOffset))
+		
+		section1Descriptors = []
+		for i in range(section1BlockCount):
+			(
+				blockID,
+				blockOffset,
+				length,
+			) = unpack_from('< I I I', buffer, descriptorsOffset + section0BlockCount * 8 + i * 12)
+			section1Descriptors.append((blockID, blockOffset, length))
+		
+		for (blockID, entryCount, sectionOffset) in section0Descriptors:
+			if blockID not in self.SECTION0_BLOCK_ENTRY_SIZES:
+				continue
+			entrySize = self.SECTION0_BLOCK_ENTRY_SIZES[blockID]
+			
+			if blockID in self.segment0Blocks:
+				raise InvalidFmdl("Duplicate segment 0 block %d" % blockID)
+			
+			blockStart = sectionOffset + section0Offset
+			if blockStart + entryCount * entrySize > fileLength:
+				raise InvalidFmdl("Unexpected end of file reading section 0 block %d entry" % blockID)
+			
+			self.segment0Blocks[blockID] = [
+				buffer[blockStart + i * entrySize : blockStart + (i + 1) * entrySize]
+				for i in range(entryCount)
+			]
+		
+		for (blockID, sectionOffset, length) in section1Descriptors:
+			if blockID in self.segment1Blocks:
+				raise InvalidFmdl("Duplicate segment 1 block %d" % blockID)
+			
+			# These block lengths are occasionally set to slightly wrong values.
+			# Interpret them liberally.
+			remainingLength = fileLength - (sectionOffset + section1Offset)
+			if remainingLength < 0:
+				raise InvalidFmdl("Unexpected end of file reading section 1 block %d" % blockID)
+			if length > remainingLength or blockID == 3:
+				length = remainingLength
+			
+			blockStart = sectionOffset + section1Offset
+			self.segment1Blocks[blockID] = buffer[blockStart : blockStart + length]
+	
+	#
+	# Reads an fmdl file by mapping it into memory, without copying any of its blocks.
+	# The file stays mapped until close() is called.
+	#
+	def readMappedFile(self, filename):
+		with open(filename, 'rb') as stream:
+			try:
+				self.mapping = mmap.mmap(stream.fileno(), 0, access = mmap.ACCESS_READ)
+			except ValueError:
+				# Empty files can't be mapped
+				raise InvalidFmdl("Incomplete header")
+		self.readBuffer(self.mapping)
+	
+	def close(self):
+		self.segment0Blocks = {}
+		self.segment1Blocks = {}
+		if self.mapping is not None:
+			try:
+				self.mapping.close()
+			except BufferError:
+				# Something still holds a view of the file; it gets unmapped once that is released
+				pass
+			self.mapping = None
+	
 	def writeStream(self, stream):
 		section0Bitmap = 0
 		section1Bitmap = 0
@@ -323,6 +434,9 @@ class FmdlFile:
 		}
 		
 		def __init__(self):
+			self.geometryLoader = None
+			self.geometryArraysLoader = None
+			self.pendingFaceCount = None
 			self.vertices = []
 			self.faces = []
 			self.boneGroup = None
@@ -333,6 +447,70 @@ class FmdlFile:
 			# extension fields
 			self.extensionHeaders = set()
 			self.vertexEncoding = None
+		
+		#
+		# The vertices, faces and vertex encoding of a mesh can be decoded lazily:
+		# geometryLoader returns (vertices, faces, vertexEncoding), and is called the first time any of them is used.
+		# geometryArraysLoader, if set, decodes the same geometry as a MeshArrays instead.
+		#
+		def setGeometryLoader(self, geometryLoader, faceCount, geometryArraysLoader = None):
+			self.geometryLoader = geometryLoader
+			self.geometryArraysLoader = geometryArraysLoader
+			self.pendingFaceCount = faceCount
+		
+		def loadGeometry(self):
+			if self.geometryLoader is not None:
+				geometryLoader = self.geometryLoader
+				self.geometryLoader = None
+				self.geometryArraysLoader = None
+				self.pendingFaceCount = None
+				(self._vertices, self._faces, self._vertexEncoding) = geometryLoader()
+		
+		#
+		# The geometry of the mesh as a MeshArrays. As long as the geometry hasn't been decoded into
+		# vertex and face objects, this decodes it straight into arrays without creating any objects.
+		#
+		def geometryArrays(self):
+			if self.geometryArraysLoader is not None:
+				return self.geometryArraysLoader()
+			return MeshArrays.fromFmdlMesh(self)
+		
+		@property
+		def vertices(self):
+			self.loadGeometry()
+			return self._vertices
+		
+		@vertices.setter
+		def vertices(self, vertices):
+			self.loadGeometry()
+			self._vertices = vertices
+		
+		@property
+		def faces(self):
+			self.loadGeometry()
+			return self._faces
+		
+		@faces.setter
+		def faces(self, faces):
+			self.loadGeometry()
+			self._faces = faces
+		
+		@property
+		def vertexEncoding(self):
+			self.loadGeometry()
+			return self._vertexEncoding
+		
+		@vertexEncoding.setter
+		def vertexEncoding(self, vertexEncoding):
+			self.loadGeometry()
+			self._vertexEncoding = vertexEncoding
+		
+		# The number of faces, without decoding the geometry
+		@property
+		def faceCount(self):
+			if self.geometryLoader is not None:
+				return self.pendingFaceCount
+			return len(self._faces)
 	
 	class MeshGroup:
 		extensionHeaders = {
@@ -598,7 +776,7 @@ class FmdlFile:
 		return assignments
 	
 	@staticmethod
-	def parseMeshes(fmdl, bones, materialInstances, extensionHeaders):
+	def parseMeshes(fmdl, bones, materialInstances, extensionHeaders, lazy = False):
 		if 3 not in fmdl.segment0Blocks:
 			return []
 		
@@ -611,6 +789,13 @@ class FmdlFile:
 		if len(bufferOffsets) < 3:
 			raise InvalidFmdl("Missing face buffer")
 		
+		geometryContainer = fmdl
+		if lazy:
+			# The file doesn't stay mapped, so keep a copy of just the vertex and face buffer for decoding it later
+			geometryContainer = FmdlContainer()
+			if 2 in fmdl.segment1Blocks:
+				geometryContainer.segment1Blocks[2] = bytes(fmdl.segment1Blocks[2])
+		
 		meshes = []
 		for definition in fmdl.segment0Blocks[3]:
 			(
@@ -708,18 +893,26 @@ class FmdlFile:
 				raise InvalidFmdl("Invalid face index ID %d referenced by mesh" % firstFaceIndexID)
 			(lodFirstFaceVertexIndex, lodFaceVertexCount) = faceIndices[firstFaceIndexID]
 			
-			(vertices, vertexEncodings) = FmdlFile.parseVertices(fmdl, meshFormats[meshFormatID], boneGroup, vertexCount)
-			faces = FmdlFile.parseFaces(fmdl, bufferOffsets[2], firstFaceVertexIndex + lodFirstFaceVertexIndex, lodFaceVertexCount, vertices)
+			def loadGeometry(fmdl = geometryContainer, format = meshFormats[meshFormatID], boneGroup = boneGroup, vertexCount = vertexCount, firstFaceVertexIndex = firstFaceVertexIndex + lodFirstFaceVertexIndex, faceVertexCount = lodFaceVertexCount):
+				(vertices, vertexEncodings) = FmdlFile.parseVertices(fmdl, format, boneGroup, vertexCount)
+				faces = FmdlFile.parseFaces(fmdl, bufferOffsets[2], firstFaceVertexIndex, faceVertexCount, vertices)
+				return (vertices, faces, vertexEncodings)
+			
+			def loadGeometryArrays(fmdl = geometryContainer, format = meshFormats[meshFormatID], boneGroup = boneGroup, vertexCount = vertexCount, firstFaceVertexIndex = firstFaceVertexIndex + lodFirstFaceVertexIndex, faceVertexCount = lodFaceVertexCount):
+				arrays = FmdlFile.parseVertexArrays(fmdl, format, boneGroup, vertexCount)
+				arrays.faces = FmdlFile.parseFaceArray(fmdl, bufferOffsets[2], firstFaceVertexIndex, faceVertexCount, vertexCount)
+				return arrays
 			
 			mesh = FmdlFile.Mesh()
-			mesh.vertices = vertices
-			mesh.faces = faces
+			if lazy:
+				mesh.setGeometryLoader(loadGeometry, (lodFaceVertexCount + 2) // 3, loadGeometryArrays)
+			else:
+				(mesh.vertices, mesh.faces, mesh.vertexEncoding) = loadGeometry()
 			mesh.boneGroup = boneGroup
 			mesh.materialInstance = materialInstance
 			mesh.alphaFlags = alphaFlags
 			mesh.shadowFlags = shadowFlags
 			mesh.vertexFields = vertexFields
-			mesh.vertexEncoding = vertexEncodings
 			mesh.extensionHeaders = FmdlFile.parseObjectExtensionHeaders(extensionHeaders, FmdlFile.Mesh.extensionHeaders, len(meshes))
 			meshes.append(mesh)
 		return meshes
@@ -1128,7 +1321,7 @@ class FmdlFile:
 		return materialParameters
 	
 	@staticmethod
-	def parseVertices(fmdl, format, boneGroup, vertexCount):
+	def parseVertexArrays(fmdl, format, boneGroup, vertexCount):
 		#
 		# This function assumes that:
 		# - no datum type in format occurs more than once;
@@ -1141,6 +1334,141 @@ class FmdlFile:
 		
 		vertexBuffer = fmdl.segment1Blocks[2]
 		
+		#
+		# Each datum of the mesh is decoded for all vertices at once, through a strided
+		# numpy view of the vertex buffer: one row per vertex, at offset + vertexIndex * increment.
+		#
+		def datumValues(dtype, count, offset, increment):
+			if vertexCount == 0:
+				return numpy.zeros((0, count), dtype = dtype)
+			itemSize = numpy.dtype(dtype).itemsize
+			return numpy.ndarray((vertexCount, count), dtype = dtype, buffer = vertexBuffer, offset = offset, strides = (increment, itemSize))
+		
+		arrays = MeshArrays.MeshArrays()
+		# The bytes of each datum, as stored in the vertex buffer
+		arrays.encodings = MeshArrays.MeshArrays()
+		
+		uvs = [None for i in range(4)]
+		uvEncodings = [None for i in range(4)]
+		
+		uvDatumTypes = [
+			FmdlFile.FmdlVertexDatumType.uv0,
+			FmdlFile.FmdlVertexDatumType.uv1,
+			FmdlFile.FmdlVertexDatumType.uv2,
+			FmdlFile.FmdlVertexDatumType.uv3,
+		]
+		
+		for (datumType, datumFormat, offset, increment) in format:
+			if datumType == FmdlFile.FmdlVertexDatumType.position:
+				if datumFormat != FmdlFile.FmdlVertexDatumFormat.tripleFloat32:
+					raise InvalidFmdl("Unexpected format %d for vertex position data" % datumFormat)
+				arrays.encodings.positions = datumValues('u1', 12, offset, increment)
+				arrays.positions = datumValues('<f4', 3, offset, increment).astype(numpy.float32)
+			elif datumType == FmdlFile.FmdlVertexDatumType.boneWeights:
+				if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
+					raise InvalidFmdl("Unexpected format %d for vertex bone weight data" % datumFormat)
+				arrays.encodings.boneWeights = datumValues('u1', 4, offset, increment)
+			elif datumType == FmdlFile.FmdlVertexDatumType.normal:
+				if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
+					raise InvalidFmdl("Unexpected format %d for vertex normal data" % datumFormat)
+				arrays.encodings.normals = datumValues('u1', 8, offset, increment)
+				arrays.normals = datumValues('<f2', 4, offset, increment).astype(numpy.float32)
+			elif datumType == FmdlFile.FmdlVertexDatumType.color:
+				if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
+					raise InvalidFmdl("Unexpected format %d for vertex color data" % datumFormat)
+				arrays.encodings.colors = datumValues('u1', 4, offset, increment)
+				arrays.colors = arrays.encodings.colors / 255.0
+			elif datumType == FmdlFile.FmdlVertexDatumType.boneIndices:
+				if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadInt8:
+					raise InvalidFmdl("Unexpected format %d for vertex bone index data" % datumFormat)
+				arrays.encodings.boneIndices = datumValues('u1', 4, offset, increment)
+			elif datumType in uvDatumTypes:
+				i = uvDatumTypes.index(datumType)
+				if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
+					uvEncodings[i] = datumValues('u1', 4, offset, increment)
+					uvs[i] = datumValues('<f2', 2, offset, increment).astype(numpy.float32)
+				elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
+					uvEncodings[i] = datumValues('u1', 8, offset, increment)
+					uvs[i] = datumValues('<f4', 2, offset, increment).astype(numpy.float32)
+				else:
+					raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
+			elif datumType == FmdlFile.FmdlVertexDatumType.tangent:
+				if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
+					raise InvalidFmdl("Unexpected format %d for vertex tangent data" % datumFormat)
+				arrays.encodings.tangents = datumValues('u1', 8, offset, increment)
+				arrays.tangents = datumValues('<f2', 4, offset, increment).astype(numpy.float32)
+			else:
+				raise InvalidFmdl("Unexpected vertex datum type %d" % datumType)
+		
+		arrays.uvs = [uv for uv in uvs if uv is not None]
+		arrays.encodings.uvs = [uvEncoding for uvEncoding in uvEncodings if uvEncoding is not None]
+		arrays.vertexIds = numpy.arange(vertexCount, dtype = numpy.intp)
+		arrays.encodings.vertexIds = arrays.vertexIds
+		
+		if arrays.encodings.boneWeights is not None:
+			#
+			# Bone indices outside of the bone group happen a fair few times in real models.
+			# Let's just ignore the bone weighting instead.
+			#
+			# WARNING
+			#raise InvalidFmdl("Invalid bone ID %d referenced by vertex" % boneIndex)
+			bones = boneGroup.bones
+			boneIndices = arrays.encodings.boneIndices.astype(numpy.int32)
+			boneWeights = arrays.encodings.boneWeights / 255.0
+			unused = (arrays.encodings.boneWeights == 0) | (boneIndices >= len(bones))
+			
+			# A bone can occur more than once in a bone group; refer to each bone by its first index.
+			firstBoneIndices = {}
+			boneIndexTable = numpy.array([firstBoneIndices.setdefault(bone, index) for (index, bone) in enumerate(bones)] + [-1], dtype = numpy.int32)
+			boneIndices = boneIndexTable[numpy.where(unused, -1, boneIndices)]
+			boneWeights[unused] = 0
+			
+			#
+			# A bone occurring more than once in a vertex takes the place of its first occurrence
+			# and the weight of its last one, as in a {bone: weight} dictionary.
+			#
+			for slot in range(1, 4):
+				for previousSlot in range(slot):
+					duplicate = (boneIndices[:, slot] >= 0) & (boneIndices[:, slot] == boneIndices[:, previousSlot])
+					boneWeights[duplicate, previousSlot] = boneWeights[duplicate, slot]
+					boneWeights[duplicate, slot] = 0
+					boneIndices[duplicate, slot] = -1
+			
+			arrays.boneIndices = boneIndices
+			arrays.boneWeights = boneWeights
+		
+		return arrays
+	
+	@staticmethod
+	def parseVertices(fmdl, format, boneGroup, vertexCount):
+		arrays = FmdlFile.parseVertexArrays(fmdl, format, boneGroup, vertexCount)
+		
+		if vertexCount == 0:
+			return ([], [])
+		
+		def rows(array):
+			return None if array is None else array.tolist()
+		
+		# The bytes of the datum for every vertex, as stored in the vertex buffer
+		def datumEncodings(array):
+			return None if array is None else numpy.ascontiguousarray(array).view('V%d' % array.shape[1])[:, 0].tolist()
+		
+		positions = rows(arrays.positions)
+		positionEncodings = datumEncodings(arrays.encodings.positions)
+		normals = rows(arrays.normals)
+		normalEncodings = datumEncodings(arrays.encodings.normals)
+		tangents = rows(arrays.tangents)
+		tangentEncodings = datumEncodings(arrays.encodings.tangents)
+		colors = rows(arrays.colors)
+		colorEncodings = datumEncodings(arrays.encodings.colors)
+		boneWeights = rows(arrays.encodings.boneWeights)
+		boneIndices = rows(arrays.encodings.boneIndices)
+		presentUvs = [(rows(uv), datumEncodings(uvEncoding)) for (uv, uvEncoding) in zip(arrays.uvs, arrays.encodings.uvs)]
+		
+		if boneWeights is not None:
+			bones = boneGroup.bones
+			boneCount = len(bones)
+		
 		vertices = []
 		vertexEncodings = []
 		for vertexIndex in range(vertexCount):
@@ -1148,108 +1476,53 @@ class FmdlFile:
 			vertexEncoding = FmdlFile.VertexEncoding()
 			vertexEncoding.vertex = vertex
 			
-			uvEncoding = [None for i in range(4)]
-			uv = [None for i in range(4)]
-			boneWeights = None
-			boneIndices = None
+			if positions is not None:
+				(x, y, z) = positions[vertexIndex]
+				vertex.position = FmdlFile.Vector3(x, y, z)
+				vertexEncoding.position = positionEncodings[vertexIndex]
+			if normals is not None:
+				(x, y, z, w) = normals[vertexIndex]
+				vertex.normal = FmdlFile.Vector4(x, y, z, w)
+				vertexEncoding.normal = normalEncodings[vertexIndex]
+			if colors is not None:
+				vertex.color = colors[vertexIndex]
+				vertexEncoding.color = colorEncodings[vertexIndex]
+			if tangents is not None:
+				(x, y, z, w) = tangents[vertexIndex]
+				vertex.tangent = FmdlFile.Vector4(x, y, z, w)
+				vertexEncoding.tangent = tangentEncodings[vertexIndex]
 			
-			for (datumType, datumFormat, offset, increment) in format:
-				position = offset + vertexIndex * increment
-				
-				if datumType == FmdlFile.FmdlVertexDatumType.position:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.tripleFloat32:
-						raise InvalidFmdl("Unexpected format %d for vertex position data" % datumFormat)
-					vertexEncoding.position = vertexBuffer[position : position + 12]
-					value = unpack('< 3f', vertexEncoding.position)
-					vertex.position = FmdlFile.Vector3(value[0], value[1], value[2])
-				elif datumType == FmdlFile.FmdlVertexDatumType.boneWeights:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
-						raise InvalidFmdl("Unexpected format %d for vertex bone weight data" % datumFormat)
-					boneWeights = unpack('< 4B', vertexBuffer[position : position + 4])
-				elif datumType == FmdlFile.FmdlVertexDatumType.normal:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
-						raise InvalidFmdl("Unexpected format %d for vertex normal data" % datumFormat)
-					vertexEncoding.normal = vertexBuffer[position : position + 8]
-					value = [FmdlFile.parseFloat16(x) for x in unpack('< 4H', vertexEncoding.normal)]
-					vertex.normal = FmdlFile.Vector4(value[0], value[1], value[2], value[3])
-				elif datumType == FmdlFile.FmdlVertexDatumType.color:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat8:
-						raise InvalidFmdl("Unexpected format %d for vertex color data" % datumFormat)
-					vertexEncoding.color = vertexBuffer[position : position + 4]
-					vertex.color = [x / 255.0 for x in unpack('< 4B', vertexEncoding.color)]
-				elif datumType == FmdlFile.FmdlVertexDatumType.boneIndices:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadInt8:
-						raise InvalidFmdl("Unexpected format %d for vertex bone index data" % datumFormat)
-					boneIndices = unpack('< 4B', vertexBuffer[position : position + 4])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv0:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[0] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[0])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[0] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[0])
-					else:
-						raise InvalidFmdl("Unexpected format %d for vertex uv data" % datumFormat)
-					uv[0] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv1:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[1] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[1])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[1] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[1])
-					uv[1] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv2:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[2] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[2])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[2] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[2])
-					uv[2] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.uv3:
-					if datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat16:
-						uvEncoding[3] = vertexBuffer[position : position + 4]
-						value = [FmdlFile.parseFloat16(x) for x in unpack('< 2H', uvEncoding[3])]
-					elif datumFormat == FmdlFile.FmdlVertexDatumFormat.doubleFloat32:
-						uvEncoding[3] = vertexBuffer[position : position + 8]
-						value = unpack('< 2f', uvEncoding[3])
-					uv[3] = FmdlFile.Vector2(value[0], value[1])
-				elif datumType == FmdlFile.FmdlVertexDatumType.tangent:
-					if datumFormat != FmdlFile.FmdlVertexDatumFormat.quadFloat16:
-						raise InvalidFmdl("Unexpected format %d for vertex tangent data" % datumFormat)
-					vertexEncoding.tangent = vertexBuffer[position : position + 8]
-					value = [FmdlFile.parseFloat16(x) for x in unpack('< 4H', vertexEncoding.tangent)]
-					vertex.tangent = FmdlFile.Vector4(value[0], value[1], value[2], value[3])
-				else:
-					raise InvalidFmdl("Unexpected vertex datum type %d" % datumType)
-			
-			for i in range(4):
-				if uv[i] != None:
-					vertex.uv.append(uv[i])
-					vertexEncoding.uv.append(uvEncoding[i])
+			for (uv, uvEncoding) in presentUvs:
+				(u, v) = uv[vertexIndex]
+				vertex.uv.append(FmdlFile.Vector2(u, v))
+				vertexEncoding.uv.append(uvEncoding[vertexIndex])
 			
 			if boneWeights != None:
-				vertex.boneMapping = {}
-				vertexEncoding.boneMapping = []
-				for i in range(4):
-					if boneWeights[i] > 0:
-						if not boneIndices[i] < len(boneGroup.bones):
-							#
-							# This happens a fair few times in real models.
-							# Let's just ignore the bone weighting instead.
-							#
-							# WARNING
-							#raise InvalidFmdl("Invalid bone ID %d referenced by vertex" % boneIndices[i])
-							continue
-						
-						vertex.boneMapping[boneGroup.bones[boneIndices[i]]] = boneWeights[i] / 255.0
-						vertexEncoding.boneMapping.append((boneGroup.bones[boneIndices[i]], boneWeights[i]))
+				# Bone indices outside of the bone group are ignored; see parseVertexArrays.
+				vertexEncoding.boneMapping = [
+					(bones[boneIndex], boneWeight)
+					for (boneWeight, boneIndex) in zip(boneWeights[vertexIndex], boneIndices[vertexIndex])
+					if boneWeight > 0 and boneIndex < boneCount
+				]
+				vertex.boneMapping = {bone : boneWeight / 255.0 for (bone, boneWeight) in vertexEncoding.boneMapping}
 			
 			vertices.append(vertex)
 			vertexEncodings.append(vertexEncoding)
 		return (vertices, vertexEncodings)
 	
+	@staticmethod
+	def parseFaceArray(fmdl, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertexCount):
+		if 2 not in fmdl.segment1Blocks:
+			raise InvalidFmdl("Vertex block not found")
+		
+		vertexBuffer = fmdl.segment1Blocks[2]
+		
+		faceCount = (faceVertexCount + 2) // 3
+		faces = numpy.frombuffer(vertexBuffer, dtype = '<u2', count = 3 * faceCount, offset = firstFaceVertexIndex * 2 + vertexBufferOffset)
+		if faceCount > 0 and faces.max() >= vertexCount:
+			raise InvalidFmdl("Invalid vertex referenced by face")
+		return faces.astype(numpy.intp).reshape((faceCount, 3))
+	
 	@staticmethod
 	def parseFaces(fmdl, vertexBufferOffset, firstFaceVertexIndex, faceVertexCount, vertices):
 		if 2 not in fmdl.segment1Blocks:
@@ -1275,16 +1548,23 @@ class FmdlFile:
 				output.add(key)
 		return output
 	
-	def readFile(self, filename):
+	#
+	# With lazy set, mesh geometry is only decoded once it is used; see Mesh.setGeometryLoader.
+	#
+	def readFile(self, filename, lazy = False):
 		fmdl = FmdlContainer()
-		fmdl.readFile(filename)
-		
-		(strings, extensionHeaders) = self.parseStrings(fmdl)
-		boundingBoxes = self.parseBoundingBoxes(fmdl)
-		bones = self.parseBones(fmdl, strings, boundingBoxes)
-		materialInstances = self.parseMaterialInstances(fmdl, strings)
-		meshes = self.parseMeshes(fmdl, bones, materialInstances, extensionHeaders)
-		meshGroups = self.parseMeshGroups(fmdl, strings, boundingBoxes, meshes, extensionHeaders)
+		fmdl.readMappedFile(filename)
+		
+		try:
+			(strings, extensionHeaders) = self.parseStrings(fmdl)
+			boundingBoxes = self.parseBoundingBoxes(fmdl)
+			bones = self.parseBones(fmdl, strings, boundingBoxes)
+			materialInstances = self.parseMaterialInstances(fmdl, strings)
+			meshes = self.parseMeshes(fmdl, bones, materialInstances, extensionHeaders, lazy)
+			meshGroups = self.parseMeshGroups(fmdl, strings, boundingBoxes, meshes, extensionHeaders)
+		finally:
+			# Everything parsed is a copy, so the file doesn't need to stay mapped
+			fmdl.close()
 		
 		self.bones = bones
 		self.materialInstances = materialInstances
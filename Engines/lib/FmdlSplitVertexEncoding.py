@@ -1,4 +1,6 @@
-from . import FmdlFile
+import numpy
+
+from . import FmdlFile, MeshArrays
 
 #
 # FMDL files store mesh geometry as vertices, and faces that are sequences of
@@ -260,6 +262,94 @@ def decodeMeshVertexLoopPreservation(mesh):
 	
 	return output
 
+#
+# Same as decodeMeshVertexLoopPreservation, for a mesh decoded as a MeshArrays with encodings.
+# Decoding only changes which vertices are loops of the same vertex, so only vertexIds changes.
+#
+def decodeMeshArraysVertexLoopPreservation(arrays, vertexFields, boneGroup):
+	encodings = arrays.encodings
+	vertexCount = arrays.vertexCount
+	if vertexCount == 0:
+		return arrays
+	
+	topologicalKeys = [encodings.positions]
+	if vertexFields.hasBoneMapping:
+		#
+		# The bone mapping part of the topological key is the sequence of (bone, weight) pairs of the
+		# bone influences that are used, compared by bone object rather than by bone group index.
+		#
+		firstBoneIndices = {}
+		bones = boneGroup.bones[0:256]
+		boneIndexTable = numpy.full(256, -1, dtype = numpy.int32)
+		boneIndexTable[0:len(bones)] = [firstBoneIndices.setdefault(bone, index) for (index, bone) in enumerate(bones)]
+		boneIndices = boneIndexTable[encodings.boneIndices]
+		used = (encodings.boneWeights > 0) & (boneIndices >= 0)
+		influences = numpy.where(used, boneIndices * 256 + encodings.boneWeights, -1)
+		order = numpy.argsort(~used, axis = 1, kind = 'stable')
+		topologicalKeys.append(numpy.take_along_axis(influences, order, axis = 1))
+	
+	nontopologicalEncodings = []
+	if vertexFields.hasNormal:
+		nontopologicalEncodings.append(encodings.normals)
+	if vertexFields.hasColor:
+		nontopologicalEncodings.append(encodings.colors)
+	for i in range(4):
+		if vertexFields.uvCount > i:
+			nontopologicalEncodings.append(encodings.uvs[i])
+	if vertexFields.hasTangent:
+		nontopologicalEncodings.append(encodings.tangents)
+	# The trailing zero column doesn't change the order, but keeps the encoding from being empty
+	nontopologicalEncoding = numpy.concatenate(nontopologicalEncodings + [numpy.zeros((vertexCount, 1), dtype = numpy.uint8)], axis = 1)
+	
+	# Compare every vertex with the one before it
+	sameTopology = numpy.ones(vertexCount - 1, dtype = bool)
+	for key in topologicalKeys:
+		sameTopology &= (key[1:] == key[:-1]).all(axis = 1)
+	
+	previous = nontopologicalEncoding[:-1]
+	current = nontopologicalEncoding[1:]
+	differences = previous != current
+	firstDifference = differences.argmax(axis = 1)
+	rows = numpy.arange(len(firstDifference))
+	increasing = differences.any(axis = 1) & (previous[rows, firstDifference] < current[rows, firstDifference])
+	
+	# Each vertex that is a loop of the vertex before it takes over its vertexId
+	isLoop = numpy.concatenate([[False], sameTopology & increasing])
+	vertexIndices = numpy.arange(vertexCount)
+	firstLoops = numpy.maximum.accumulate(numpy.where(isLoop, 0, vertexIndices))
+	arrays.vertexIds = arrays.vertexIds[firstLoops]
+	return arrays
+
+#
+# Same as decodeMeshVertexLoopPreservation, but the geometry is only decoded once it is used.
+#
+def lazyDecodeMeshVertexLoopPreservation(mesh):
+	output = FmdlFile.FmdlFile.Mesh()
+	output.boneGroup = mesh.boneGroup
+	output.materialInstance = mesh.materialInstance
+	output.alphaFlags = mesh.alphaFlags
+	output.shadowFlags = mesh.shadowFlags
+	output.vertexFields = mesh.vertexFields
+	output.extensionHeaders = mesh.extensionHeaders.copy()
+	
+	def loadGeometry():
+		decodedMesh = decodeMeshVertexLoopPreservation(mesh)
+		return (decodedMesh.vertices, decodedMesh.faces, decodedMesh.vertexEncoding)
+	
+	def loadGeometryArrays():
+		arrays = mesh.geometryArrays()
+		if arrays.encodings is None:
+			# The geometry of the input mesh has been decoded into objects already
+			return MeshArrays.fromFmdlMesh(output)
+		return decodeMeshArraysVertexLoopPreservation(arrays, mesh.vertexFields, mesh.boneGroup)
+	
+	if mesh.geometryArraysLoader is not None:
+		output.setGeometryLoader(loadGeometry, mesh.faceCount, loadGeometryArrays)
+	else:
+		output.setGeometryLoader(loadGeometry, mesh.faceCount)
+	
+	return output
+
 def decodeFmdlVertexLoopPreservation(fmdl):
 	if fmdl.extensionHeaders == None or "vertex-loop-preservation" not in fmdl.extensionHeaders['x-fmdl-extensions']:
 		return fmdl
@@ -271,7 +361,7 @@ def decodeFmdlVertexLoopPreservation(fmdl):
 	output.meshes = []
 	meshMap = {}
 	for mesh in fmdl.meshes:
-		encodedMesh = decodeMeshVertexLoopPreservation(mesh)
+		encodedMesh = lazyDecodeMeshVertexLoopPreservation(mesh)
 		output.meshes.append(encodedMesh)
 		meshMap[mesh] = encodedMesh
 	output.meshGroups = []
@@ -1,4 +1,5 @@
 from struct import pack, unpack
+import io
 import zlib
 import tempfile
 import os
@@ -49,12 +50,21 @@ def readImageBuffer(stream, imageOffset, chunkCount, uncompressedSize, compresse
 		imageBuffers.append(decompressedBuffer)
 	return b''.join(imageBuffers)
 
-def ftexToDds(ftexFilename, ddsFilename):
-	inputStream = open(ftexFilename, 'rb')
+def ftexToDdsBuffer(ftexFilename):
+	with open(ftexFilename, 'rb') as inputStream:
+		ftexBuffer = inputStream.read()
+	return ftexBufferToDdsBuffer(ftexBuffer)
+
+#
+# Converts the contents of an .ftex file into the contents of a .dds file.
+# Returns None if ftexBuffer isn't a valid .ftex file.
+#
+def ftexBufferToDdsBuffer(ftexBuffer):
+	inputStream = io.BytesIO(ftexBuffer)
 	
 	header = bytearray(64)
 	if inputStream.readinto(header) != len(header):
-		return False
+		return None
 	
 	(
 		ftexMagic,
@@ -76,16 +86,16 @@ def ftexToDds(ftexFilename, ddsFilename):
 	) = unpack('< 4s f HHHH  BB HIII  BB 14x  8s 8s', header)
 	
 	if ftexMagic != b'FTEX':
-		return False
+		return None
 	
 	if ftexVersion < 2.025:
-		return False
+		return None
 	if ftexVersion > 2.045:
-		return False
+		return None
 	if ftexFtexsCount > 0:
-		return False
+		return None
 	if ftexMipmapCount == 0:
-		return False
+		return None
 	
 	
 	
@@ -101,7 +111,7 @@ def ftexToDds(ftexFilename, ddsFilename):
 	if (ftexTextureType & 4) != 0:
 		# Cube map, with six faces
 		if ftexDepth > 1:
-			return False
+			return None
 		imageCount = 6
 		ddsDepth = 1
 		ddsCapabilities1 |= 0x8    # complex
@@ -158,7 +168,7 @@ def ftexToDds(ftexFilename, ddsFilename):
 				chunkCount,
 			) = unpack('< I I I BB H', mipmapHeader)
 			if index != j:
-				return False
+				return None
 			
 			frameSpecifications.append((offset, chunkCount, uncompressedSize, compressedSize))
 	
@@ -166,7 +176,7 @@ def ftexToDds(ftexFilename, ddsFilename):
 	for (offset, chunkCount, uncompressedSize, compressedSize) in frameSpecifications:
 		frame = readImageBuffer(inputStream, offset, chunkCount, uncompressedSize, compressedSize)
 		if frame == None:
-			return False
+			return None
 		frames.append(frame)
 	
 	
@@ -245,7 +255,7 @@ def ftexToDds(ftexFilename, ddsFilename):
 		elif ftexPixelFormat == 15:
 			ddsExtensionFormat = 26
 		else:
-			return False
+			return None
 		
 		if ddsExtensionFormat is not None:
 			ddsFourCC = b'DX10'
@@ -255,9 +265,9 @@ def ftexToDds(ftexFilename, ddsFilename):
 	
 	
 	
-	outputStream = open(ddsFilename, 'wb')
+	ddsBuffers = []
 	
-	outputStream.write(pack('< 4s 7I 44x 2I 4s 5I 2I 12x',
+	ddsBuffers.append(pack('< 4s 7I 44x 2I 4s 5I 2I 12x',
 		b'DDS ',
 		
 		124, # header size
@@ -282,7 +292,7 @@ def ftexToDds(ftexFilename, ddsFilename):
 	))
 	
 	if useExtensionHeader:
-		outputStream.write(pack('< 5I',
+		ddsBuffers.append(pack('< 5I',
 			ddsExtensionFormat,
 			ddsExtensionDimension,
 			ddsExtensionFlags,
@@ -290,10 +300,17 @@ def ftexToDds(ftexFilename, ddsFilename):
 			0, # flags
 		))
 	
-	for frame in frames:
-		outputStream.write(frame)
+	ddsBuffers += frames
+	
+	return b''.join(ddsBuffers)
+
+def ftexToDds(ftexFilename, ddsFilename):
+	ddsBuffer = ftexToDdsBuffer(ftexFilename)
+	if ddsBuffer is None:
+		return False
 	
-	outputStream.close()
+	with open(ddsFilename, 'wb') as outputStream:
+		outputStream.write(ddsBuffer)
 	
 	return True
 
@@ -0,0 +1,153 @@
+import numpy
+
+#
+# Mesh geometry stored as a structure of arrays, rather than as lists of vertex and face objects.
+#
+# Every vertex attribute is a single numpy array with one row per vertex:
+# - positions: float32, 3 columns;
+# - normals, tangents, bitangents: float32, 3 or 4 columns, or None if absent;
+# - colors: float64, 4 columns of values between 0 and 1, or None if absent;
+# - uvs: a list of float32 arrays with 2 columns, one per uv map;
+# - boneIndices, boneWeights: int32 and float64, one column per bone influence, or None if absent.
+#   Indices point into the bone group of the mesh; unused influence slots have index -1 and weight 0.
+# - vertexIds: for each vertex, the index of the first vertex sharing its position object.
+#   Vertices with the same vertexId are loops of the same vertex; see ModelSplitVertexEncoding.
+#
+# faces is an integer array with one row of three vertex indices per face.
+#
+# For meshes decoded straight from a file or encoded for writing one, encodings holds the bytes
+# of each vertex attribute as stored in the file, as a MeshArrays of uint8 arrays with one row per vertex.
+# Bone influences are stored there exactly as in the file, including unused and invalid ones.
+#
+
+class MeshArrays:
+	def __init__(self):
+		self.positions = numpy.zeros((0, 3), dtype = numpy.float32)
+		self.normals = None
+		self.tangents = None
+		self.bitangents = None
+		self.colors = None
+		self.uvs = []
+		self.boneIndices = None
+		self.boneWeights = None
+		self.vertexIds = numpy.zeros((0, ), dtype = numpy.intp)
+		self.faces = numpy.zeros((0, 3), dtype = numpy.intp)
+		self.encodings = None
+	
+	@property
+	def vertexCount(self):
+		return len(self.positions)
+	
+	@property
+	def faceCount(self):
+		return len(self.faces)
+
+#
+# A MeshArrays holding the given vertices of arrays, in the given order.
+# The faces are left empty.
+#
+def selectVertices(arrays, vertexIndices):
+	def select(array):
+		return None if array is None else array[vertexIndices]
+	
+	output = MeshArrays()
+	output.positions = select(arrays.positions)
+	output.normals = select(arrays.normals)
+	output.tangents = select(arrays.tangents)
+	output.bitangents = select(arrays.bitangents)
+	output.colors = select(arrays.colors)
+	output.uvs = [select(uv) for uv in arrays.uvs]
+	output.boneIndices = select(arrays.boneIndices)
+	output.boneWeights = select(arrays.boneWeights)
+	output.vertexIds = select(arrays.vertexIds)
+	if arrays.encodings is not None:
+		output.encodings = selectVertices(arrays.encodings, vertexIndices)
+	return output
+
+#
+# The lexicographic rank of every row of a 2-dimensional array: equal rows get the same rank,
+# and a row that is less than another gets a lower rank.
+#
+def rowRanks(rows):
+	if len(rows) == 0:
+		return numpy.zeros((0, ), dtype = numpy.intp)
+	
+	order = numpy.lexsort(rows.T[::-1])
+	sortedRows = rows[order]
+	isNewRow = numpy.concatenate([[False], (sortedRows[1:] != sortedRows[:-1]).any(axis = 1)])
+	ranks = numpy.empty(len(rows), dtype = numpy.intp)
+	ranks[order] = numpy.cumsum(isNewRow)
+	return ranks
+
+def vectorArray(rows, columns, dtype):
+	return numpy.array(rows, dtype = dtype).reshape((-1, columns))
+
+#
+# Vertices sharing a position object get the same vertexId.
+#
+def vertexIdArray(vertices):
+	positionIds = {}
+	return numpy.array([positionIds.setdefault(vertex.position, index) for (index, vertex) in enumerate(vertices)], dtype = numpy.intp)
+
+def faceArray(faces, vertices):
+	vertexIndices = { vertex: index for (index, vertex) in enumerate(vertices) }
+	return vectorArray([[vertexIndices[vertex] for vertex in face.vertices] for face in faces], 3, numpy.intp)
+
+#
+# Builds dense bone influence arrays out of per-vertex {bone: weight} mappings.
+# boneIndices maps bones to their index in the bone group; if it is None, the bones already are indices.
+#
+def boneMappingArrays(boneMappings, boneIndices = None):
+	boneMappings = [{} if boneMapping is None else boneMapping for boneMapping in boneMappings]
+	influenceCount = max((len(boneMapping) for boneMapping in boneMappings), default = 0)
+	
+	indices = numpy.full((len(boneMappings), influenceCount), -1, dtype = numpy.int32)
+	weights = numpy.zeros((len(boneMappings), influenceCount), dtype = numpy.float64)
+	for (vertexIndex, boneMapping) in enumerate(boneMappings):
+		for (slot, (bone, weight)) in enumerate(boneMapping.items()):
+			indices[vertexIndex, slot] = bone if boneIndices is None else boneIndices[bone]
+			weights[vertexIndex, slot] = weight
+	return (indices, weights)
+
+#
+# Merges influences of a vertex that refer to the same bone into the first of them,
+# adding up the weights in slot order. This is how bone mappings are merged when several
+# bones of a mesh are replaced by the same bone.
+#
+def mergeDuplicateBones(boneIndices, boneWeights):
+	boneIndices = boneIndices.copy()
+	boneWeights = boneWeights.copy()
+	for slot in range(1, boneIndices.shape[1]):
+		for previousSlot in range(slot):
+			duplicate = (boneIndices[:, slot] >= 0) & (boneIndices[:, slot] == boneIndices[:, previousSlot])
+			boneWeights[duplicate, previousSlot] += boneWeights[duplicate, slot]
+			boneWeights[duplicate, slot] = 0
+			boneIndices[duplicate, slot] = -1
+	return (boneIndices, boneWeights)
+
+#
+# Adapter from the FmdlFile object model.
+# Bone indices point into mesh.boneGroup.bones.
+#
+def fromFmdlMesh(mesh):
+	vertices = mesh.vertices
+	vertexFields = mesh.vertexFields
+	
+	arrays = MeshArrays()
+	arrays.positions = vectorArray([(vertex.position.x, vertex.position.y, vertex.position.z) for vertex in vertices], 3, numpy.float32)
+	arrays.vertexIds = vertexIdArray(vertices)
+	
+	if vertexFields.hasNormal:
+		arrays.normals = vectorArray([(vertex.normal.x, vertex.normal.y, vertex.normal.z, vertex.normal.w) for vertex in vertices], 4, numpy.float32)
+	if vertexFields.hasTangent:
+		arrays.tangents = vectorArray([(vertex.tangent.x, vertex.tangent.y, vertex.tangent.z, vertex.tangent.w) for vertex in vertices], 4, numpy.float32)
+	if vertexFields.hasColor:
+		arrays.colors = vectorArray([vertex.color for vertex in vertices], 4, numpy.float64)
+	for i in range(vertexFields.uvCount):
+		arrays.uvs.append(vectorArray([(vertex.uv[i].u, vertex.uv[i].v) for vertex in vertices], 2, numpy.float32))
+	if vertexFields.hasBoneMapping:
+		boneIndices = { bone: index for (index, bone) in enumerate(mesh.boneGroup.bones) }
+		(arrays.boneIndices, arrays.boneWeights) = boneMappingArrays([vertex.boneMapping for vertex in vertices], boneIndices)
+	
+	arrays.faces = faceArray(mesh.faces, vertices)
+	return arrays
@@ -1,7 +1,13 @@
+import io
 import struct
 from struct import pack, unpack
+import sys
 import zlib
 
+import numpy
+
+from . import MeshArrays
+
 class InvalidModel(Exception):
 	pass
 
@@ -125,6 +131,7 @@ class ModelFile:
 	
 	class Mesh:
 		def __init__(self):
+			self.arrays = None
 			self.vertices = None
 			self.faces = None
 			self.boneGroup = None
@@ -135,6 +142,50 @@ class ModelFile:
 			self.name = None
 			self.extensionHeaders = set()
 			self.vertexEncodings = None
+		
+		#
+		# The geometry of a mesh is stored either as vertex and face objects, or as a MeshArrays.
+		# When the arrays are set, the objects are built out of them the first time they are used,
+		# and the arrays are dropped; setting the objects drops the arrays as well.
+		#
+		def loadObjects(self):
+			if self.arrays is not None:
+				arrays = self.arrays
+				self.arrays = None
+				(self._vertices, self._faces) = arraysToObjects(arrays)
+		
+		@property
+		def vertices(self):
+			self.loadObjects()
+			return self._vertices
+		
+		@vertices.setter
+		def vertices(self, vertices):
+			self.loadObjects()
+			self._vertices = vertices
+		
+		@property
+		def faces(self):
+			self.loadObjects()
+			return self._faces
+		
+		@faces.setter
+		def faces(self, faces):
+			self.loadObjects()
+			self._faces = faces
+		
+		# The number of vertices and faces, without building objects out of the arrays
+		@property
+		def vertexCount(self):
+			if self.arrays is not None:
+				return self.arrays.vertexCount
+			return len(self._vertices)
+		
+		@property
+		def faceCount(self):
+			if self.arrays is not None:
+				return self.arrays.faceCount
+			return len(self._faces)
 	
 	def __init__(self):
 		self.bones = []
@@ -955,6 +1006,79 @@ def readModelFile(filename, parserSettings):
 
 
 
+#
+# Adapters between the vertex and face objects of a mesh and MeshArrays.
+#
+def objectsToArrays(vertices, faces, vertexFields):
+	arrays = MeshArrays.MeshArrays()
+	arrays.positions = MeshArrays.vectorArray([(vertex.position.x, vertex.position.y, vertex.position.z) for vertex in vertices], 3, numpy.float32)
+	arrays.vertexIds = MeshArrays.vertexIdArray(vertices)
+	
+	if vertexFields.hasNormal:
+		arrays.normals = MeshArrays.vectorArray([(vertex.normal.x, vertex.normal.y, vertex.normal.z) for vertex in vertices], 3, numpy.float32)
+	if vertexFields.hasTangent:
+		arrays.tangents = MeshArrays.vectorArray([(vertex.tangent.x, vertex.tangent.y, vertex.tangent.z) for vertex in vertices], 3, numpy.float32)
+	if vertexFields.hasBitangent:
+		arrays.bitangents = MeshArrays.vectorArray([(vertex.bitangent.x, vertex.bitangent.y, vertex.bitangent.z) for vertex in vertices], 3, numpy.float32)
+	if vertexFields.hasColor:
+		arrays.colors = MeshArrays.vectorArray([vertex.color for vertex in vertices], 4, numpy.float64)
+	for i in range(vertexFields.uvCount):
+		arrays.uvs.append(MeshArrays.vectorArray([(vertex.uv[i].u, vertex.uv[i].v) for vertex in vertices], 2, numpy.float32))
+	if vertexFields.hasBoneMapping:
+		(arrays.boneIndices, arrays.boneWeights) = MeshArrays.boneMappingArrays([vertex.boneMapping for vertex in vertices])
+	
+	arrays.faces = MeshArrays.faceArray(faces, vertices)
+	return arrays
+
+def arraysToObjects(arrays):
+	def rows(array):
+		return None if array is None else array.tolist()
+	
+	positions = rows(arrays.positions)
+	normals = rows(arrays.normals)
+	tangents = rows(arrays.tangents)
+	bitangents = rows(arrays.bitangents)
+	colors = rows(arrays.colors)
+	uvs = [rows(uv) for uv in arrays.uvs]
+	boneIndices = rows(arrays.boneIndices)
+	boneWeights = rows(arrays.boneWeights)
+	
+	vertices = []
+	for (vertexIndex, vertexId) in enumerate(arrays.vertexIds.tolist()):
+		vertex = ModelFile.Vertex()
+		
+		if vertexId != vertexIndex:
+			# Loops of the same vertex share their position object
+			vertex.position = vertices[vertexId].position
+		else:
+			(x, y, z) = positions[vertexIndex]
+			vertex.position = ModelFile.Vector3(x, y, z)
+		
+		if normals is not None:
+			vertex.normal = ModelFile.Vector3(*normals[vertexIndex][0:3])
+		if tangents is not None:
+			vertex.tangent = ModelFile.Vector3(*tangents[vertexIndex][0:3])
+		if bitangents is not None:
+			vertex.bitangent = ModelFile.Vector3(*bitangents[vertexIndex][0:3])
+		if colors is not None:
+			vertex.color = colors[vertexIndex]
+		for uv in uvs:
+			(u, v) = uv[vertexIndex]
+			vertex.uv.append(ModelFile.Vector2(u, v))
+		if boneIndices is not None:
+			vertex.boneMapping = {
+				boneIndex : boneWeight
+				for (boneIndex, boneWeight) in zip(boneIndices[vertexIndex], boneWeights[vertexIndex])
+				if boneIndex >= 0
+			}
+		
+		vertices.append(vertex)
+	
+	faces = [ModelFile.Face(vertices[v1], vertices[v2], vertices[v3]) for (v1, v2, v3) in arrays.faces.tolist()]
+	return (vertices, faces)
+
+
+
 def encodeBoneMapping(boneMapping):
 	#
 	# .model bone mappings support at most 4 bones. If a vertex has more than four bones in its bone mapping,
@@ -980,47 +1104,244 @@ def encodeBoneMapping(boneMapping):
 	boneWeights = pack('< 4f', *(weight for (boneIndex, weight) in effectiveMapping))
 	return (boneIndices, boneWeights)
 
+#
+# The sum of every row of a 2-dimensional float array, added up one column at a time
+# so that the result is rounded exactly like the builtin sum() of the row would be.
+# Since python 3.12, sum() adds up floats with Neumaier compensated summation.
+#
+def sumColumns(rows):
+	total = numpy.zeros(len(rows), dtype = numpy.float64)
+	if sys.version_info < (3, 12):
+		for column in rows.T:
+			total = total + column
+		return total
+	
+	compensation = numpy.zeros(len(rows), dtype = numpy.float64)
+	for column in rows.T:
+		newTotal = total + column
+		compensation += numpy.where(
+			numpy.abs(total) >= numpy.abs(column),
+			(total - newTotal) + column,
+			(column - newTotal) + total,
+		)
+		total = newTotal
+	hasCompensation = (compensation != 0) & numpy.isfinite(compensation)
+	total[hasCompensation] += compensation[hasCompensation]
+	return total
+
+#
+# encodeBoneMapping for every vertex of a set of dense bone influence arrays, all at once.
+# Returns the encoded bone indices and weights as uint8 arrays with one row per vertex.
+#
+def encodeBoneMappingArrays(boneIndices, boneWeights):
+	(vertexCount, influenceCount) = boneIndices.shape
+	isUsed = boneIndices >= 0
+	
+	#
+	# Order the influences of every vertex by descending weight, then descending bone index,
+	# like encodeBoneMapping does; unused slots go last.
+	#
+	sortWeights = numpy.where(isUsed, boneWeights, -numpy.inf)
+	order = numpy.lexsort((-boneIndices, -sortWeights), axis = 1)
+	orderedIndices = numpy.take_along_axis(boneIndices, order, axis = 1)
+	orderedWeights = numpy.take_along_axis(numpy.where(isUsed, boneWeights, 0.0), order, axis = 1)
+	orderedUsed = numpy.take_along_axis(isUsed, order, axis = 1)
+	
+	totalWeight = sumColumns(orderedWeights)
+	selectedWeight = sumColumns(orderedWeights[:, 0:4])
+	missingWeight = totalWeight - selectedWeight
+	
+	selectedIndices = numpy.zeros((vertexCount, 4), dtype = numpy.int64)
+	selectedWeights = numpy.zeros((vertexCount, 4), dtype = numpy.float64)
+	selectedUsed = numpy.zeros((vertexCount, 4), dtype = bool)
+	selectedSlots = min(influenceCount, 4)
+	selectedIndices[:, 0:selectedSlots] = orderedIndices[:, 0:selectedSlots]
+	selectedWeights[:, 0:selectedSlots] = orderedWeights[:, 0:selectedSlots]
+	selectedUsed[:, 0:selectedSlots] = orderedUsed[:, 0:selectedSlots]
+	
+	hasMissingWeight = missingWeight > 0
+	if hasMissingWeight.any():
+		weights = selectedWeights[hasMissingWeight]
+		selectedWeights[hasMissingWeight] = weights + (missingWeight[hasMissingWeight, None] * (weights / selectedWeight[hasMissingWeight, None]))
+	
+	selectedIndices[~selectedUsed] = 0
+	selectedWeights[~selectedUsed] = 0.0
+	
+	if selectedIndices.max(initial = 0) > 0xff:
+		raise ExportError('Bone index out of range')
+	
+	encodedIndices = selectedIndices.astype(numpy.uint8)
+	encodedWeights = numpy.ascontiguousarray(selectedWeights.astype('<f4')).view(numpy.uint8)
+	return (encodedIndices, encodedWeights)
+
+#
+# The encoding of every vertex attribute of a MeshArrays as stored in a .model vertex buffer,
+# as a MeshArrays of uint8 arrays with one row per vertex.
+#
+def encodeVertexArrays(arrays, vertexFields):
+	def encode(array, dtype):
+		array = numpy.ascontiguousarray(array.astype(dtype, copy = False))
+		return array.view(numpy.uint8).reshape((len(array), array.shape[1] * array.itemsize))
+	
+	encodings = MeshArrays.MeshArrays()
+	encodings.positions = encode(arrays.positions, '<f4')
+	encodings.vertexIds = arrays.vertexIds
+	
+	if vertexFields.hasNormal:
+		encodings.normals = encode(arrays.normals[:, 0:3], '<f4')
+	if vertexFields.hasTangent:
+		encodings.tangents = encode(arrays.tangents[:, 0:3], '<f4')
+	if vertexFields.hasBitangent:
+		encodings.bitangents = encode(arrays.bitangents[:, 0:3], '<f4')
+	if vertexFields.hasColor:
+		encodings.colors = encode(arrays.colors * 255 + 0.5, 'u1')
+	for i in range(vertexFields.uvCount):
+		encodings.uvs.append(encode(arrays.uvs[i], '<f4'))
+	if vertexFields.hasBoneMapping:
+		(encodings.boneIndices, encodings.boneWeights) = encodeBoneMappingArrays(arrays.boneIndices, arrays.boneWeights)
+	
+	return encodings
+
+def encodeFaceArray(faces):
+	if len(faces) > 0 and (faces.min() < 0 or faces.max() > 0xffff):
+		raise ExportError('Face vertex index out of range')
+	return faces.astype('<u2').tobytes()
+
 def encodeVertices(mesh):
 	if mesh.vertexEncodings is not None:
 		return
 	
+	encodings = encodeVertexArrays(objectsToArrays(mesh.vertices, [], mesh.vertexFields), mesh.vertexFields)
+	
+	# The rows of an encoding array, as bytes objects
+	def rows(array):
+		if array is None:
+			return None
+		return numpy.ascontiguousarray(array).view('V%d' % array.shape[1])[:, 0].tolist()
+	
+	positions = rows(encodings.positions)
+	normals = rows(encodings.normals)
+	tangents = rows(encodings.tangents)
+	bitangents = rows(encodings.bitangents)
+	colors = rows(encodings.colors)
+	uvs = [rows(uv) for uv in encodings.uvs]
+	boneIndices = rows(encodings.boneIndices)
+	boneWeights = rows(encodings.boneWeights)
+	
 	mesh.vertexEncodings = []
-	for vertex in mesh.vertices:
+	for (vertexIndex, vertex) in enumerate(mesh.vertices):
 		encoding = ModelFile.VertexEncoding()
 		encoding.vertex = vertex
-		encoding.position = pack('< 3f', vertex.position.x, vertex.position.y, vertex.position.z)
+		encoding.position = positions[vertexIndex]
+		if normals is not None:
+			encoding.normal = normals[vertexIndex]
+		if tangents is not None:
+			encoding.tangent = tangents[vertexIndex]
+		if bitangents is not None:
+			encoding.bitangent = bitangents[vertexIndex]
+		if colors is not None:
+			encoding.color = colors[vertexIndex]
+		encoding.uv = [uv[vertexIndex] for uv in uvs]
+		if boneIndices is not None:
+			encoding.boneIndices = boneIndices[vertexIndex]
+			encoding.boneWeights = boneWeights[vertexIndex]
 		mesh.vertexEncodings.append(encoding)
-	
+
+#
+# The vertex buffer columns of a mesh, as (datum type, datum format, encoded column) tuples.
+#
+def encodedVertexColumns(mesh):
+	columns = []
+	
+	def addColumn(datumType, datumFormat, encodings):
+		columns.append((datumType, datumFormat, b''.join(encodings)))
+	
+	if True:
+		# position is always present
+		addColumn(ModelFile.VertexDatumType.position, ModelFile.VertexDatumFormat.tripleFloat32, (v.position for v in mesh.vertexEncodings))
 	if mesh.vertexFields.hasNormal:
-		for (vertex, encoding) in zip(mesh.vertices, mesh.vertexEncodings):
-			encoding.normal = pack('< 3f', vertex.normal.x, vertex.normal.y, vertex.normal.z)
-	
+		addColumn(ModelFile.VertexDatumType.normal, ModelFile.VertexDatumFormat.tripleFloat32, (v.normal for v in mesh.vertexEncodings))
 	if mesh.vertexFields.hasTangent:
-		for (vertex, encoding) in zip(mesh.vertices, mesh.vertexEncodings):
-			encoding.tangent = pack('< 3f', vertex.tangent.x, vertex.tangent.y, vertex.tangent.z)
-	
+		addColumn(ModelFile.VertexDatumType.tangent, ModelFile.VertexDatumFormat.tripleFloat32, (v.tangent for v in mesh.vertexEncodings))
 	if mesh.vertexFields.hasBitangent:
-		for (vertex, encoding) in zip(mesh.vertices, mesh.vertexEncodings):
-			encoding.bitangent = pack('< 3f', vertex.bitangent.x, vertex.bitangent.y, vertex.bitangent.z)
-	
+		addColumn(ModelFile.VertexDatumType.bitangent, ModelFile.VertexDatumFormat.tripleFloat32, (v.bitangent for v in mesh.vertexEncodings))
 	if mesh.vertexFields.hasColor:
-		for (vertex, encoding) in zip(mesh.vertices, mesh.vertexEncodings):
-			encoding.color = pack('< 4B', *(int(x * 255 + 0.5) for x in vertex.color))
-	
+		addColumn(ModelFile.VertexDatumType.color, ModelFile.VertexDatumFormat.quadFloat8, (v.color for v in mesh.vertexEncodings))
 	for i in range(mesh.vertexFields.uvCount):
-		for (vertex, encoding) in zip(mesh.vertices, mesh.vertexEncodings):
-			encoding.uv.append(pack('< 2f', vertex.uv[i].u, vertex.uv[i].v))
-	
+		datumType = [ModelFile.VertexDatumType.uv0, ModelFile.VertexDatumType.uv1, ModelFile.VertexDatumType.uv2, ModelFile.VertexDatumType.uv3][i]
+		addColumn(datumType, ModelFile.VertexDatumFormat.doubleFloat32, (v.uv[i] for v in mesh.vertexEncodings))
 	if mesh.vertexFields.hasBoneMapping:
-		for (vertex, encoding) in zip(mesh.vertices, mesh.vertexEncodings):
-			encoding.boneIndices, encoding.boneWeights = encodeBoneMapping(vertex.boneMapping)
+		addColumn(ModelFile.VertexDatumType.boneIndices, ModelFile.VertexDatumFormat.quadInt8, (v.boneIndices for v in mesh.vertexEncodings))
+		addColumn(ModelFile.VertexDatumType.boneWeights, ModelFile.VertexDatumFormat.quadFloat32, (v.boneWeights for v in mesh.vertexEncodings))
+	
+	return columns
 
-def writeModel(model):
+#
+# Same as encodedVertexColumns, for the encodings of a mesh stored as MeshArrays.
+# Each column is written straight out of its encoding array.
+#
+def encodedArrayColumns(encodings, vertexFields):
+	columns = []
+	
+	def addColumn(datumType, datumFormat, encoding):
+		columns.append((datumType, datumFormat, memoryview(numpy.ascontiguousarray(encoding).reshape(-1))))
+	
+	if True:
+		# position is always present
+		addColumn(ModelFile.VertexDatumType.position, ModelFile.VertexDatumFormat.tripleFloat32, encodings.positions)
+	if vertexFields.hasNormal:
+		addColumn(ModelFile.VertexDatumType.normal, ModelFile.VertexDatumFormat.tripleFloat32, encodings.normals)
+	if vertexFields.hasTangent:
+		addColumn(ModelFile.VertexDatumType.tangent, ModelFile.VertexDatumFormat.tripleFloat32, encodings.tangents)
+	if vertexFields.hasBitangent:
+		addColumn(ModelFile.VertexDatumType.bitangent, ModelFile.VertexDatumFormat.tripleFloat32, encodings.bitangents)
+	if vertexFields.hasColor:
+		addColumn(ModelFile.VertexDatumType.color, ModelFile.VertexDatumFormat.quadFloat8, encodings.colors)
+	for i in range(vertexFields.uvCount):
+		datumType = [ModelFile.VertexDatumType.uv0, ModelFile.VertexDatumType.uv1, ModelFile.VertexDatumType.uv2, ModelFile.VertexDatumType.uv3][i]
+		addColumn(datumType, ModelFile.VertexDatumFormat.doubleFloat32, encodings.uvs[i])
+	if vertexFields.hasBoneMapping:
+		addColumn(ModelFile.VertexDatumType.boneIndices, ModelFile.VertexDatumFormat.quadInt8, encodings.boneIndices)
+		addColumn(ModelFile.VertexDatumType.boneWeights, ModelFile.VertexDatumFormat.quadFloat32, encodings.boneWeights)
+	
+	return columns
+
+#
+# A blob made up of a list of byte strings, which are written out one after the other
+# rather than joined together. Nested blob lists are flattened.
+#
+class BlobList:
+	def __init__(self, blobs = ()):
+		self.blobs = []
+		self.size = 0
+		for blob in blobs:
+			self.append(blob)
+	
+	def __len__(self):
+		return self.size
+	
+	def append(self, blob):
+		if isinstance(blob, BlobList):
+			self.blobs += blob.blobs
+		else:
+			self.blobs.append(blob)
+		self.size += len(blob)
+	
+	def write(self, stream):
+		for blob in self.blobs:
+			stream.write(blob)
+
+#
+# Lays out the sections of a .model file, as a BlobList of the file contents.
+# Large blobs, such as vertex and face buffers, are referenced rather than copied,
+# so that writing the file takes little memory besides the model itself.
+#
+def encodeModel(model):
 	def pad(blob, size):
 		if len(blob) % size == 0:
 			return blob
 		padding = size - (len(blob) % size)
-		return blob + bytearray(padding)
+		return BlobList([blob, bytes(padding)])
 	
 	def relativizeAddresses(addresses, offset):
 		return { key: address + offset for (key, address) in addresses.items() }
@@ -1047,7 +1368,7 @@ def writeModel(model):
 				len(self.records),
 				self.recordSize,
 			)
-			return b''.join([arrayHeader] + [self.header] + self.records)
+			return BlobList([arrayHeader, self.header] + self.records)
 	
 	class StructArray:
 		def __init__(self, recordSize, recordCount, header = None):
@@ -1070,7 +1391,7 @@ def writeModel(model):
 			if len(self.recordArray.records) != self.expectedRecordCount:
 				raise ExportError('Unexpected record count')
 			
-			return b''.join([self.recordArray.encode()] + self.blobs)
+			return BlobList([self.recordArray.encode()] + self.blobs)
 	
 	class Sections:
 		def __init__(self, sectionCount):
@@ -1105,7 +1426,7 @@ def writeModel(model):
 				9,  # unknown
 				0,  # flags
 			)
-			return header + self.sections.encode()
+			return BlobList([header, self.sections.encode()])
 	
 	def storeMetadata(sections, model):
 		section7 = StructArray(4, 2)
@@ -1175,7 +1496,18 @@ def writeModel(model):
 		return relativizeAddresses(materialAddresses, sectionOffset)
 	
 	def storeMeshGeometry(geometrySection, mesh):
-		encodeVertices(mesh)
+		if mesh.arrays is not None:
+			encodings = mesh.arrays.encodings
+			if encodings is None:
+				encodings = encodeVertexArrays(mesh.arrays, mesh.vertexFields)
+			vertexColumns = encodedArrayColumns(encodings, mesh.vertexFields)
+			faces = mesh.arrays.faces
+		else:
+			encodeVertices(mesh)
+			vertexColumns = encodedVertexColumns(mesh)
+			faces = MeshArrays.faceArray(mesh.faces, mesh.vertices)
+		vertexCount = mesh.vertexCount
+		faceCount = len(faces)
 		
 		vertexFieldArray = RecordArray(20, pack('< 2I',
 			0, # disable cloth physics
@@ -1186,36 +1518,13 @@ def writeModel(model):
 				bufferOffset,
 				datumType,
 				datumFormat,
-				len(mesh.vertices),
+				vertexCount,
 				0, # unknown
 			))
 		
-		if True:
-			# position is always present
-			offset = geometrySection.addBlob(b''.join(v.position for v in mesh.vertexEncodings))
-			addField(offset, ModelFile.VertexDatumType.position, ModelFile.VertexDatumFormat.tripleFloat32)
-		if mesh.vertexFields.hasNormal:
-			offset = geometrySection.addBlob(b''.join(v.normal for v in mesh.vertexEncodings))
-			addField(offset, ModelFile.VertexDatumType.normal, ModelFile.VertexDatumFormat.tripleFloat32)
-		if mesh.vertexFields.hasTangent:
-			offset = geometrySection.addBlob(b''.join(v.tangent for v in mesh.vertexEncodings))
-			addField(offset, ModelFile.VertexDatumType.tangent, ModelFile.VertexDatumFormat.tripleFloat32)
-		if mesh.vertexFields.hasBitangent:
-			offset = geometrySection.addBlob(b''.join(v.bitangent for v in mesh.vertexEncodings))
-			addField(offset, ModelFile.VertexDatumType.bitangent, ModelFile.VertexDatumFormat.tripleFloat32)
-		if mesh.vertexFields.hasColor:
-			offset = geometrySection.addBlob(b''.join(v.color for v in mesh.vertexEncodings))
-			addField(offset, ModelFile.VertexDatumType.color, ModelFile.VertexDatumFormat.quadFloat8)
-		for i in range(mesh.vertexFields.uvCount):
-			offset = geometrySection.addBlob(b''.join(v.uv[i] for v in mesh.vertexEncodings))
-			datumType = [ModelFile.VertexDatumType.uv0, ModelFile.VertexDatumType.uv1, ModelFile.VertexDatumType.uv2, ModelFile.VertexDatumType.uv3][i]
-			addField(offset, datumType, ModelFile.VertexDatumFormat.doubleFloat32)
-		if mesh.vertexFields.hasBoneMapping:
-			indexOffset = geometrySection.addBlob(b''.join(v.boneIndices for v in mesh.vertexEncodings))
-			addField(indexOffset, ModelFile.VertexDatumType.boneIndices, ModelFile.VertexDatumFormat.quadInt8)
-			
-			weightOffset = geometrySection.addBlob(b''.join(v.boneWeights for v in mesh.vertexEncodings))
-			addField(weightOffset, ModelFile.VertexDatumType.boneWeights, ModelFile.VertexDatumFormat.quadFloat32)
+		for (datumType, datumFormat, blob) in vertexColumns:
+			offset = geometrySection.addBlob(blob)
+			addField(offset, datumType, datumFormat)
 		
 		vertexFieldsOffset = geometrySection.addBlob(vertexFieldArray.encode())
 		vertexSetArray = RecordArray(4)
@@ -1224,16 +1533,14 @@ def writeModel(model):
 		
 		
 		
-		vertexIndices = { vertex: index for vertex, index in zip(mesh.vertices, range(len(mesh.vertices))) }
-		encodedFaces = [pack('< 3H', *(vertexIndices[v] for v in f.vertices)) for f in mesh.faces]
-		facesOffset = geometrySection.addBlob(pad(b''.join(encodedFaces), 4))
+		facesOffset = geometrySection.addBlob(pad(encodeFaceArray(faces), 4))
 		
 		faceDescriptorArray = RecordArray(24)
 		faceDescriptorArray.addRecord(pack('< 6I',
 			facesOffset,
 			1, # unknown; datum type?
 			ModelFile.VertexDatumFormat.uint16,
-			3 * len(mesh.faces),
+			3 * faceCount,
 			0, # lod level count
 			0, # lod table offset
 		))
@@ -1385,10 +1692,41 @@ def writeModel(model):
 	
 	return sections.encode()
 
-def writeModelFile(model, filename):
-	data = writeModel(model)
+def writeModelStream(model, stream):
+	encodeModel(model).write(stream)
+
+def writeModel(model):
+	stream = io.BytesIO()
+	writeModelStream(model, stream)
+	return stream.getvalue()
+
+#
+# Wraps the contents of a .model file in the zlib container understood by zlibExtract:
+# the magic "WESYS", the compressed and uncompressed size, and a zlib stream.
+#
+def esysCompress(blobs, compressionLevel):
+	compressor = zlib.compressobj(compressionLevel)
+	compressedBlobs = BlobList()
+	for blob in blobs.blobs:
+		compressedBlobs.append(compressor.compress(blob))
+	compressedBlobs.append(compressor.flush())
+	
+	header = pack('< 3s 5s II', b'\x00\x10\x01', b'WESYS', len(compressedBlobs), len(blobs))
+	return BlobList([header, compressedBlobs])
+
+#
+# Writes the output of encodeModel to a file, zlib compressed if a compressionLevel is given.
+# zlib releases the GIL while compressing, so several models can be compressed on different threads.
+#
+def writeModelBlobs(blobs, filename, compressionLevel = None):
+	if compressionLevel is not None:
+		blobs = esysCompress(blobs, compressionLevel)
 	with open(filename, 'wb') as stream:
-		stream.write(data)
+		blobs.write(stream)
+
+def writeModelFile(model, filename, compressionLevel = None):
+	# Lay out the whole file before creating it, so that a model that fails to encode leaves no partial file
+	writeModelBlobs(encodeModel(model), filename, compressionLevel)
 
 
 
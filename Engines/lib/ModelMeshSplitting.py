@@ -570,13 +570,11 @@ def computeParentBones(bones):
 def meshNeedsSplitting(mesh):
 	return (
 		   (mesh.boneGroup is not None and len(mesh.boneGroup.bones) > BONE_LIMIT_HARD)
-		or len(mesh.vertices) > VERTEX_LIMIT_HARD
-		or len(mesh.faces) > FACE_LIMIT_HARD
+		or mesh.vertexCount > VERTEX_LIMIT_HARD
+		or mesh.faceCount > FACE_LIMIT_HARD
 	)
 
 def encodeModelSplitMeshes(model):
-	model.precomputeVertexEncoding()
-	
 	parentBones = computeParentBones(model.bones)
 	
 	output = ModelFile.ModelFile()
@@ -592,6 +590,7 @@ def encodeModelSplitMeshes(model):
 			output.meshes.append(mesh)
 			continue
 		
+		ModelFile.encodeVertices(mesh)
 		meshes = splitMesh(mesh, parentBones)
 		for submesh in meshes:
 			submesh.extensionHeaders.add("Split-Mesh: %s" % splitMeshIndex)
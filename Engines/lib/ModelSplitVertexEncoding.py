@@ -1,4 +1,6 @@
-from . import ModelFile
+import numpy
+
+from . import MeshArrays, ModelFile
 
 #
 # .model files store mesh geometry as vertices, and faces that are sequences of
@@ -98,11 +100,105 @@ def replaceFaceVertices(faces, replacedVertices):
 		]) for face in faces
 	]
 
+#
+# Same as encodeMeshVertexLoopPreservation, for a mesh stored as MeshArrays.
+# Vertices with the same vertexId are loops of the same vertex.
+#
+def encodeMeshArraysVertexLoopPreservation(mesh):
+	arrays = mesh.arrays
+	encodings = ModelFile.encodeVertexArrays(arrays, mesh.vertexFields)
+	vertexIndices = numpy.arange(arrays.vertexCount)
+	vertexIds = arrays.vertexIds
+	
+	topologicalKeys = [encodings.positions]
+	if mesh.vertexFields.hasBoneMapping:
+		topologicalKeys += [encodings.boneIndices, encodings.boneWeights]
+	topologicalIds = MeshArrays.rowRanks(numpy.concatenate(topologicalKeys, axis = 1))
+	
+	nontopologicalEncodings = []
+	if mesh.vertexFields.hasNormal:
+		nontopologicalEncodings.append(encodings.normals)
+	if mesh.vertexFields.hasColor:
+		nontopologicalEncodings.append(encodings.colors)
+	for i in range(4):
+		if mesh.vertexFields.uvCount > i:
+			nontopologicalEncodings.append(encodings.uvs[i])
+	if mesh.vertexFields.hasTangent:
+		nontopologicalEncodings.append(encodings.tangents)
+	if mesh.vertexFields.hasBitangent:
+		nontopologicalEncodings.append(encodings.bitangents)
+	# The trailing zero column doesn't change the order, but keeps the encoding from being empty
+	nontopologicalEncodings.append(numpy.zeros((arrays.vertexCount, 1), dtype = numpy.uint8))
+	nontopologicalRanks = MeshArrays.rowRanks(numpy.concatenate(nontopologicalEncodings, axis = 1))
+	
+	#
+	# Remove duplicate loops of each vertex: a loop is replaced by the first loop
+	# of the same vertex with the same nontopological encoding.
+	#
+	order = numpy.lexsort((vertexIndices, nontopologicalRanks, vertexIds))
+	sortedIds = vertexIds[order]
+	sortedRanks = nontopologicalRanks[order]
+	isFirstLoop = numpy.concatenate([[True], (sortedIds[1:] != sortedIds[:-1]) | (sortedRanks[1:] != sortedRanks[:-1])])
+	replacedVertices = numpy.empty(arrays.vertexCount, dtype = numpy.intp)
+	replacedVertices[order] = order[numpy.maximum.accumulate(numpy.where(isFirstLoop, numpy.arange(len(order)), 0))]
+	keptVertices = vertexIndices[replacedVertices == vertexIndices]
+	
+	# The nontopological encoding of the first loop of each vertex, after sorting its loops
+	isFirstOfVertex = numpy.concatenate([[True], sortedIds[1:] != sortedIds[:-1]])
+	vertexRanks = numpy.zeros(arrays.vertexCount, dtype = numpy.intp)
+	vertexRanks[sortedIds[isFirstOfVertex]] = sortedRanks[isFirstOfVertex]
+	
+	# The index of the first vertex with each topological key
+	(uniqueTopologicalIds, firstIndices) = numpy.unique(topologicalIds, return_index = True)
+	topologicalKeyOrder = numpy.zeros(len(uniqueTopologicalIds), dtype = numpy.intp)
+	topologicalKeyOrder[uniqueTopologicalIds] = firstIndices
+	
+	#
+	# Vertices are stored in order of first appearance of their topological key;
+	# topologically equivalent vertices in descending order of the nontopological encoding of
+	# their first loop; and the loops of a vertex in order of increasing nontopological encoding.
+	#
+	keptIds = vertexIds[keptVertices]
+	storedVertices = keptVertices[numpy.lexsort((
+		nontopologicalRanks[keptVertices],
+		keptIds,
+		-vertexRanks[keptIds],
+		topologicalKeyOrder[topologicalIds[keptIds]],
+	))]
+	
+	storedIndices = numpy.zeros(arrays.vertexCount, dtype = numpy.intp)
+	storedIndices[storedVertices] = numpy.arange(len(storedVertices))
+	
+	outputArrays = MeshArrays.selectVertices(arrays, storedVertices)
+	outputArrays.encodings = MeshArrays.selectVertices(encodings, storedVertices)
+	outputArrays.faces = storedIndices[replacedVertices[arrays.faces]]
+	# The loops of each vertex are stored next to each other; their vertexId becomes the index of the first one
+	storedIds = outputArrays.vertexIds
+	isFirstStored = numpy.concatenate([[True], storedIds[1:] != storedIds[:-1]])[0:len(storedIds)]
+	outputArrays.vertexIds = numpy.maximum.accumulate(numpy.where(isFirstStored, numpy.arange(len(storedIds)), 0))
+	outputArrays.encodings.vertexIds = outputArrays.vertexIds
+	
+	output = ModelFile.ModelFile.Mesh()
+	output.boneGroup = mesh.boneGroup
+	output.material = mesh.material
+	output.vertexFields = mesh.vertexFields
+	output.boundingBox = mesh.boundingBox
+	output.name = mesh.name
+	output.arrays = outputArrays
+	output.extensionHeaders = mesh.extensionHeaders.copy()
+	output.extensionHeaders.add("vertex-loop-preservation")
+	return output
+
 #
 # Consider all model vertices to be loops of the same vertex when they share a
 # position object pointer.
 #
 def encodeMeshVertexLoopPreservation(mesh):
+	if mesh.arrays is not None:
+		return encodeMeshArraysVertexLoopPreservation(mesh)
+	
+	ModelFile.encodeVertices(mesh)
+	
 	#
 	# Map from topological keys to lists of position objects
 	#
@@ -170,8 +266,6 @@ def encodeMeshVertexLoopPreservation(mesh):
 	return output
 
 def encodeModelVertexLoopPreservation(model):
-	model.precomputeVertexEncoding()
-	
 	output = ModelFile.ModelFile()
 	output.bones = model.bones
 	output.materials = model.materials
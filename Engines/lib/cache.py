@@ -0,0 +1,92 @@
+import os
+import tempfile
+
+#
+# Returns the directory for the named cache, in the "cache" folder next to converter_main.py.
+#
+def cacheDirectory(name):
+	return os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "cache", name)
+
+#
+# A directory of files keyed by string, holding at most maxSize bytes.
+# When it grows bigger than that, the least recently used entries are deleted.
+# Several processes can share a cache directory; a failing cache operation is treated
+# as a cache miss rather than an error, since everything in it can be recomputed.
+#
+class DiskCache:
+	def __init__(self, directory, maxSize):
+		self.directory = directory
+		self.maxSize = maxSize
+		# Total size of the entries as of the last eviction, plus what this process added since.
+		# Lets put skip listing the directory until the cache may have grown too big.
+		self.estimatedSize = None
+	
+	def path(self, key):
+		return os.path.join(self.directory, key)
+	
+	def get(self, key):
+		path = self.path(key)
+		try:
+			with open(path, 'rb') as f:
+				data = f.read()
+			# Mark the entry as recently used
+			os.utime(path)
+		except OSError:
+			return None
+		return data
+	
+	def put(self, key, data):
+		if len(data) > self.maxSize:
+			return
+		
+		try:
+			os.makedirs(self.directory, exist_ok = True)
+			# Write to a temporary file first, so that other processes never see a partial entry
+			(handle, temporaryPath) = tempfile.mkstemp(dir = self.directory, prefix = ".tmp-")
+		except OSError:
+			return
+		
+		try:
+			with os.fdopen(handle, 'wb') as f:
+				f.write(data)
+			os.replace(temporaryPath, self.path(key))
+		except OSError:
+			try:
+				os.remove(temporaryPath)
+			except OSError:
+				pass
+			return
+		
+		if self.estimatedSize is not None:
+			self.estimatedSize += len(data)
+		if self.estimatedSize is None or self.estimatedSize > self.maxSize:
+			self.evict()
+	
+	def evict(self):
+		try:
+			filenames = os.listdir(self.directory)
+		except OSError:
+			return
+		
+		entries = []
+		for filename in filenames:
+			if filename.startswith(".tmp-"):
+				continue
+			try:
+				stat = os.stat(os.path.join(self.directory, filename))
+			except OSError:
+				# Deleted by another process in the meantime
+				continue
+			entries.append((stat.st_mtime, stat.st_size, filename))
+		
+		totalSize = sum(size for (mtime, size, filename) in entries)
+		for (mtime, size, filename) in sorted(entries):
+			if totalSize <= self.maxSize:
+				break
+			try:
+				os.remove(os.path.join(self.directory, filename))
+			except OSError:
+				pass
+			totalSize -= size
+		
+		self.estimatedSize = totalSize
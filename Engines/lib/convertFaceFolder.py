@@ -24,7 +24,7 @@ def parseFpkXml(xmlPath, containingDirectory):
 				output.append(fullPath)
 	return output
 
-def convertBootsFolder(sourceDirectory, destinationDirectory, commonDestinationDirectory):
+def convertBootsFolder(sourceDirectory, destinationDirectory, commonDestinationDirectory, modelCompressionLevel = None):
 	bootsFmdlFilename = ijoin(sourceDirectory, "boots.fmdl")
 	if bootsFmdlFilename is None:
 		print("WARNING: Boots folder '%s' does not contain boots.fmdl" % sourceDirectory)
@@ -37,39 +37,51 @@ def convertBootsFolder(sourceDirectory, destinationDirectory, commonDestinationD
 	open(os.path.join(destinationDirectory, "boots.mtl"), 'wb').write(materialFile)
 	
 	modelFile = fmdl2model.convertFmdl(fmdlFile, fmdlMeshMaterialNames)
-	fmdl2model.saveModel(modelFile, os.path.join(destinationDirectory, "boots.model"))
+	fmdl2model.saveModel(modelFile, os.path.join(destinationDirectory, "boots.model"), modelCompressionLevel)
 
-def convertGlovesFolder(sourceDirectory, destinationDirectory, commonDestinationDirectory):
+def convertGlovesFolder(sourceDirectory, destinationDirectory, commonDestinationDirectory, modelCompressionLevel = None):
 	gloveLFilename = ijoin(sourceDirectory, "glove_l.fmdl")
 	gloveRFilename = ijoin(sourceDirectory, "glove_r.fmdl")
 	
-	fmdls = []
-	if gloveLFilename is None:
-		gloveLFmdlFile = None
-	else:
-		gloveLFmdlFile = fmdl2model.loadFmdl(gloveLFilename)
-		fmdls.append((gloveLFilename, os.path.dirname(gloveLFilename), gloveLFmdlFile))
-	if gloveRFilename is None:
-		gloveRFmdlFile = None
-	else:
-		gloveRFmdlFile = fmdl2model.loadFmdl(gloveRFilename)
-		fmdls.append((gloveRFilename, os.path.dirname(gloveRFilename), gloveRFmdlFile))
-	
-	(materialFile, fmdlMeshMaterialNames) = material.buildMaterials(fmdls, destinationDirectory, commonDestinationDirectory)
+	# Convert the textures of each glove while loading the other
+	textureConverter = material.TextureConverter()
+	try:
+		fmdls = []
+		if gloveLFilename is None:
+			gloveLFmdlFile = None
+		else:
+			gloveLFmdlFile = fmdl2model.loadFmdl(gloveLFilename)
+			textureConverter.startFmdl(gloveLFmdlFile, os.path.dirname(gloveLFilename), destinationDirectory, commonDestinationDirectory)
+			fmdls.append((gloveLFilename, os.path.dirname(gloveLFilename), gloveLFmdlFile))
+		if gloveRFilename is None:
+			gloveRFmdlFile = None
+		else:
+			gloveRFmdlFile = fmdl2model.loadFmdl(gloveRFilename)
+			textureConverter.startFmdl(gloveRFmdlFile, os.path.dirname(gloveRFilename), destinationDirectory, commonDestinationDirectory)
+			fmdls.append((gloveRFilename, os.path.dirname(gloveRFilename), gloveRFmdlFile))
+		
+		(materialFile, fmdlMeshMaterialNames) = material.buildMaterials(fmdls, destinationDirectory, commonDestinationDirectory, textureConverter)
+	finally:
+		textureConverter.close()
 	open(os.path.join(destinationDirectory, "materials.mtl"), 'wb').write(materialFile)
 	
-	if gloveLFmdlFile is not None:
-		modelFile = fmdl2model.convertFmdl(gloveLFmdlFile, fmdlMeshMaterialNames)
-		fmdl2model.saveModel(modelFile, os.path.join(destinationDirectory, "glove_l.model"))
-	if gloveRFmdlFile is not None:
-		modelFile = fmdl2model.convertFmdl(gloveRFmdlFile, fmdlMeshMaterialNames)
-		fmdl2model.saveModel(modelFile, os.path.join(destinationDirectory, "glove_r.model"))
+	modelSaver = fmdl2model.ModelSaver(modelCompressionLevel)
+	try:
+		if gloveLFmdlFile is not None:
+			modelFile = fmdl2model.convertFmdl(gloveLFmdlFile, fmdlMeshMaterialNames)
+			modelSaver.save(modelFile, os.path.join(destinationDirectory, "glove_l.model"))
+		if gloveRFmdlFile is not None:
+			modelFile = fmdl2model.convertFmdl(gloveRFmdlFile, fmdlMeshMaterialNames)
+			modelSaver.save(modelFile, os.path.join(destinationDirectory, "glove_r.model"))
+		modelSaver.wait()
+	finally:
+		modelSaver.close()
 
 def faceDiffFileIsEmpty(faceDiffBin):
 	(xScale, yScale, zScale) = struct.unpack('< 3f', faceDiffBin[8:20])
 	return xScale < 0.1 and yScale < 0.1 and zScale < 0.1
 
-def convertFaceFolder(sourceDirectories, destinationDirectory, commonDestinationDirectory):
+def convertFaceFolder(sourceDirectories, destinationDirectory, commonDestinationDirectory, modelCompressionLevel = None):
 	faceDiffBinFilename = None
 	fmdlFiles = []
 	
@@ -102,65 +114,79 @@ def convertFaceFolder(sourceDirectories, destinationDirectory, commonDestination
 				print("WARNING: Unknown file '%s' referenced by '%s', skipping" % (filename, fpkFilenames[0]))
 				continue
 	
-	fmdls = []
-	for filename in fmdlFiles:
-		containingDirectory = os.path.dirname(filename)
-		fmdlFile = fmdl2model.loadFmdl(filename)
+	# Convert the textures of each fmdl file while loading the next ones
+	textureConverter = material.TextureConverter()
+	try:
+		fmdls = []
+		for filename in fmdlFiles:
+			containingDirectory = os.path.dirname(filename)
+			fmdlFile = fmdl2model.loadFmdl(filename)
+			textureConverter.startFmdl(fmdlFile, containingDirectory, destinationDirectory, commonDestinationDirectory)
+			
+			fmdls.append((filename, containingDirectory, fmdlFile))
 		
-		fmdls.append((filename, containingDirectory, fmdlFile))
-	
-	(materialFile, fmdlMeshMaterialNames) = material.buildMaterials(fmdls, destinationDirectory, commonDestinationDirectory)
+		(materialFile, fmdlMeshMaterialNames) = material.buildMaterials(fmdls, destinationDirectory, commonDestinationDirectory, textureConverter)
+	finally:
+		textureConverter.close()
 	open(os.path.join(destinationDirectory, 'materials.mtl'), 'wb').write(materialFile)
 	
-	for (filename, containingDirectory, fmdlFile) in fmdls:
-		baseName = os.path.basename(filename)[:-5].lower()
-		
-		if 'face_high' in baseName:
-			modelType = 'face_neck'
-			modelSubtype = 'face'
-		elif 'hair_high' in baseName:
-			modelType = 'face_neck'
-			modelSubtype = 'hair'
-		elif 'oral' in baseName:
-			modelType = 'face_neck'
-			modelSubtype = 'oral'
-		elif 'boots' in baseName:
-			modelType = 'parts'
-			modelSubtype = 'body'
-		elif 'glove_l' in baseName:
-			baseName = baseName.replace("glove_l", "gloveL")
-			modelType = 'gloveL'
-			modelSubtype = None
-		elif 'glove_r' in baseName:
-			baseName = baseName.replace("glove_r", "gloveR")
-			modelType = 'gloveR'
-			modelSubtype = None
-		else:
-			modelType = 'parts'
-			modelSubtype = baseName
-		
-		suffixIndex = 0
-		while True:
-			if suffixIndex == 0:
-				suffixComponent = ""
-			else:
-				suffixComponent = "_%s" % suffixIndex
-				suffixIndex += 1
+	modelSaver = fmdl2model.ModelSaver(modelCompressionLevel)
+	try:
+		modelPaths = set()
+		for (filename, containingDirectory, fmdlFile) in fmdls:
+			baseName = os.path.basename(filename)[:-5].lower()
 			
-			if modelSubtype is None:
-				subtypeComponent = ""
+			if 'face_high' in baseName:
+				modelType = 'face_neck'
+				modelSubtype = 'face'
+			elif 'hair_high' in baseName:
+				modelType = 'face_neck'
+				modelSubtype = 'hair'
+			elif 'oral' in baseName:
+				modelType = 'face_neck'
+				modelSubtype = 'oral'
+			elif 'boots' in baseName:
+				modelType = 'parts'
+				modelSubtype = 'body'
+			elif 'glove_l' in baseName:
+				baseName = baseName.replace("glove_l", "gloveL")
+				modelType = 'gloveL'
+				modelSubtype = None
+			elif 'glove_r' in baseName:
+				baseName = baseName.replace("glove_r", "gloveR")
+				modelType = 'gloveR'
+				modelSubtype = None
 			else:
-				subtypeComponent = "_%s" % modelSubtype
+				modelType = 'parts'
+				modelSubtype = baseName
 			
-			typeComponent = modelType.replace("_", "").lower()
+			suffixIndex = 0
+			while True:
+				if suffixIndex == 0:
+					suffixComponent = ""
+				else:
+					suffixComponent = "_%s" % suffixIndex
+					suffixIndex += 1
+				
+				if modelSubtype is None:
+					subtypeComponent = ""
+				else:
+					subtypeComponent = "_%s" % modelSubtype
+				
+				typeComponent = modelType.replace("_", "").lower()
+				
+				modelFilename = "%s%s%s.model" % (typeComponent, subtypeComponent, suffixComponent)
+				modelPath = os.path.join(destinationDirectory, modelFilename)
+				# Models still being written by the model saver don't exist yet
+				if not os.path.exists(modelPath) and modelPath not in modelPaths:
+					break
 			
-			modelFilename = "%s%s%s.model" % (typeComponent, subtypeComponent, suffixComponent)
-			modelPath = os.path.join(destinationDirectory, modelFilename)
-			if not os.path.exists(modelPath):
-				break
-		
-		modelFile = fmdl2model.convertFmdl(fmdlFile, fmdlMeshMaterialNames)
-		fmdl2model.saveModel(modelFile, modelPath)
+			modelPaths.add(modelPath)
+			modelFile = fmdl2model.convertFmdl(fmdlFile, fmdlMeshMaterialNames)
+			modelSaver.save(modelFile, modelPath)
+		modelSaver.wait()
+	finally:
+		modelSaver.close()
 	
 	if faceDiffBinFilename is not None:
 		faceDiffBin = open(faceDiffBinFilename, 'rb').read()
@@ -1,3 +1,4 @@
+import numpy
 import os
 import shutil
 import struct
@@ -5,9 +6,10 @@ import sys
 from PIL import Image
 
 from . import save16, save19
+from .cache import DiskCache, cacheDirectory
 from .convertFaceFolder import convertBootsFolder, convertFaceFolder, convertGlovesFolder
 from .material import convertTextureFile
-from .util import iglob, ijoin
+from .util import iglob, ijoin, indexDirectoryTree, invalidateDirectory
 
 def readString(buffer, offset):
 	data = bytearray()
@@ -21,100 +23,147 @@ def writeString(buffer, offset, string):
 	for i in range(len(data)):
 		buffer[offset + i] = data[i]
 
+#
+# Converts bitfields between two arrays of records of the same size, all at once.
+# byteRanges are (start, end) ranges of bytes that are copied as they are.
+# fields are (byteOffset, bitOffset, bitCount, conversion) entries: each field is read as bits from the
+# little endian 32-bit word at byteOffset of the source record, passed through conversion, and written
+# to the same bits of the destination record. A conversion gets the source values of the field for all
+# records and a dict of per-record parameter arrays, and returns the destination values.
+#
+class BitfieldMap:
+	def __init__(self, recordSize, byteRanges, fields):
+		self.recordSize = recordSize
+		self.byteRanges = byteRanges
+		
+		# One (possibly overlapping) 32-bit field per distinct byte offset
+		wordOffsets = sorted(set(byteOffset for (byteOffset, bitOffset, bitCount, conversion) in fields))
+		self.dtype = numpy.dtype({
+			'names': ["word%i" % byteOffset for byteOffset in wordOffsets],
+			'formats': ['<u4'] * len(wordOffsets),
+			'offsets': wordOffsets,
+			'itemsize': recordSize,
+		})
+		
+		self.fields = [
+			("word%i" % byteOffset, numpy.uint32(bitOffset), numpy.uint32((1 << bitCount) - 1), conversion)
+			for (byteOffset, bitOffset, bitCount, conversion) in fields
+		]
+	
+	# Converts the records in sourceBuffer into destinationBuffer, a writable buffer of the same size
+	def apply(self, sourceBuffer, destinationBuffer, parameters):
+		sourceBytes = numpy.frombuffer(sourceBuffer, dtype = numpy.uint8).reshape(-1, self.recordSize)
+		destinationBytes = numpy.frombuffer(destinationBuffer, dtype = numpy.uint8).reshape(-1, self.recordSize)
+		for (start, end) in self.byteRanges:
+			destinationBytes[:, start:end] = sourceBytes[:, start:end]
+		
+		sourceRecords = numpy.frombuffer(sourceBuffer, dtype = self.dtype)
+		destinationRecords = numpy.frombuffer(destinationBuffer, dtype = self.dtype)
+		for (name, bitOffset, mask, conversion) in self.fields:
+			values = (sourceRecords[name] >> bitOffset) & mask
+			values = numpy.asarray(conversion(values, parameters)).astype(numpy.uint32) & mask
+			destinationRecords[name] = (destinationRecords[name] & ~(mask << bitOffset)) | (values << bitOffset)
+
+def copyField():
+	return lambda values, parameters: values
+
+def constantField(value):
+	return lambda values, parameters: numpy.full(len(values), value)
+
+# Values above maximum don't exist in pes16, and are replaced by default
+def capField(maximum, default):
+	return lambda values, parameters: numpy.where(values > maximum, default, values)
+
+def convertBootsId(bootsId, parameters):
+	# Players without converted boots of their own get one of the standard pes16 boots
+	standardBootsId = numpy.where(bootsId < 39, 0, 55)
+	return numpy.where(parameters["bootsId"] >= 0, parameters["bootsId"], standardBootsId)
+
+def convertGlovesId(glovesId, parameters):
+	standardGlovesId = numpy.minimum(glovesId, 11)
+	return numpy.where(parameters["glovesId"] >= 0, parameters["glovesId"], standardGlovesId)
+
+def convertEditedBits(editedBits, parameters):
+	return numpy.where(parameters["hasFaceModel"], 0x0c, 0x0f)
+
+def convertSkinColor(skinColor, parameters):
+	# reset invisible skin
+	return numpy.where(skinColor == 7, 1, skinColor)
+
+#
+# How the pes16 player aesthetics data is made from the pes19 aesthetics data (the last 72 bytes of a player).
+# Anything not mentioned is kept from the pes16 template player.
+#
+aestheticsMap = BitfieldMap(72, [
+	(12, 19), # body physique
+	(22, 72), # ingame face
+], [
+	(4, 4, 14, convertBootsId), # boots id
+	(4, 18, 14, convertGlovesId), # gloves id
+	(4, 0, 4, convertEditedBits), # edited bits
+	(8, 0, 32, constantField(0)), # base copy id
+	(19, 0, 6, constantField(0)), # wrist tape color
+	(19, 6, 2, constantField(0)), # wrist tape enabled
+	(20, 0, 6, copyField()), # glasses
+	(20, 6, 2, copyField()), # sleeves
+	(21, 0, 2, copyField()), # inners
+	(21, 2, 2, copyField()), # socks
+	(21, 4, 2, copyField()), # undershorts
+	(21, 6, 1, copyField()), # shirttail
+	(21, 7, 1, constantField(0)), # ankle taping
+	(22, 0, 4, constantField(0)), # winter gloves
+	(45, 0, 3, convertSkinColor), # skin color
+	(45, 3, 5, capField(3, 0)), # cheek type
+	(46, 0, 3, capField(5, 0)), # forehead type
+	(46, 3, 5, capField(12, 0)), # facial hair type
+	(47, 0, 3, capField(4, 0)), # laughter lines type
+	(47, 3, 3, capField(6, 0)), # upper eyelid type
+	(48, 0, 3, capField(2, 0)), # lower eyelid type
+	(50, 0, 3, capField(5, 0)), # eyebrow type
+	(50, 5, 2, capField(2, 0)), # neck line type
+	(52, 0, 3, capField(6, 0)), # nose type
+	(53, 0, 3, capField(3, 0)), # upper lip type
+	(53, 3, 3, capField(2, 0)), # lower lip type
+])
+
+#
+# Creates pes16 savedata for a list of players based on pes19 savedata.
+# Each player is a (sourcePlayerData, oldDestinationPlayerData, hasFaceModel, destinationBootsId, destinationGlovesId) tuple,
+# where destinationBootsId and destinationGlovesId can be None to pick a standard pes16 model.
+#
+def convertPlayersSaveData(players):
+	newPlayerData = []
+	for (sourcePlayerData, oldDestinationPlayerData, hasFaceModel, destinationBootsId, destinationGlovesId) in players:
+		(oldPlayerData, oldPlayerAestheticsData) = oldDestinationPlayerData
+		# The old data are views into the shared template save, so copy them
+		playerData = bytearray(oldPlayerData)
+		
+		writeString(playerData, 50, readString(sourcePlayerData, 52)[0:45]) # player name
+		writeString(playerData, 96, readString(sourcePlayerData, 98)[0:15]) # shirt name
+		
+		playerData[23] |= 128
+		#playerData[27] |= 128
+		
+		newPlayerData.append(playerData)
+	
+	sourceAestheticsBuffer = b''.join(bytes(sourcePlayerData[116:]) for (sourcePlayerData, _, _, _, _) in players)
+	aestheticsBuffer = bytearray(b''.join(bytes(oldDestinationPlayerData[1]) for (_, oldDestinationPlayerData, _, _, _) in players))
+	aestheticsMap.apply(sourceAestheticsBuffer, aestheticsBuffer, {
+		"hasFaceModel": numpy.array([hasFaceModel for (_, _, hasFaceModel, _, _) in players], dtype = bool),
+		"bootsId": numpy.array([-1 if bootsId is None else bootsId for (_, _, _, bootsId, _) in players], dtype = numpy.int64),
+		"glovesId": numpy.array([-1 if glovesId is None else glovesId for (_, _, _, _, glovesId) in players], dtype = numpy.int64),
+	})
+	
+	return [
+		(newPlayerData[i], aestheticsBuffer[72 * i : 72 * (i + 1)])
+		for i in range(len(players))
+	]
+
 #
 # Creates pes16 savedata for a player based on pes19 savedata.
 #
 def convertPlayerSaveData(sourcePlayerData, oldDestinationPlayerData, hasFaceModel, destinationBootsId, destinationGlovesId):
-	(oldPlayerData, oldPlayerAestheticsData) = oldDestinationPlayerData
-	playerData = oldPlayerData[:]
-	aestheticsData = oldPlayerAestheticsData[:]
-	
-	sourceAestheticsData = sourcePlayerData[116:]
-	
-	def readBits(byteOffset, bitOffset, bitCount):
-		(word32, ) = struct.unpack('< I', sourceAestheticsData[byteOffset : byteOffset + 4])
-		return (word32 >> bitOffset) & ((1 << bitCount) - 1)
-	
-	def writeBits(byteOffset, bitOffset, bitCount, value):
-		(word32, ) = struct.unpack('< I', aestheticsData[byteOffset : byteOffset + 4])
-		# Mask the bits to be overwritten
-		word32 = word32 & ~(((1 << bitCount) - 1) << bitOffset)
-		# Add the new bits
-		word32 = word32 | (value << bitOffset)
-		aestheticsData[byteOffset : byteOffset + 4] = struct.pack('< I', word32)
-	
-	def cap(maximum, default, value):
-		if value > maximum:
-			return default
-		return value
-	
-	writeString(playerData, 50, readString(sourcePlayerData, 52)[0:45]) # player name
-	writeString(playerData, 96, readString(sourcePlayerData, 98)[0:15]) # shirt name
-	
-	playerData[23] |= 128
-	#playerData[27] |= 128
-	
-	
-	aestheticsData[12 : 19] = sourceAestheticsData[12 : 19] # body physique
-	aestheticsData[22 : 72] = sourceAestheticsData[22 : 72] # ingame face
-	
-	bootsId = readBits(4, 4, 14)
-	glovesId = readBits(4, 18, 14)
-	
-	if destinationBootsId is not None:
-		pass
-	elif bootsId < 39:
-		destinationBootsId = 0
-	else:
-		destinationBootsId = 55
-	writeBits(4, 4, 14, destinationBootsId)
-	
-	if destinationGlovesId is not None:
-		pass
-	elif glovesId == 0:
-		destinationGlovesId = 0
-	elif glovesId < 11:
-		destinationGlovesId = glovesId
-	else:
-		destinationGlovesId = 11
-	writeBits(4, 18, 14, destinationGlovesId)
-	
-	if hasFaceModel:
-		writeBits(4, 0, 4, 0x0c) # edited bits
-	else:
-		writeBits(4, 0, 4, 0x0f) # edited bits
-	
-	writeBits(8, 0, 32, 0) # base copy id
-	writeBits(19, 0, 6, 0) # wrist tape color
-	writeBits(19, 6, 2, 0) # wrist tape enabled
-	writeBits(20, 0, 6, readBits(20, 0, 6)) # glasses
-	writeBits(20, 6, 2, readBits(20, 6, 2)) # sleeves
-	writeBits(21, 0, 2, readBits(21, 0, 2)) # inners
-	writeBits(21, 2, 2, readBits(21, 2, 2)) # socks
-	writeBits(21, 4, 2, readBits(21, 4, 2)) # undershorts
-	writeBits(21, 6, 1, readBits(21, 6, 1)) # shirttail
-	writeBits(21, 7, 1, 0) # ankle taping
-	writeBits(22, 0, 4, 0) # winter gloves
-	
-	skinColor = readBits(45, 0, 3)
-	if skinColor == 7:
-		# reset invisible skin
-		skinColor = 1
-	writeBits(45, 0, 3, skinColor)
-	
-	writeBits(45, 3, 5, cap(3, 0, readBits(45, 3, 5))) # cheek type
-	writeBits(46, 0, 3, cap(5, 0, readBits(46, 0, 3))) # forehead type
-	writeBits(46, 3, 5, cap(12, 0, readBits(46, 3, 5))) # facial hair type
-	writeBits(47, 0, 3, cap(4, 0, readBits(47, 0, 3))) # laughter lines type
-	writeBits(47, 3, 3, cap(6, 0, readBits(47, 3, 3))) # upper eyelid type
-	writeBits(48, 0, 3, cap(2, 0, readBits(48, 0, 3))) # lower eyelid type
-	writeBits(50, 0, 3, cap(5, 0, readBits(50, 0, 3))) # eyebrow type
-	writeBits(50, 5, 2, cap(2, 0, readBits(50, 5, 2))) # neck line type
-	writeBits(52, 0, 3, cap(6, 0, readBits(52, 0, 3))) # nose type
-	writeBits(53, 0, 3, cap(3, 0, readBits(53, 0, 3))) # upper lip type
-	writeBits(53, 3, 3, cap(2, 0, readBits(53, 3, 3))) # lower lip type
-	
-	return (playerData, aestheticsData)
+	return convertPlayersSaveData([(sourcePlayerData, oldDestinationPlayerData, hasFaceModel, destinationBootsId, destinationGlovesId)])[0]
 
 def mkdir(containingDirectory, name):
 	existingDirectory = ijoin(containingDirectory, name)
@@ -122,15 +171,17 @@ def mkdir(containingDirectory, name):
 		return existingDirectory
 	newDirectory = os.path.join(containingDirectory, name)
 	os.mkdir(newDirectory)
+	invalidateDirectory(containingDirectory)
 	return newDirectory
 
 #
-# Converts a player in a pes19 export directory into a pes16 directory, and creates the save data for that player.
+# Converts a player in a pes19 export directory into a pes16 directory.
 # If possible, this will create a single face folder containing the entire model.
 # If the pes19 player doesn't have a face folder (and therefore has an ingame face), this will instead
 # create boots and gloves folders.
+# Returns the (hasFaceModel, bootsId, glovesId) settings needed to create the save data for that player.
 #
-def convertPlayer(sourceDirectory, destinationDirectory, relativePlayerId, bootsGlovesBaseId, sourcePlayerData, oldDestinationPlayerData):
+def convertPlayer(sourceDirectory, destinationDirectory, relativePlayerId, bootsGlovesBaseId, sourcePlayerData, modelCompressionLevel = None):
 	(bootsGlovesIdData, ) = struct.unpack('< I', sourcePlayerData[120 : 124])
 	sourceBootsId = (bootsGlovesIdData >> 4) & ((1 << 14) - 1)
 	sourceGlovesId = (bootsGlovesIdData >> 18) & ((1 << 14) - 1)
@@ -191,7 +242,7 @@ def convertPlayer(sourceDirectory, destinationDirectory, relativePlayerId, boots
 			sourceModelDirectories.append(sourceGloveDirectory)
 		
 		faceDirectory = mkdir(mkdir(destinationDirectory, "Faces"), os.path.basename(sourceFaceDirectory))
-		convertFaceFolder(sourceModelDirectories, faceDirectory, commonDirectory)
+		convertFaceFolder(sourceModelDirectories, faceDirectory, commonDirectory, modelCompressionLevel)
 		
 		portraitFilename = ijoin(sourceFaceDirectory, "portrait.dds")
 		if portraitFilename is not None:
@@ -212,7 +263,7 @@ def convertPlayer(sourceDirectory, destinationDirectory, relativePlayerId, boots
 			if len(bootsDirectoryTitle) > 0:
 				bootsDirectoryName += " - %s" % bootsDirectoryTitle
 			destinationBootsDirectory = mkdir(mkdir(destinationDirectory, "Boots"), bootsDirectoryName)
-			convertBootsFolder(sourceBootDirectory, destinationBootsDirectory, commonDirectory)
+			convertBootsFolder(sourceBootDirectory, destinationBootsDirectory, commonDirectory, modelCompressionLevel)
 		
 		if sourceGloveDirectory is not None:
 			glovesId = bootsGlovesBaseId + relativePlayerId
@@ -221,7 +272,7 @@ def convertPlayer(sourceDirectory, destinationDirectory, relativePlayerId, boots
 			if len(gloveDirectoryTitle) > 0:
 				gloveDirectoryName += " - %s" % gloveDirectoryTitle
 			destinationGlovesDirectory = mkdir(mkdir(destinationDirectory, "Gloves"), gloveDirectoryName)
-			convertGlovesFolder(sourceGloveDirectory, destinationGlovesDirectory, commonDirectory)
+			convertGlovesFolder(sourceGloveDirectory, destinationGlovesDirectory, commonDirectory, modelCompressionLevel)
 		
 		hasFaceModel = False
 	
@@ -238,12 +289,7 @@ def convertPlayer(sourceDirectory, destinationDirectory, relativePlayerId, boots
 				portraitsDirectory = mkdir(destinationDirectory, "Portraits")
 				shutil.copy(portraitFilenames[0], os.path.join(portraitsDirectory, "player_XXX%02i.dds" % relativePlayerId))
 	
-	#
-	# Convert save data, lookup boots and gloves ID
-	#
-	newDestinationPlayerData = convertPlayerSaveData(sourcePlayerData, oldDestinationPlayerData, hasFaceModel, bootsId, glovesId)
-	
-	return newDestinationPlayerData
+	return (hasFaceModel, bootsId, glovesId)
 
 
 def getTeamName(sourceDirectory):
@@ -299,6 +345,7 @@ def convertKitTextureFile(kitTextureFile, destinationDirectory):
 		maskImage.save(maskImageFilename)
 		convertTextureFile(maskImageFilename, destinationDirectory)
 		os.remove(maskImageFilename)
+		invalidateDirectory(destinationDirectory)
 	else:
 		convertTextureFile(kitTextureFile, destinationDirectory)
 
@@ -372,7 +419,42 @@ def convertTeamFiles(sourceDirectory, destinationDirectory):
 			else:
 				convertKitTextureFile(kitTexturePath, destinationKitTextureDirectory)
 
-def convertTeam(sourceDirectory, sourceSaveFile, destinationDirectory):
+#
+# Decrypts the pes19 source save and the pes16 template save and indexes their players.
+# None of this depends on the team, so it can be loaded once and passed to every convertTeam call.
+#
+def loadSaveData(sourceSaveFile):
+	# Decrypted saves are kept between runs, so unchanged savefiles don't need to be decrypted again
+	saveCache = DiskCache(cacheDirectory("saves"), 256 * 1024 * 1024)
+	
+	sourceSave = save19.SaveFile()
+	sourceSave.load(sourceSaveFile, saveCache)
+	
+	destinationSave = save16.SaveFile()
+	destinationSave.load(os.path.join(os.path.dirname(os.path.realpath(__file__)), "EDIT00000000_16"), saveCache)
+	
+	sourcePlayers = save19.loadPlayers(sourceSave.payload)
+	oldDestinationPlayers = save16.loadPlayers(destinationSave.payload)
+	
+	return (sourcePlayers, destinationSave, oldDestinationPlayers)
+
+#
+# Writes converted players into a copy of the pes16 template save, and saves it as filename.
+# The players of several teams can be saved together.
+#
+def saveTeamPlayers(saveData, players, filename):
+	(sourcePlayers, templateSave, oldDestinationPlayers) = saveData
+	# The template save is shared with other teams, so write the players into a copy of it
+	destinationSave = templateSave.copy()
+	# The template's player index is valid for its copies as well
+	save16.savePlayers(destinationSave.payload, players, oldDestinationPlayers)
+	destinationSave.save(filename)
+
+#
+# Converts a pes19 export directory into a pes16 one, and returns the new pes16 save data of its players.
+# If writeSave is set, a pes16 savefile with these players is created in the destination directory.
+#
+def convertTeam(sourceDirectory, sourceSaveFile, destinationDirectory, saveData = None, writeSave = True, modelCompressionLevel = None):
 	teamName = getTeamName(sourceDirectory)
 	
 	sourceTeamId = getTeamId(os.path.join(os.path.dirname(os.path.realpath(__file__)), "teams_list_19.txt"), teamName)
@@ -382,16 +464,16 @@ def convertTeam(sourceDirectory, sourceSaveFile, destinationDirectory):
 	
 	print("Converting team %i - /%s/" % (sourceTeamId, teamName))
 	
-	print("  Loading save data")
-	sourceSave = save19.SaveFile()
-	sourceSave.load(sourceSaveFile)
+	# Everything in the export gets looked up many times, so list it all once
+	indexDirectoryTree(sourceDirectory)
 	
-	destinationSave = save16.SaveFile()
-	destinationSave.load(os.path.join(os.path.dirname(os.path.realpath(__file__)), "EDIT00000000_16"))
+	if saveData is None:
+		print("  Loading save data")
+		saveData = loadSaveData(sourceSaveFile)
 	
-	sourcePlayers = save19.loadPlayers(sourceSave.payload)
-	oldDestinationPlayers = save16.loadPlayers(destinationSave.payload)
-	newDestinationPlayers = {}
+	(sourcePlayers, templateSave, oldDestinationPlayers) = saveData
+	destinationPlayerIds = []
+	playerSaveData = []
 	
 	for i in range(23):
 		print("  Converting player %02i" % (i + 1))
@@ -410,14 +492,20 @@ def convertTeam(sourceDirectory, sourceSaveFile, destinationDirectory):
 		if oldDestinationPlayerData is None or oldDestinationPlayerAestheticsData is None:
 			print("ERROR: Incomplete player %s found in pes16 save" % destinationPlayerId)
 		
-		newDestinationPlayers[destinationPlayerId] = convertPlayer(
+		(hasFaceModel, bootsId, glovesId) = convertPlayer(
 			sourceDirectory,
 			destinationDirectory,
 			i + 1,
 			bootsGlovesBaseId,
 			sourcePlayer,
-			oldDestinationPlayer,
+			modelCompressionLevel,
 		)
+		
+		destinationPlayerIds.append(destinationPlayerId)
+		playerSaveData.append((sourcePlayer, oldDestinationPlayer, hasFaceModel, bootsId, glovesId))
+	
+	# Convert the save data of the whole team in one go
+	newDestinationPlayers = dict(zip(destinationPlayerIds, convertPlayersSaveData(playerSaveData)))
 	
 	print("  Converting kits")
 	commonDirectory = ijoin(destinationDirectory, "Common")
@@ -426,9 +514,11 @@ def convertTeam(sourceDirectory, sourceSaveFile, destinationDirectory):
 	
 	convertTeamFiles(sourceDirectory, destinationDirectory)
 	
-	print("  Creating save")
-	save16.savePlayers(destinationSave.payload, newDestinationPlayers)
-	destinationSave.save(os.path.join(destinationDirectory, "EDIT00000000"))
+	if writeSave:
+		print("  Creating save")
+		saveTeamPlayers(saveData, newDestinationPlayers, os.path.join(destinationDirectory, "EDIT00000000"))
+	
+	return newDestinationPlayers
 
 if __name__ == "__main__":
 	if len(sys.argv) != 4:
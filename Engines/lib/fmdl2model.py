@@ -1,6 +1,7 @@
+import concurrent.futures
 import numpy
 from . import FmdlAntiBlur, FmdlFile, FmdlMeshSplitting, FmdlSplitVertexEncoding
-from . import ModelFile, ModelMeshSplitting, ModelSplitVertexEncoding
+from . import MeshArrays, ModelFile, ModelMeshSplitting, ModelSplitVertexEncoding
 from . import PesSkeletonData, Skeleton
 
 missingBones = {
@@ -73,58 +74,34 @@ def convertMesh(fmdlMesh, fmdlModelBones):
 		uvMapsToInclude.append(i)
 		modelMesh.vertexFields.uvCount += 1
 	
-	fmdlModelPositions = {}
-	fmdlModelVertices = {}
-	modelMesh.vertices = []
-	for fmdlVertex in fmdlMesh.vertices:
-		modelVertex = ModelFile.ModelFile.Vertex()
-		
-		if fmdlVertex.position in fmdlModelPositions:
-			modelVertex.position = fmdlModelPositions[fmdlVertex.position]
-		else:
-			modelVertex.position = ModelFile.ModelFile.Vector3(fmdlVertex.position.x, fmdlVertex.position.y, fmdlVertex.position.z)
-			fmdlModelPositions[fmdlVertex.position] = modelVertex.position
-		
-		if modelMesh.vertexFields.hasNormal:
-			modelVertex.normal = ModelFile.ModelFile.Vector3(fmdlVertex.normal.x, fmdlVertex.normal.y, fmdlVertex.normal.z)
-		if modelMesh.vertexFields.hasTangent:
-			modelVertex.tangent = ModelFile.ModelFile.Vector3(fmdlVertex.tangent.x, fmdlVertex.tangent.y, fmdlVertex.tangent.z)
-		
-		for uvMap in uvMapsToInclude:
-			modelVertex.uv.append(ModelFile.ModelFile.Vector2(fmdlVertex.uv[uvMap].u, fmdlVertex.uv[uvMap].v))
-		
-		if modelMesh.vertexFields.hasBoneMapping:
-			modelVertex.boneMapping = {}
-			for (bone, weight) in fmdlVertex.boneMapping.items():
-				boneIndex = fmdlBoneIndices[bone]
-				if boneIndex not in modelVertex.boneMapping:
-					modelVertex.boneMapping[boneIndex] = 0
-				modelVertex.boneMapping[boneIndex] += weight
-		
-		modelMesh.vertices.append(modelVertex)
-		fmdlModelVertices[fmdlVertex] = modelVertex
-	
-	modelMesh.faces = []
-	for fmdlFace in fmdlMesh.faces:
-		modelMesh.faces.append(ModelFile.ModelFile.Face(*reversed([fmdlModelVertices[fmdlVertex] for fmdlVertex in fmdlFace.vertices])))
-	
-	if len(modelMesh.vertices) == 0:
+	fmdlArrays = fmdlMesh.geometryArrays()
+	
+	arrays = MeshArrays.MeshArrays()
+	arrays.positions = fmdlArrays.positions
+	arrays.vertexIds = fmdlArrays.vertexIds
+	if modelMesh.vertexFields.hasNormal:
+		arrays.normals = fmdlArrays.normals[:, 0:3]
+	if modelMesh.vertexFields.hasTangent:
+		arrays.tangents = fmdlArrays.tangents[:, 0:3]
+	arrays.uvs = [fmdlArrays.uvs[uvMap] for uvMap in uvMapsToInclude]
+	if modelMesh.vertexFields.hasBoneMapping:
+		# Maps fmdl bone group indices to model bone group indices; the last entry maps unused influence slots to -1
+		boneIndexTable = numpy.array([fmdlBoneIndices[fmdlBone] for fmdlBone in fmdlMesh.boneGroup.bones] + [-1], dtype = numpy.int32)
+		(arrays.boneIndices, arrays.boneWeights) = MeshArrays.mergeDuplicateBones(boneIndexTable[fmdlArrays.boneIndices], fmdlArrays.boneWeights)
+	arrays.faces = fmdlArrays.faces[:, ::-1]
+	modelMesh.arrays = arrays
+	
+	if arrays.vertexCount == 0:
 		modelMesh.boundingBox = ModelFile.ModelFile.BoundingBox(
 			ModelFile.ModelFile.Vector3(0, 0, 0),
 			ModelFile.ModelFile.Vector3(0, 0, 0),
 		)
 	else:
+		(minX, minY, minZ) = arrays.positions.min(axis = 0).tolist()
+		(maxX, maxY, maxZ) = arrays.positions.max(axis = 0).tolist()
 		modelMesh.boundingBox = ModelFile.ModelFile.BoundingBox(
-			ModelFile.ModelFile.Vector3(
-				min(vertex.position.x for vertex in modelMesh.vertices),
-				min(vertex.position.y for vertex in modelMesh.vertices),
-				min(vertex.position.z for vertex in modelMesh.vertices),
-			),
-			ModelFile.ModelFile.Vector3(
-				max(vertex.position.x for vertex in modelMesh.vertices),
-				max(vertex.position.y for vertex in modelMesh.vertices),
-				max(vertex.position.z for vertex in modelMesh.vertices),
-			),
+			ModelFile.ModelFile.Vector3(minX, minY, minZ),
+			ModelFile.ModelFile.Vector3(maxX, maxY, maxZ),
 		)
 	
 	return modelMesh
@@ -157,17 +134,18 @@ def convertFmdl(fmdl, fmdlMeshMaterialNames):
 			ModelFile.ModelFile.Vector3(0, 0, 0),
 		)
 	else:
+		corners = numpy.array([
+			[
+				(mesh.boundingBox.min.x, mesh.boundingBox.min.y, mesh.boundingBox.min.z),
+				(mesh.boundingBox.max.x, mesh.boundingBox.max.y, mesh.boundingBox.max.z),
+			]
+			for mesh in modelFile.meshes
+		])
+		(minX, minY, minZ) = corners[:, 0].min(axis = 0).tolist()
+		(maxX, maxY, maxZ) = corners[:, 1].max(axis = 0).tolist()
 		modelFile.boundingBox = ModelFile.ModelFile.BoundingBox(
-			ModelFile.ModelFile.Vector3(
-				min(mesh.boundingBox.min.x for mesh in modelFile.meshes),
-				min(mesh.boundingBox.min.y for mesh in modelFile.meshes),
-				min(mesh.boundingBox.min.z for mesh in modelFile.meshes),
-			),
-			ModelFile.ModelFile.Vector3(
-				max(mesh.boundingBox.max.x for mesh in modelFile.meshes),
-				max(mesh.boundingBox.max.y for mesh in modelFile.meshes),
-				max(mesh.boundingBox.max.z for mesh in modelFile.meshes),
-			),
+			ModelFile.ModelFile.Vector3(minX, minY, minZ),
+			ModelFile.ModelFile.Vector3(maxX, maxY, maxZ),
 		)
 	
 	materials = set()
@@ -181,7 +159,7 @@ def convertFmdl(fmdl, fmdlMeshMaterialNames):
 
 def loadFmdl(filename):
 	fmdlFile = FmdlFile.FmdlFile()
-	fmdlFile.readFile(filename)
+	fmdlFile.readFile(filename, lazy = True)
 	
 	fmdlFile = FmdlMeshSplitting.decodeFmdlSplitMeshes(fmdlFile)
 	fmdlFile = FmdlSplitVertexEncoding.decodeFmdlVertexLoopPreservation(fmdlFile)
@@ -189,8 +167,36 @@ def loadFmdl(filename):
 	
 	return fmdlFile
 
-def saveModel(modelFile, filename):
+def encodeModel(modelFile):
 	modelFile = ModelSplitVertexEncoding.encodeModelVertexLoopPreservation(modelFile)
 	modelFile = ModelMeshSplitting.encodeModelSplitMeshes(modelFile)
 	
-	ModelFile.writeModelFile(modelFile, filename)
+	return ModelFile.encodeModel(modelFile)
+
+def saveModel(modelFile, filename, compressionLevel = None):
+	ModelFile.writeModelBlobs(encodeModel(modelFile), filename, compressionLevel)
+
+#
+# Saves the models of a folder, compressing and writing them on worker threads
+# while the next model gets converted. wait() waits for all models to be written,
+# and raises the first error that occurred while writing them.
+# close() drops the models not yet being written, for when the folder fails to convert;
+# call it in a finally block so that no model is written after that.
+#
+class ModelSaver:
+	def __init__(self, compressionLevel = None, maxWorkers = 2):
+		self.compressionLevel = compressionLevel
+		self.executor = concurrent.futures.ThreadPoolExecutor(maxWorkers)
+		self.futures = []
+	
+	def save(self, modelFile, filename):
+		blobs = encodeModel(modelFile)
+		self.futures.append(self.executor.submit(ModelFile.writeModelBlobs, blobs, filename, self.compressionLevel))
+	
+	def wait(self):
+		self.executor.shutdown(wait = True)
+		for future in self.futures:
+			future.result()
+	
+	def close(self):
+		self.executor.shutdown(wait = True, cancel_futures = True)
@@ -1,11 +1,43 @@
+import concurrent.futures
+import hashlib
+import io
 import os
 import re
 import subprocess
+import tempfile
 from xml.etree import ElementTree
 from PIL import Image
 
-from .util import iglob, ijoin
-from . import Ftex
+from .cache import DiskCache, cacheDirectory
+from .util import iglob, ijoin, invalidateDirectory
+from . import Dds, Ftex
+
+# Bump this when the output of texture conversion changes, so that old cache entries are ignored
+textureCacheFormatVersion = 1
+
+#
+# Converted textures are kept between runs, keyed by the contents of their source file,
+# so that textures shared between exports and players, or converted again on a rerun,
+# only get converted once. None disables the cache.
+#
+textureCache = DiskCache(cacheDirectory("textures"), 1024 * 1024 * 1024)
+
+def setTextureCacheSize(maxSize):
+	global textureCache
+	if maxSize > 0:
+		textureCache = DiskCache(cacheDirectory("textures"), maxSize)
+	else:
+		textureCache = None
+
+#
+# Number of threads each TextureConverter converts textures on.
+# Processes that already run one per cpu core, such as --jobs workers, set this to 1.
+#
+textureConversionWorkers = min(4, os.cpu_count() or 1)
+
+def setTextureConversionWorkers(workers):
+	global textureConversionWorkers
+	textureConversionWorkers = workers
 
 class ModelTexture:
 	def __init__(self, path, settings):
@@ -37,6 +69,43 @@ def run(command):
 	result = subprocess.run(command, capture_output = True, text = True)
 	return result.stdout
 
+#
+# Converts a texture file to a DXT5 .dds file with imagemagick.
+# Returns False if imagemagick isn't installed.
+#
+def runMagick(sourceFilename, destinationFilename):
+	try:
+		run(["magick", "convert", sourceFilename, "-format", "dds", "-define", "dds:compression=dxt5", destinationFilename])
+	except FileNotFoundError:
+		return False
+	return True
+
+#
+# Converts the contents of a texture file into the contents of a .dds file, in memory.
+# Returns None if that isn't possible.
+#
+def convertTextureData(sourceFilename, sourceData):
+	if sourceFilename.lower().endswith('.ftex'):
+		ddsBuffer = Ftex.ftexBufferToDdsBuffer(sourceData)
+	elif sourceFilename.lower().endswith('.dds'):
+		ddsBuffer = sourceData
+	else:
+		try:
+			with Image.open(io.BytesIO(sourceData)) as image:
+				ddsBuffer = Dds.encodeDxt5(image)
+		except OSError:
+			return None
+	
+	# Transcode BC7 textures to DXT5 in memory, so that the file gets written only once
+	if ddsBuffer is not None:
+		ddsHeader = Dds.parseDdsHeader(ddsBuffer)
+		if ddsHeader is not None and ddsHeader.format == 'BC7':
+			dxt5Buffer = Dds.transcodeBc7ToDxt5(ddsBuffer)
+			if dxt5Buffer is not None:
+				ddsBuffer = dxt5Buffer
+	
+	return ddsBuffer
+
 def convertTextureFile(sourceFilename, destinationDirectory, basename = None):
 	if basename is None:
 		basename = os.path.basename(sourceFilename)
@@ -47,31 +116,92 @@ def convertTextureFile(sourceFilename, destinationDirectory, basename = None):
 		destinationName = basename[:pos]
 	
 	destinationFilename = os.path.join(destinationDirectory, "%s.dds" % destinationName)
-	if sourceFilename.lower().endswith('.ftex'):
-		Ftex.ftexToDds(sourceFilename, destinationFilename)
-	elif sourceFilename.lower().endswith('.dds'):
-		open(destinationFilename, 'wb').write(open(sourceFilename, 'rb').read())
-	else:
-		run(["magick", "convert", sourceFilename, "-format", "dds", "-define", "dds:compression=dxt5", destinationFilename])
+	sourceData = open(sourceFilename, 'rb').read()
 	
-	identifyData = run(["magick", "identify", "-verbose", destinationFilename])
-	
-	if "Compression: BC7" in identifyData:
+	# Other than BC7 ones, .dds files are only copied, so caching them wouldn't save any work
+	if sourceFilename.lower().endswith('.dds'):
+		sourceHeader = Dds.parseDdsHeader(sourceData)
+		useCache = sourceHeader is not None and sourceHeader.format == 'BC7'
+	else:
+		useCache = True
+	
+	ddsBuffer = None
+	cacheKey = None
+	if useCache and textureCache is not None:
+		cacheKey = "texture-%i-%s-%s" % (
+			textureCacheFormatVersion,
+			os.path.splitext(sourceFilename)[1].lower().lstrip('.'),
+			hashlib.sha256(sourceData).hexdigest(),
+		)
+		ddsBuffer = textureCache.get(cacheKey)
+	
+	if ddsBuffer is None:
+		ddsBuffer = convertTextureData(sourceFilename, sourceData)
+		# BC7 textures that still need imagemagick, such as texture arrays, would only cache a copy of the source
+		if ddsBuffer is not None and cacheKey is not None:
+			bufferHeader = Dds.parseDdsHeader(ddsBuffer)
+			if bufferHeader is None or bufferHeader.format != 'BC7':
+				textureCache.put(cacheKey, ddsBuffer)
+	
+	if ddsBuffer is not None:
+		open(destinationFilename, 'wb').write(ddsBuffer)
+		recordFileDigest(destinationFilename, hashlib.sha256(ddsBuffer).digest())
+		# Only the header is needed to tell the format and dimensions; this doesn't decode the image
+		ddsHeader = Dds.parseDdsHeader(ddsBuffer)
+	else:
+		if not sourceFilename.lower().endswith(('.ftex', '.dds')):
+			# Formats that PIL can't read still go through imagemagick
+			if not runMagick(sourceFilename, destinationFilename):
+				print("WARNING: Texture '%s' needs ImageMagick to be converted, skipping" % sourceFilename)
+		ddsHeader = Dds.readDdsHeader(destinationFilename)
+	
+	# BC7 textures that can't be transcoded in memory, such as texture arrays, still go through imagemagick
+	if ddsHeader is not None and ddsHeader.format == 'BC7':
 		tempDxt5Filename = os.path.join(destinationDirectory, "%s_temp_dxt5.dds" % destinationName)
 		
-		run(["magick", "convert", destinationFilename, "-format", "dds", "-define", "dds:compression=dxt5", tempDxt5Filename])
-		os.remove(destinationFilename)
-		os.rename(tempDxt5Filename, destinationFilename)
-	
-	dimensions = re.search("Geometry: ([0-9]+)x([0-9]+)\\+.*", identifyData)
-	if dimensions is not None:
-		width = int(dimensions.group(1))
-		height = int(dimensions.group(2))
+		if runMagick(destinationFilename, tempDxt5Filename) and os.path.exists(tempDxt5Filename):
+			os.remove(destinationFilename)
+			os.rename(tempDxt5Filename, destinationFilename)
+		else:
+			print("WARNING: Texture '%s' needs ImageMagick to be converted to DXT5, leaving it as BC7" % sourceFilename)
+	
+	if ddsHeader is not None:
+		width = ddsHeader.width
+		height = ddsHeader.height
 		if (width & (width - 1)) > 0 or (height & (height - 1)) > 0:
 			print("WARNING: Texture '%s' has invalid dimensions %sx%s, this will not work in PES" % (sourceFilename, width, height))
 	
+	invalidateDirectory(destinationDirectory)
 	return destinationFilename
 
+#
+# Content digests of converted files, so that makeUniqueSuffixForFiles can tell whether two files
+# are identical without reading them again. convertTextureFile records the digest of every file it writes.
+# Entries remember the size and modification time of the file they were made for,
+# so that files written by anything else get hashed again when they are next compared.
+#
+fileDigests = {}
+
+def fileDigestKey(path):
+	return os.path.normcase(os.path.abspath(path))
+
+def recordFileDigest(path, digest):
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return
+	fileDigests[fileDigestKey(path)] = (stat.st_size, stat.st_mtime_ns, digest)
+
+def fileDigest(path):
+	stat = os.stat(path)
+	entry = fileDigests.get(fileDigestKey(path))
+	if entry is not None and entry[0:2] == (stat.st_size, stat.st_mtime_ns):
+		return entry[2]
+	
+	digest = hashlib.sha256(open(path, 'rb').read()).digest()
+	fileDigests[fileDigestKey(path)] = (stat.st_size, stat.st_mtime_ns, digest)
+	return digest
+
 def makeUniqueSuffixForFiles(directory, extension, basenamesToMap):
 	def filename(basename, suffixIndex):
 		if suffixIndex == 0:
@@ -79,6 +209,11 @@ def makeUniqueSuffixForFiles(directory, extension, basenamesToMap):
 		else:
 			return "%s_%s%s" % (basename, suffixIndex, extension)
 	
+	newDigests = {}
+	for (basename, sourceFile) in basenamesToMap.items():
+		if sourceFile is not None:
+			newDigests[basename] = fileDigest(sourceFile)
+	
 	suffixIndex = 0
 	while True:
 		conflictFound = False
@@ -89,12 +224,9 @@ def makeUniqueSuffixForFiles(directory, extension, basenamesToMap):
 					conflictFound = True
 					break
 			else:
-				if existingFilename is not None:
-					existingContent = open(existingFilename, 'rb').read()
-					newContent = open(sourceFile, 'rb').read()
-					if existingContent != newContent:
-						conflictFound = True
-						break
+				if existingFilename is not None and fileDigest(existingFilename) != newDigests[basename]:
+					conflictFound = True
+					break
 		
 		if not conflictFound:
 			break
@@ -105,16 +237,113 @@ def makeUniqueSuffixForFiles(directory, extension, basenamesToMap):
 		existingFilename = ijoin(directory, filename(basename, suffixIndex))
 		if existingFilename is not None:
 			os.remove(sourceFile)
+			fileDigests.pop(fileDigestKey(sourceFile), None)
 		else:
-			os.rename(sourceFile, os.path.join(directory, filename(basename, suffixIndex)))
+			finalFilename = os.path.join(directory, filename(basename, suffixIndex))
+			os.rename(sourceFile, finalFilename)
+			# Renaming keeps the size and modification time, so the digest stays valid
+			entry = fileDigests.pop(fileDigestKey(sourceFile), None)
+			if entry is not None:
+				fileDigests[fileDigestKey(finalFilename)] = entry
 		finalFilenames[basename] = filename(basename, suffixIndex)
+	invalidateDirectory(directory)
 	
 	if suffixIndex == 0:
 		return ""
 	else:
 		return "_%s" % suffixIndex
 
-def convertTexture(sourceDirectory, filename, putInCommonDirectory, faceDirectory, commonDirectory):
+#
+# A texture conversion started by a TextureConverter.
+# result() waits for the conversion, gives the converted files their final name,
+# and returns (the output texture filename, the .mtl texture path relative to the destination directory).
+#
+class TextureConversion:
+	def __init__(self, finish):
+		self.finish = finish
+		self.finished = False
+		self.value = None
+	
+	def result(self):
+		if not self.finished:
+			self.value = self.finish()
+			self.finished = True
+		return self.value
+
+def finishedTextureConversion(value):
+	return TextureConversion(lambda: value)
+
+#
+# Converts textures in the background, at most maxWorkers at a time, so that finding textures,
+# loading fmdl files and building materials don't wait for every texture in turn.
+# Converted files get their final name in TextureConversion.result(), on the calling thread,
+# so that the names don't depend on the order in which conversions finish.
+# finish() waits for all conversions; close() stops the workers and deletes any temporary files left,
+# and must be called in a finally block so that a failed conversion doesn't leave them behind.
+#
+class TextureConverter:
+	def __init__(self, maxWorkers = None):
+		if maxWorkers is None:
+			maxWorkers = textureConversionWorkers
+		self.executor = concurrent.futures.ThreadPoolExecutor(maxWorkers)
+		# Conversions by source texture and destination, so that textures used by several meshes are converted once
+		self.conversions = {}
+		# Base texture conversions by fmdl mesh, as started by startFmdl
+		self.baseTextures = {}
+		self.temporaryFilenames = []
+	
+	def convertTexture(self, sourceDirectory, filename, putInCommonDirectory, faceDirectory, commonDirectory):
+		key = (sourceDirectory, filename, putInCommonDirectory, faceDirectory, commonDirectory)
+		if key not in self.conversions:
+			self.conversions[key] = convertTexture(sourceDirectory, filename, putInCommonDirectory, faceDirectory, commonDirectory, self)
+		return self.conversions[key]
+	
+	#
+	# Converts a texture file to a temporary .dds file in destinationDirectory.
+	# Returns a future of the name of that file, which is None if the conversion failed.
+	#
+	def submit(self, sourceFilename, destinationDirectory, name):
+		# Textures with the same name can be converted at the same time, by this converter or another one,
+		# so each gets its own temporary file, created empty right away to reserve its name
+		(handle, tempFilename) = tempfile.mkstemp(prefix = "temp19to16_%s_" % name, suffix = ".dds", dir = destinationDirectory)
+		os.close(handle)
+		self.temporaryFilenames.append(tempFilename)
+		
+		def convert():
+			destinationFilename = convertTextureFile(sourceFilename, destinationDirectory, os.path.basename(tempFilename))
+			if os.path.getsize(destinationFilename) == 0:
+				os.remove(destinationFilename)
+				invalidateDirectory(destinationDirectory)
+				return None
+			return destinationFilename
+		
+		return self.executor.submit(convert)
+	
+	#
+	# Starts converting the textures the meshes of an fmdl file need.
+	#
+	def startFmdl(self, fmdl, sourceDirectory, faceDirectory, commonDirectory):
+		for mesh in fmdl.meshes:
+			if mesh not in self.baseTextures:
+				self.baseTextures[mesh] = findBaseTexture(mesh, sourceDirectory, faceDirectory, commonDirectory, self)
+	
+	#
+	# Gives every converted texture its final name, so that no temporary files remain.
+	#
+	def finish(self):
+		for conversion in self.conversions.values():
+			conversion.result()
+	
+	def close(self):
+		self.executor.shutdown(wait = True, cancel_futures = True)
+		
+		for tempFilename in self.temporaryFilenames:
+			if os.path.exists(tempFilename):
+				os.remove(tempFilename)
+				invalidateDirectory(os.path.dirname(tempFilename))
+		self.temporaryFilenames = []
+
+def convertTexture(sourceDirectory, filename, putInCommonDirectory, faceDirectory, commonDirectory, textureConverter):
 	def findSourceTexture(basename):
 		ddsFilename = ijoin(sourceDirectory, basename + ".dds")
 		if ddsFilename is not None:
@@ -142,43 +371,50 @@ def convertTexture(sourceDirectory, filename, putInCommonDirectory, faceDirector
 		name = basename[:pos]
 	
 	if re.search("u0[0-9a-zA-Z]{3}[gp]0", name) is not None:
-		tempFilenames = {}
+		kitConversions = {}
 		
 		for i in range(1, 10):
 			kitFilename = re.sub("(u0[0-9a-zA-Z]{3}[pg])0", "\\g<1>%s" % i, name)
 			kitTexture = findSourceTexture(kitFilename)
 			
 			if kitTexture is not None:
-				tempFilename = "temp19to16_%s.dds" % kitFilename
-				convertTextureFile(kitTexture, destinationDirectory, tempFilename)
-				tempFilenames[kitFilename] = ijoin(destinationDirectory, tempFilename)
+				kitConversions[kitFilename] = textureConverter.submit(kitTexture, destinationDirectory, kitFilename)
 		
-		suffix = makeUniqueSuffixForFiles(destinationDirectory, ".dds", tempFilenames)
-		if len(tempFilenames) == 0:
-			finalTextureFilename = None
-		else:
-			finalTextureFilename = "%s%s.dds" % (list(tempFilenames.keys())[0], suffix)
+		def finishKit():
+			tempFilenames = {}
+			for (kitFilename, future) in kitConversions.items():
+				tempFilenames[kitFilename] = future.result()
+			
+			suffix = makeUniqueSuffixForFiles(destinationDirectory, ".dds", tempFilenames)
+			if len(tempFilenames) == 0:
+				finalTextureFilename = None
+			else:
+				finalTextureFilename = "%s%s.dds" % (list(tempFilenames.keys())[0], suffix)
+			
+			return (os.path.join(destinationDirectory, finalTextureFilename), prefix + "%s%s.dds" % (name, suffix))
 		
-		return (os.path.join(destinationDirectory, finalTextureFilename), prefix + "%s%s.dds" % (name, suffix))
+		return TextureConversion(finishKit)
 	else:
 		sourceTexture = findSourceTexture(name)
 		if sourceTexture is None:
-			return (None, None)
+			return finishedTextureConversion((None, None))
 		
-		tempFilename = "temp19to16_%s.dds" % name
-		convertTextureFile(sourceTexture, destinationDirectory, tempFilename)
+		future = textureConverter.submit(sourceTexture, destinationDirectory, name)
 		
-		suffix = makeUniqueSuffixForFiles(destinationDirectory, ".dds", { name : ijoin(destinationDirectory, tempFilename) })
-		finalFilename = "%s%s.dds" % (name, suffix)
+		def finish():
+			suffix = makeUniqueSuffixForFiles(destinationDirectory, ".dds", { name : future.result() })
+			finalFilename = "%s%s.dds" % (name, suffix)
+			
+			return (os.path.join(destinationDirectory, finalFilename), prefix + finalFilename)
 		
-		return (os.path.join(destinationDirectory, finalFilename), prefix + finalFilename)
+		return TextureConversion(finish)
 
 #
 # Given an fmdl texture object and a directory containing the surrounding fmdl file,
-# find a source texture file for it and convert it to a destination texture.
-# Returns (the output texture filename, the .mtl texture path relative to the destination directory).
+# find a source texture file for it and start converting it to a destination texture.
+# Returns a TextureConversion.
 #
-def findTexture(fmdlTexture, sourceDirectory, faceDirectory, commonDirectory):
+def findTexture(fmdlTexture, sourceDirectory, faceDirectory, commonDirectory, textureConverter):
 	def findModelDirectory(parentDirectories, globPattern):
 		for parentDirectory in parentDirectories:
 			if parentDirectory is not None:
@@ -195,22 +431,22 @@ def findTexture(fmdlTexture, sourceDirectory, faceDirectory, commonDirectory):
 	if os.path.basename(sourceDirectory).lower()[0] == 'k':
 		# boots/k0000/something.dds
 		if texturePathComponents[-3].lower() == 'boots':
-			return convertTexture(sourceDirectory, texturePathComponents[-1], False, faceDirectory, commonDirectory)
+			return textureConverter.convertTexture(sourceDirectory, texturePathComponents[-1], False, faceDirectory, commonDirectory)
 	elif os.path.basename(sourceDirectory).lower()[0] == 'g':
 		# glove/g0000/something.dds
 		if texturePathComponents[-3].lower() == 'glove':
-			return convertTexture(sourceDirectory, texturePathComponents[-1], False, faceDirectory, commonDirectory)
+			return textureConverter.convertTexture(sourceDirectory, texturePathComponents[-1], False, faceDirectory, commonDirectory)
 	else:
 		# face/real/00000/sourceimages/something.dds
 		if texturePathComponents[-5].lower() == 'face' and texturePathComponents[-4].lower() == 'real':
-			return convertTexture(sourceDirectory, texturePathComponents[-1], False, faceDirectory, commonDirectory)
+			return textureConverter.convertTexture(sourceDirectory, texturePathComponents[-1], False, faceDirectory, commonDirectory)
 	
 	#
 	# Fail to find global common textures
 	# common/sourceimages/something.dds
 	#
 	if texturePathComponents[-3].lower() == 'common' and texturePathComponents[-2].lower() == 'sourceimages':
-		return (None, None)
+		return finishedTextureConversion((None, None))
 	
 	#
 	# If none of these applies, assume the grandparent of $sourceDirectory is an export directory and work from there.
@@ -252,9 +488,9 @@ def findTexture(fmdlTexture, sourceDirectory, faceDirectory, commonDirectory):
 		# common/000/sourceimages/something.dds
 		
 		if texturePathComponents[-1].lower().startswith('dummy_kit'):
-			return (None, "model/character/uniform/common/XXX/dummy_kit.dds")
+			return finishedTextureConversion((None, "model/character/uniform/common/XXX/dummy_kit.dds"))
 		if texturePathComponents[-1].lower().startswith('dummy_gk_kit'):
-			return (None, "model/character/uniform/common/XXX/dummy_gk_kit.dds")
+			return finishedTextureConversion((None, "model/character/uniform/common/XXX/dummy_gk_kit.dds"))
 		
 		commonFolders = findModelDirectory([grandparentDirectory, parentDirectory], "Common")
 		if len(commonFolders) == 0:
@@ -266,9 +502,9 @@ def findTexture(fmdlTexture, sourceDirectory, faceDirectory, commonDirectory):
 		textureDirectory = None
 	
 	if textureDirectory is None:
-		return (None, None)
+		return finishedTextureConversion((None, None))
 	
-	return convertTexture(textureDirectory, texturePathComponents[-1], isCommonDirectory, faceDirectory, commonDirectory)
+	return textureConverter.convertTexture(textureDirectory, texturePathComponents[-1], isCommonDirectory, faceDirectory, commonDirectory)
 
 def findTextureForRole(fmdlMaterialInstance, roles):
 	for (role, fmdlTexture) in fmdlMaterialInstance.textures:
@@ -276,6 +512,19 @@ def findTextureForRole(fmdlMaterialInstance, roles):
 			return fmdlTexture
 	return None
 
+#
+# Starts converting the base texture of a mesh, if buildMaterial will need it.
+# Returns a TextureConversion, or None.
+#
+def findBaseTexture(mesh, sourceDirectory, faceDirectory, commonDirectory, textureConverter):
+	if mesh.faceCount <= 1 or "fuzzblock" in mesh.materialInstance.shader:
+		return None
+	
+	fmdlBaseTexture = findTextureForRole(mesh.materialInstance, ['Base_Tex_SRGB', 'Base_Tex_LIN'])
+	if fmdlBaseTexture is None:
+		return None
+	return findTexture(fmdlBaseTexture, sourceDirectory, faceDirectory, commonDirectory, textureConverter)
+
 def textureUsesAlphaBlending(texturePath):
 	image = Image.open(texturePath)
 	if image.mode != 'RGBA':
@@ -298,14 +547,13 @@ def textureUsesAlphaBlending(texturePath):
 	#
 	return (blendCount * 10) > (blendCount + oneCount)
 
-def buildDecalMaterial(mesh, sourceDirectory, faceDirectory, commonDirectory):
+def buildDecalMaterial(mesh, baseTexture):
 	# if primary texture is present, map to Basic_C with alpha blending enabled.
 	# if primary texture is missing, delete.
 	
-	fmdlBaseTexture = findTextureForRole(mesh.materialInstance, ['Base_Tex_SRGB', 'Base_Tex_LIN'])
-	if fmdlBaseTexture is None:
+	if baseTexture is None:
 		return None
-	(baseTextureRealFilename, baseTexturePath) = findTexture(fmdlBaseTexture, sourceDirectory, faceDirectory, commonDirectory)
+	(baseTextureRealFilename, baseTexturePath) = baseTexture.result()
 	if baseTexturePath is None:
 		return None
 	
@@ -331,16 +579,18 @@ def buildDecalMaterial(mesh, sourceDirectory, faceDirectory, commonDirectory):
 		},
 	)
 
-def buildMetalMaterial(mesh, baseTexturePath, sourceDirectory, faceDirectory, commonDirectory):
+def buildMetalMaterial(mesh, baseTexturePath, sourceDirectory, faceDirectory, commonDirectory, textureConverter):
 	#
 	# Build an all-grey RoughnessMap
 	#
 	roughnessImage = Image.new('RGBA', (4, 4), (128, 128, 128, 255))
 	roughnessImageFilename = os.path.join(commonDirectory, "metal_roughness.png")
 	roughnessImage.save(roughnessImageFilename)
+	invalidateDirectory(commonDirectory)
 	
-	(roughnessTextureRealFilename, roughnessTexturePath) = convertTexture(commonDirectory, "metal_roughness.png", True, faceDirectory, commonDirectory)
+	(roughnessTextureRealFilename, roughnessTexturePath) = textureConverter.convertTexture(commonDirectory, "metal_roughness.png", True, faceDirectory, commonDirectory).result()
 	os.remove(roughnessImageFilename)
+	invalidateDirectory(commonDirectory)
 	
 	return ModelMaterial(
 		"Basic_CNSR",
@@ -464,16 +714,19 @@ def buildConstantMaterial(mesh, baseTexturePath, sourceDirectory, faceDirectory,
 		},
 	)
 
-def buildMaterial(mesh, fmdlFilename, sourceDirectory, faceDirectory, commonDirectory):
+#
+# baseTexture is the conversion of the base texture of the mesh, as started by findBaseTexture.
+#
+def buildMaterial(mesh, fmdlFilename, baseTexture, sourceDirectory, faceDirectory, commonDirectory, textureConverter):
 	shader = mesh.materialInstance.shader
 	
-	if len(mesh.faces) <= 1:
+	if mesh.faceCount <= 1:
 		return None
 	
 	if "fuzzblock" in shader:
 		return None
 	if "3ddc" in shader or "eyeocclusion" in shader or "translucent" in shader:
-		return buildDecalMaterial(mesh, sourceDirectory, faceDirectory, commonDirectory)
+		return buildDecalMaterial(mesh, baseTexture)
 	
 	fmdlBaseTexture = findTextureForRole(mesh.materialInstance, ['Base_Tex_SRGB', 'Base_Tex_LIN'])
 	if fmdlBaseTexture is None:
@@ -481,13 +734,13 @@ def buildMaterial(mesh, fmdlFilename, sourceDirectory, faceDirectory, commonDire
 		baseTexturePath = "./.dds"
 		baseTextureRealFilename = None
 	else:
-		(baseTextureRealFilename, baseTexturePath) = findTexture(fmdlBaseTexture, sourceDirectory, faceDirectory, commonDirectory)
+		(baseTextureRealFilename, baseTexturePath) = baseTexture.result()
 		if baseTexturePath is None:
 			print("WARNING: missing texture '%s' for fmdl file '%s'" % (fmdlBaseTexture.filename, fmdlFilename))
 			baseTexturePath = "./.dds"
 	
 	if "ggx" in shader:
-		return buildMetalMaterial(mesh, baseTexturePath, sourceDirectory, faceDirectory, commonDirectory)
+		return buildMetalMaterial(mesh, baseTexturePath, sourceDirectory, faceDirectory, commonDirectory, textureConverter)
 	if "glass" in shader:
 		# TODO: Build fancier glass material if this ever comes up
 		return buildTransparentBlinMaterial(mesh, baseTexturePath, sourceDirectory, faceDirectory, commonDirectory)
@@ -548,7 +801,12 @@ def buildMaterialsXml(materialNames):
 	
 	return ElementTree.tostring(materialsElement, encoding = 'utf-8')
 
-def buildMaterials(fmdls, destinationDirectory, commonDestinationDirectory):
+#
+# Textures are converted in the background by textureConverter, which callers can pass
+# to start converting the textures of fmdl files before all of them are loaded;
+# they then have to close it themselves. All textures are converted by the time this returns.
+#
+def buildMaterials(fmdls, destinationDirectory, commonDestinationDirectory, textureConverter = None):
 	class MaterialSource:
 		def __init__(self, mesh, fmdlFilename):
 			self.mesh = mesh
@@ -558,13 +816,26 @@ def buildMaterials(fmdls, destinationDirectory, commonDestinationDirectory):
 	materialSources = {}
 	
 	#
-	# Build a ModelMaterial for each mesh
+	# Start converting all textures, then build a ModelMaterial for each mesh,
+	# waiting only for the textures each material needs
 	#
-	for (fmdlFilename, fmdlDirectory, fmdl) in fmdls:
-		for mesh in fmdl.meshes:
-			material = buildMaterial(mesh, fmdlFilename, fmdlDirectory, destinationDirectory, commonDestinationDirectory)
-			meshMaterials[mesh] = material
-			materialSources[material] = MaterialSource(mesh, fmdlFilename)
+	closeTextureConverter = textureConverter is None
+	if closeTextureConverter:
+		textureConverter = TextureConverter()
+	try:
+		for (fmdlFilename, fmdlDirectory, fmdl) in fmdls:
+			textureConverter.startFmdl(fmdl, fmdlDirectory, destinationDirectory, commonDestinationDirectory)
+		
+		for (fmdlFilename, fmdlDirectory, fmdl) in fmdls:
+			for mesh in fmdl.meshes:
+				material = buildMaterial(mesh, fmdlFilename, textureConverter.baseTextures[mesh], fmdlDirectory, destinationDirectory, commonDestinationDirectory, textureConverter)
+				meshMaterials[mesh] = material
+				materialSources[material] = MaterialSource(mesh, fmdlFilename)
+		
+		textureConverter.finish()
+	finally:
+		if closeTextureConverter:
+			textureConverter.close()
 	
 	#
 	# Determine unique materials
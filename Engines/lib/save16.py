@@ -1,4 +1,5 @@
 import hashlib
+import numpy
 import random
 import struct
 
@@ -17,6 +18,9 @@ effectiveMasterKey = bytes([
 	masterKey[(i & ~7) + 7 - (i & 7)] for i in range(len(masterKey))
 ])
 
+# Bump this when the layout of cached save data changes, so that old cache entries are ignored
+cacheFormatVersion = 1
+
 class ParseError(Exception):
 	pass
 
@@ -78,6 +82,40 @@ class mersenne_rng(object):
 			self.state[i] = self.state[(i+self.m)%624]^temp_shift
 		self.index = 0
 	
+	# Same as twist, on a numpy copy of the state. Every index range below only depends on
+	# state words that the scalar loop would already have updated (or not yet touched) by then.
+	def twist_array(self, state):
+		def mix(start, end, source):
+			temp = (state[start:end] & self.upper_mask) | (state[start + 1 : end + 1] & self.lower_mask)
+			state[start:end] = state[source : source + end - start] ^ (temp >> 1) ^ ((temp & 1) * 0x9908b0df)
+		
+		mix(0, 227, 397)
+		mix(227, 454, 0)
+		mix(454, 623, 227)
+		temp = (state[623] & self.upper_mask) | (state[0] & self.lower_mask)
+		state[623] = state[396] ^ (temp >> 1) ^ ((temp & 1) * 0x9908b0df)
+		self.index = 0
+	
+	# Returns the next count numbers as a numpy uint32 array, same as calling get_random_number count times
+	def get_random_numbers(self, count):
+		state = numpy.array(self.state, dtype = numpy.uint32)
+		output = numpy.empty(count, dtype = numpy.uint32)
+		filled = 0
+		while filled < count:
+			if self.index >= 624:
+				self.twist_array(state)
+			taken = min(624 - self.index, count - filled)
+			output[filled : filled + taken] = state[self.index : self.index + taken]
+			self.index += taken
+			filled += taken
+		self.state = state.tolist()
+		
+		output ^= output >> self.u
+		output ^= (output << self.s) & self.b
+		output ^= (output << self.t) & self.c
+		output ^= output >> self.l
+		return output
+	
 	def get_random_number(self):
 		if self.index >= 624:
 			self.twist()
@@ -100,42 +138,100 @@ class SaveFile:
 		self.payload = None
 		self.serial = None
 	
+	def copy(self):
+		other = SaveFile()
+		other.identifier = bytearray(self.identifier)
+		other.description = bytearray(self.description)
+		other.logo = bytearray(self.logo)
+		other.payload = bytearray(self.payload)
+		other.serial = bytearray(self.serial)
+		return other
+	
+	# Yields the keystream as numpy uint32 arrays of blockSize words each, endlessly
 	@staticmethod
-	def cryptStream(key, length):
+	def cryptStreamBlocks(key, blockSize):
 		foo = struct.unpack('< 16I', key)
 		twister = mersenne_rng(list(foo))
-		output = bytearray(length)
-		
-		c0 = twister.get_random_number()
-		c1 = twister.get_random_number()
-		c2 = twister.get_random_number()
-		c3 = twister.get_random_number()
 		
 		def rol(value, bits):
 			return ((value << bits) & 0xffffffff) | (value >> (32 - bits))
 		def ror(value, bits):
 			return rol(value, 32 - bits)
-		index = 0
-		output = bytearray((length + 3) // 4 * 4)
-		for i in range((length + 3) // 4):
-			c4 = twister.get_random_number()
-			v = c4 ^ c3 ^ c2 ^ c1 ^ c0
+		
+		# Each keystream word mixes the last five random numbers, rotated by an amount that
+		# depends on how many times they have been mixed in already. The rotations only settle
+		# from the fifth word onwards, so the first four words are built one by one.
+		numbers = twister.get_random_numbers(4 + blockSize)
+		(c0, c1, c2, c3) = [int(number) for number in numbers[0:4]]
+		first = numpy.empty(4, dtype = numpy.uint32)
+		for i in range(4):
+			c4 = int(numbers[4 + i])
+			first[i] = c4 ^ c3 ^ c2 ^ c1 ^ c0
 			
 			c0 = ror(c1, 15)
 			c1 = rol(c2, 11)
 			c2 = rol(c3, 7)
 			c3 = ror(c4, 13)
+		
+		while True:
+			block = (
+				  numbers[4:]
+				^ ror(numbers[3:-1], 13)
+				^ ror(numbers[2:-2], 6)
+				^ rol(numbers[1:-3], 5)
+				^ ror(numbers[0:-4], 10)
+			)
+			if first is not None:
+				block[0:4] = first
+				first = None
+			yield block
 			
-			struct.pack_into('<I', output, i * 4, v)
-		return output[0:length]
+			numbers = numpy.concatenate((numbers[-4:], twister.get_random_numbers(blockSize)))
+	
+	@staticmethod
+	def cryptStream(key, length):
+		wordCount = (length + 3) // 4
+		if wordCount == 0:
+			return bytearray()
+		
+		blocks = SaveFile.cryptStreamBlocks(key, max(wordCount, 4))
+		return bytearray(next(blocks)[0:wordCount].astype('<u4').tobytes()[0:length])
+	
+	# XORs the key, repeated as needed, into a writable buffer (bytearray or memoryview)
+	@staticmethod
+	def xorInPlace(buffer, key):
+		output = numpy.frombuffer(buffer, dtype = numpy.uint8)
+		key = numpy.frombuffer(bytes(key), dtype = numpy.uint8)
+		
+		repeats = len(output) // len(key)
+		output[0 : repeats * len(key)].reshape(repeats, len(key))[:] ^= key
+		output[repeats * len(key):] ^= key[0 : len(output) - repeats * len(key)]
 	
 	@staticmethod
 	def xor(data, key):
-		return bytearray([data[i] ^ key[i % len(key)] for i in range(len(data))])
+		output = bytearray(data)
+		SaveFile.xorInPlace(output, key)
+		return output
+	
+	# Encrypts or decrypts a writable buffer, generating the keystream a block at a time
+	@staticmethod
+	def cryptInPlace(key, buffer, blockSize = 0x10000):
+		output = numpy.frombuffer(buffer, dtype = numpy.uint8)
+		wordCount = (len(output) + 3) // 4
+		if wordCount == 0:
+			return
+		
+		blockSize = max(min(wordCount, blockSize), 4)
+		blocks = SaveFile.cryptStreamBlocks(key, blockSize)
+		for offset in range(0, len(output), blockSize * 4):
+			chunk = output[offset : offset + blockSize * 4]
+			chunk ^= next(blocks).astype('<u4').view(numpy.uint8)[0:len(chunk)]
 	
 	@staticmethod
 	def cryptData(key, data):
-		return SaveFile.xor(data, SaveFile.cryptStream(key, len(data)))
+		output = bytearray(data)
+		SaveFile.cryptInPlace(key, output)
+		return output
 	
 	@staticmethod
 	def decryptSalt(salt):
@@ -148,9 +244,36 @@ class SaveFile:
 			decryptedSalt[192:256]),
 			decryptedSalt[256:320])
 	
-	def load(self, filename):
+	# Serializes the decrypted sections, for storing them in a cache
+	def packSections(self):
+		sections = [self.identifier, self.description, self.logo, self.payload, self.serial]
+		return struct.pack('< 5I', *[len(section) for section in sections]) + b''.join(sections)
+	
+	# Restores the sections stored by packSections. Returns False if the data is incomplete.
+	def unpackSections(self, data):
+		if len(data) < 20:
+			return False
+		lengths = struct.unpack('< 5I', data[0:20])
+		if len(data) != 20 + sum(lengths):
+			return False
+		
+		sections = []
+		offset = 20
+		for length in lengths:
+			sections.append(bytearray(data[offset : offset + length]))
+			offset += length
+		(self.identifier, self.description, self.logo, self.payload, self.serial) = sections
+		return True
+	
+	def load(self, filename, cache = None):
 		data = open(filename, 'rb').read()
 		
+		if cache is not None:
+			cacheKey = "save16-%i-%s" % (cacheFormatVersion, hashlib.sha256(data).hexdigest())
+			cachedSections = cache.get(cacheKey)
+			if cachedSections is not None and self.unpackSections(cachedSections):
+				return
+		
 		salt = data[0:320]
 		key = SaveFile.decryptSalt(salt)
 		offset = 320
@@ -175,6 +298,9 @@ class SaveFile:
 		
 		self.serial = SaveFile.cryptData(SaveFile.xor(key, struct.pack('<Q', 3)), data[offset : offset + serialSize * 2])
 		offset += serialSize * 2
+		
+		if cache is not None:
+			cache.put(cacheKey, self.packSections())
 	
 	def save(self, filename):
 		salt = bytes([random.randint(0, 255) for i in range(320)])
@@ -199,43 +325,64 @@ class SaveFile:
 		with open(filename, 'wb') as f:
 			f.write(output)
 
+#
+# Index of the player records in a pes16 save payload, by player ID.
+# Records are returned as memoryviews of the payload, so looking up a player doesn't copy anything,
+# and savePlayers only needs to touch the records of the players being written.
+#
+class PlayerIndex:
+	def __init__(self, save):
+		self.save = save
+		(playerCount, ) = struct.unpack('<H', save[0x36:0x38])
+		self.playerOffsets = indexRecords(save, 0x4c, 112, 0, playerCount)
+		self.aestheticsOffsets = indexRecords(save, 0x2ab9cc, 72, 0, playerCount)
+	
+	def __contains__(self, playerID):
+		return playerID in self.playerOffsets or playerID in self.aestheticsOffsets
+	
+	def __getitem__(self, playerID):
+		if playerID not in self:
+			raise KeyError(playerID)
+		return (
+			self.record(self.playerOffsets, playerID, 112),
+			self.record(self.aestheticsOffsets, playerID, 72),
+		)
+	
+	def record(self, offsets, playerID, size):
+		if playerID not in offsets:
+			return None
+		# Like a plain scan of the table, the last record with this ID wins
+		offset = offsets[playerID][-1]
+		return memoryview(self.save)[offset : offset + size]
+
+#
+# Maps the player ID at idOffset in each record of a table to the offsets of the records with that ID.
+#
+def indexRecords(save, tableOffset, recordSize, idOffset, recordCount):
+	playerIDs = numpy.ndarray((recordCount, ), dtype = '<u4', buffer = save, offset = tableOffset + idOffset, strides = (recordSize, ))
+	offsets = {}
+	for (i, playerID) in enumerate(playerIDs.tolist()):
+		offsets.setdefault(playerID, []).append(tableOffset + recordSize * i)
+	return offsets
+
 def loadPlayers(save):
-	(playerCount, ) = struct.unpack('<H', save[0x36:0x38])
-	
-	playerIDs = set()
-	playerData = {}
-	for i in range(playerCount):
-		data = save[0x4c + 112 * i : 0x4c + 112 * (i + 1)]
-		(playerID, ) = struct.unpack('<I', data[0:4])
-		playerData[playerID] = data
-		playerIDs.add(playerID)
-	
-	playerAestheticsData = {}
-	for i in range(playerCount):
-		data = save[0x2ab9cc + 72 * i : 0x2ab9cc + 72 * (i + 1)]
-		(playerID, ) = struct.unpack('<I', data[0:4])
-		playerAestheticsData[playerID] = data
-		playerIDs.add(playerID)
-	
-	return { playerID: (playerData.get(playerID), playerAestheticsData.get(playerID)) for playerID in playerIDs }
+	return PlayerIndex(save)
 
-def savePlayers(save, players):
-	(playerCount, ) = struct.unpack('<H', save[0x36:0x38])
-	
-	for i in range(playerCount):
-		data = save[0x4c + 112 * i : 0x4c + 112 * (i + 1)]
-		(playerID, ) = struct.unpack('<I', data[0:4])
-		if playerID in players:
-			(playerData, playerAestheticsData) = players.get(playerID)
-			if playerData is not None:
+#
+# Writes players into a save payload. index can be the PlayerIndex of this payload,
+# or of any other payload with the same player table layout, such as the one it was copied from.
+#
+def savePlayers(save, players, index = None):
+	if index is None:
+		index = PlayerIndex(save)
+	
+	for (playerID, (playerData, playerAestheticsData)) in players.items():
+		if playerData is not None:
+			for offset in index.playerOffsets.get(playerID, []):
 				assert len(playerData) == 112, "Invalid player data block"
-				save[0x4c + 112 * i : 0x4c + 112 * (i + 1)] = playerData
-	
-	for i in range(playerCount):
-		data = save[0x2ab9cc + 72 * i : 0x2ab9cc + 72 * (i + 1)]
-		(playerID, ) = struct.unpack('<I', data[0:4])
-		if playerID in players:
-			(playerData, playerAestheticsData) = players.get(playerID)
-			if playerAestheticsData is not None:
+				save[offset : offset + 112] = playerData
+		
+		if playerAestheticsData is not None:
+			for offset in index.aestheticsOffsets.get(playerID, []):
 				assert len(playerAestheticsData) == 72, "Invalid player aesthetics data block"
-				save[0x2ab9cc + 72 * i : 0x2ab9cc + 72 * (i + 1)] = playerAestheticsData
+				save[offset : offset + 72] = playerAestheticsData
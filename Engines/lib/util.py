@@ -1,16 +1,71 @@
 import fnmatch
 import os
 
+#
+# Snapshots of directory trees, so that ijoin and iglob don't need to list every directory again
+# on every lookup. indexDirectoryTree lists all directories of a tree in one walk; after that,
+# ijoin and iglob look up paths in that tree in memory, by lower-cased name.
+# Code that creates, renames or removes files in an indexed tree must call invalidateDirectory
+# on the directory containing them, so that it gets listed again on the next lookup.
+# Lookups outside of indexed trees list directories as they always did.
+#
+class DirectoryListing:
+	def __init__(self, names):
+		self.names = names
+		self.namesByLowerCase = {}
+		for name in names:
+			self.namesByLowerCase.setdefault(name.lower(), name)
+
+indexedRoots = set()
+directoryListings = {}
+
+def directoryKey(directory):
+	return os.path.normcase(os.path.abspath(directory))
+
+def isIndexed(key):
+	while key not in indexedRoots:
+		parent = os.path.dirname(key)
+		if parent == key:
+			return False
+		key = parent
+	return True
+
+def indexDirectoryTree(root):
+	def walk(directory):
+		names = []
+		with os.scandir(directory) as entries:
+			for entry in entries:
+				names.append(entry.name)
+				# Symlinked directories are listed when they are first looked up instead
+				if entry.is_dir(follow_symlinks = False):
+					walk(entry.path)
+		directoryListings[directoryKey(directory)] = DirectoryListing(names)
+	
+	walk(root)
+	indexedRoots.add(directoryKey(root))
+
+def invalidateDirectory(directory):
+	directoryListings.pop(directoryKey(directory), None)
+
+def listDirectory(directory):
+	key = directoryKey(directory)
+	listing = directoryListings.get(key)
+	if listing is None:
+		listing = DirectoryListing(os.listdir(directory))
+		if isIndexed(key):
+			directoryListings[key] = listing
+	return listing
+
 def ijoin(directory, filename):
 	parts = filename.split('/')
 	for part in parts:
 		if part == '.':
 			continue
-		items = [os.path.join(directory, f) for f in os.listdir(directory) if f.lower() == part.lower()]
-		if len(items) == 0:
+		name = listDirectory(directory).namesByLowerCase.get(part.lower())
+		if name is None:
 			return None
 		else:
-			directory = items[0]
+			directory = os.path.join(directory, name)
 	return directory
 
 def iglob(directory, pattern):
@@ -21,7 +76,6 @@ def iglob(directory, pattern):
 			continue
 		nextMatches = []
 		for match in matches:
-			nextMatches += [os.path.join(match, f) for f in os.listdir(match) if fnmatch.fnmatch(f.lower(), part.lower())]
+			nextMatches += [os.path.join(match, f) for f in listDirectory(match).names if fnmatch.fnmatch(f.lower(), part.lower())]
 		matches = nextMatches
 	return matches
-
@@ -4,5 +4,5 @@ REM ^ Don't write everything to screen
 REM - Set the working folder
 cd /D "%~dp0"
 
-REM - Call the runner
-.\Engines\converter_run 0
+REM - Call the runner, passing along any options (e.g. --jobs 4)
+.\Engines\converter_run 0 %*